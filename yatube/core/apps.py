@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.cache import caches
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def clear_caches(**kwargs):
+    # общий кеш переживает перезапуск и может помнить данные,
+    # которых после миграции или пересоздания базы уже нет
+    for alias in settings.CACHES:
+        caches[alias].clear()
 
 
 class CoreConfig(AppConfig):
     name = "core"
+
+    def ready(self):
+        from . import slowlog
+        connection_created.connect(slowlog.install)
+        post_migrate.connect(clear_caches, sender=self)
@@ -0,0 +1,16 @@
+"""
+SQLite, в котором транзакция сразу берёт блокировку на запись.
+
+Обычный BEGIN откладывает блокировку до первой записи. Если транзакция
+уже читала, а базу в это время пишет другое соединение, SQLite не ждёт
+busy timeout и сразу отвечает «database is locked»: ожидание могло бы
+закончиться взаимной блокировкой. BEGIN IMMEDIATE берёт блокировку
+в начале transaction.atomic, и конкурирующие записи ждут друг друга
+до OPTIONS["timeout"] секунд.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
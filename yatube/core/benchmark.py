@@ -0,0 +1,327 @@
+"""
+Синтетические данные и замеры страниц для бенчмарков.
+
+Seeder наполняет базу пользователями, группами, постами с картинками,
+комментариями и подписками заданного масштаба. Авторство, подписки
+и комментарии распределены по закону Ципфа: немногие авторы пишут
+и собирают подписчиков больше всех, как на живом сайте.
+Производные данные (счётчики, ленты, ссылки на картинки) пересобираются
+теми же функциями, что и командами rebuild_*.
+"""
+import itertools
+import json
+import math
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from faker import Faker
+from mixer.backend.django import Mixer
+from PIL import Image
+
+from posts import counters, images, timeline
+from posts.importer import bulk_insert
+from posts.models import Comment, Follow, Group, Post
+from posts.utils import chunked
+
+from .queries import QueryLog
+
+User = get_user_model()
+
+SCALES = {
+    "10k": {
+        "users": 1_000, "groups": 20, "posts": 10_000,
+        "comments": 20_000, "follows": 20_000,
+    },
+    "100k": {
+        "users": 10_000, "groups": 50, "posts": 100_000,
+        "comments": 200_000, "follows": 200_000,
+    },
+    "1m": {
+        "users": 50_000, "groups": 200, "posts": 1_000_000,
+        "comments": 2_000_000, "follows": 1_000_000,
+    },
+}
+USERNAME_PREFIX = "bench"
+# доля постов с картинкой и сколько разных картинок на них приходится
+IMAGE_SHARE = 0.1
+IMAGE_VARIETY = 50
+GROUP_SHARE = 0.7
+HISTORY = timedelta(days=3 * 365)
+TEXTS = 500
+
+
+def zipf_weights(count, exponent=1.1):
+    """Накопленные веса рангов 1..count для random.choices."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+class Seeder:
+    def __init__(self, scale, seed=0, batch_size=5000, log=None):
+        self.counts = SCALES[scale] if isinstance(scale, str) else scale
+        self.random = random.Random(seed)
+        Faker.seed(seed)
+        self.mixer = Mixer(commit=False, locale="ru")
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def run(self):
+        started = time.perf_counter()
+        with transaction.atomic():
+            users = self.create_users()
+            groups = self.create_groups()
+            pictures = self.create_images()
+            posts = self.create_posts(users, groups, pictures)
+            self.create_follows(users)
+            self.create_comments(users, posts)
+            self.update_derived()
+        self.log(f"Готово за {time.perf_counter() - started:.1f} с")
+
+    def step(self, name, model, objects, dates=(), **options):
+        count = 0
+        for batch in chunked(objects, self.batch_size):
+            if dates:
+                bulk_insert(model, batch, self.batch_size, dates)
+            else:
+                model.objects.bulk_create(batch, **options)
+            count += len(batch)
+        self.log(f"{name}: {count}")
+
+    def create_users(self):
+        first = User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).count()
+        password = make_password(None)
+        self.step("Пользователи", User, (
+            self.mixer.blend(
+                User,
+                username=f"{USERNAME_PREFIX}{number}",
+                password=password,
+            )
+            for number in range(first, first + self.counts["users"])
+        ))
+        return list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX)
+            .order_by("id").values_list("id", flat=True)
+        )
+
+    def create_groups(self):
+        first = Group.objects.count()
+        self.step("Группы", Group, (
+            self.mixer.blend(Group, slug=f"{USERNAME_PREFIX}-{number}")
+            for number in range(first, first + self.counts["groups"])
+        ))
+        return list(Group.objects.order_by("id").values_list("id", flat=True))
+
+    def create_images(self):
+        storage = images.storage()
+        upload_to = Post._meta.get_field("image").upload_to
+        names = []
+        for number in range(IMAGE_VARIETY):
+            color = tuple(self.random.randrange(256) for _ in range(3))
+            buffer = BytesIO()
+            Image.new("RGB", (1200, 424), color).save(buffer, "JPEG")
+            names.append(storage.save(
+                f"{upload_to}bench.jpg", ContentFile(buffer.getvalue())
+            ))
+        self.log(f"Картинки: {len(names)}")
+        return names
+
+    def create_posts(self, users, groups, pictures):
+        count = self.counts["posts"]
+        texts = [
+            self.mixer.faker.text(self.random.randint(100, 600))
+            for _ in range(TEXTS)
+        ]
+        # самые активные авторы — не обязательно самые популярные
+        writers = users[:]
+        self.random.shuffle(writers)
+        authors = self.random.choices(
+            writers, cum_weights=zipf_weights(len(users)), k=count
+        )
+        group_weights = zipf_weights(len(groups))
+        step = HISTORY / count
+        start = self.now - HISTORY
+        last = Post.objects.order_by("-id").values_list("id", flat=True)
+        last = last.first() or 0
+
+        def posts():
+            for number, author_id in enumerate(authors):
+                group_id = None
+                if self.random.random() < GROUP_SHARE:
+                    group_id = self.random.choices(
+                        groups, cum_weights=group_weights
+                    )[0]
+                image = None
+                if self.random.random() < IMAGE_SHARE:
+                    image = self.random.choice(pictures)
+                yield Post(
+                    author_id=author_id,
+                    group_id=group_id,
+                    text=self.random.choice(texts),
+                    image=image,
+                    # посты идут по времени, как и их id
+                    pub_date=start + step * (number + self.random.random()),
+                )
+
+        self.step("Посты", Post, posts(), dates=["pub_date"])
+        return list(
+            Post.objects.filter(id__gt=last).order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    def create_follows(self, users):
+        weights = zipf_weights(len(users))
+        pairs = set()
+        for _ in range(self.counts["follows"]):
+            user_id = self.random.choice(users)
+            author_id = self.random.choices(users, cum_weights=weights)[0]
+            if user_id != author_id:
+                pairs.add((user_id, author_id))
+        self.step("Подписки", Follow, (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in pairs
+        ), ignore_conflicts=True)
+
+    def create_comments(self, users, posts):
+        count = len(posts)
+        # обсуждают в основном немногие посты, разбросанные по времени
+        ranked = posts[:]
+        self.random.shuffle(ranked)
+        position = {post_id: number for number, post_id in enumerate(posts)}
+        weights = zipf_weights(count)
+        step = HISTORY / count
+        start = self.now - HISTORY
+        texts = [self.mixer.faker.sentence() for _ in range(TEXTS)]
+
+        def comments():
+            for _ in range(self.counts["comments"]):
+                post_id = self.random.choices(ranked, cum_weights=weights)[0]
+                # комментарий оставлен между публикацией поста и сейчас
+                number = position[post_id]
+                delay = self.random.random() * (count - number)
+                yield Comment(
+                    post_id=post_id,
+                    author_id=self.random.choice(users),
+                    text=self.random.choice(texts),
+                    created=start + step * (number + 1 + delay),
+                )
+
+        self.step("Комментарии", Comment, comments(), dates=["created"])
+
+    def update_derived(self):
+        counters.rebuild()
+        timeline.rebuild()
+        images.rebuild()
+        cache.clear()
+        self.log("Счётчики, ленты и ссылки на картинки пересобраны")
+
+
+def percentile(samples, percent):
+    """Перцентиль по ближайшему рангу; samples отсортированы."""
+    rank = max(1, math.ceil(percent / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+def request(client, path, params):
+    response = client.get(path, params)
+    if response.streaming:
+        b"".join(response.streaming_content)
+    return response
+
+
+def measure(client, path, params=None, iterations=20, cold=False,
+            login=None):
+    """
+    Задержка, число запросов и пик памяти одной страницы. Каждый
+    запрос откатывается, чтобы подписки и выходы из аккаунта
+    не меняли данные следующих замеров.
+    """
+    timings, queries = [], []
+
+    def one():
+        if login is not None:
+            client.force_login(login)
+        if cold:
+            cache.clear()
+        with transaction.atomic():
+            with QueryLog() as log:
+                started = time.perf_counter()
+                response = request(client, path, params)
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return response, elapsed, len(log)
+
+    one()
+    for _ in range(iterations):
+        response, elapsed, count = one()
+        timings.append(elapsed * 1000)
+        queries.append(count)
+    # tracemalloc замедляет выполнение, поэтому память — отдельным запросом
+    tracemalloc.start()
+    try:
+        one()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        "status": response.status_code,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "queries": statistics.median_low(queries),
+        "memory_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Строки сравнения с базовыми результатами и число регрессий:
+    p95 выросла больше чем на threshold процентов или прибавились запросы.
+    """
+    lines, regressions = [], 0
+    for name, current in results["views"].items():
+        before = baseline["views"].get(name)
+        if before is None:
+            lines.append(f"{name}: нет в базовых результатах")
+            continue
+        change = (
+            (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            if before["p95_ms"] else 0
+        )
+        slower = change > threshold
+        more_queries = current["queries"] > before["queries"]
+        mark = "РЕГРЕССИЯ " if slower or more_queries else ""
+        regressions += slower or more_queries
+        lines.append(
+            f"{mark}{name}: p95 {before['p95_ms']} -> {current['p95_ms']} мс "
+            f"({change:+.0f}%), запросов {before['queries']} -> "
+            f"{current['queries']}"
+        )
+    return lines, regressions
+
+
+def load(path):
+    with open(path, encoding="utf-8") as stream:
+        return json.load(stream)
+
+
+def dump(results, path):
+    with open(path, "w", encoding="utf-8") as stream:
+        json.dump(results, stream, ensure_ascii=False, indent=2,
+                  sort_keys=True)
+        stream.write("\n")
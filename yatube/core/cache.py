@@ -0,0 +1,435 @@
+"""
+Двухуровневый кеш, общий для всех процессов сервера без внешних служб.
+
+L2 — файл SQLite (LOCATION) в режиме WAL: его видят все процессы,
+поэтому страница, закешированная одним процессом, отдаётся и другими.
+L1 — LRU в памяти процесса, ограниченный L1_MAX_BYTES, с уже
+сериализованными значениями; повторные чтения не доходят до файла.
+
+Любая запись в L2 добавляет строку в журнал changes. Перед чтением
+процесс сверяет PRAGMA data_version — меняется, только когда в файл
+писало другое соединение, — и лишь тогда читает журнал и выбрасывает
+из L1 ключи, изменённые другими процессами. Размер L2 ограничен
+MAX_ENTRIES: раз в CULL_EVERY записей процесс удаляет просроченные
+ключи и, если их всё ещё больше, 1/CULL_FREQUENCY самых старых записей.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT,
+    origin TEXT NOT NULL
+);
+"""
+# сколько записей журнала изменений хранить; отставший процесс
+# очищает L1 целиком
+CHANGES_KEEP = 10000
+CULL_EVERY = 100
+# у SQLite ограничено число параметров запроса
+BATCH = 500
+
+_stores = {}
+_stores_lock = threading.Lock()
+_all_stores = weakref.WeakSet()
+# соединения родителя: закрывать их в потомке нельзя, SQLite снимет
+# блокировки файла, которые держит родитель
+_inherited = []
+
+
+def _reset_stores():
+    global _stores_lock
+    _stores_lock = threading.Lock()
+    for store in list(_all_stores):
+        store.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_stores)
+
+
+class Store:
+    """L1 и соединения с L2 одного файла, общие для потоков процесса."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.reset()
+        _all_stores.add(self)
+
+    def reset(self):
+        """
+        Начинает с чистого листа. Вызывается и в потомке после fork:
+        кеши Django держат ссылку на Store, поэтому он сбрасывается
+        на месте, а потомок получает своё имя в журнале изменений.
+        """
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            _inherited.append(db)
+        self.memory = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = uuid.uuid4().hex
+        self.writes = 0
+        self.last_change = None
+        # растёт при каждой записи и инвалидации L1: прочитанное из L2
+        # не кладётся в L1, если ключ могли изменить, пока его читали
+        self.epoch = 0
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self.local.db = db
+            self.local.data_version = None
+            with self.lock:
+                if self.last_change is None:
+                    self.last_change = db.execute(
+                        "SELECT COALESCE(MAX(id), 0) FROM changes"
+                    ).fetchone()[0]
+        return db
+
+    def sync(self, db):
+        """Выбрасывает из L1 ключи, изменённые другими процессами."""
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.local.data_version:
+            return
+        self.local.data_version = version
+        with self.lock:
+            first = db.execute("SELECT MIN(id) FROM changes").fetchone()[0]
+            if first is not None and first > self.last_change + 1:
+                self.clear_memory()
+            rows = db.execute(
+                "SELECT id, key, origin FROM changes WHERE id > ? "
+                "ORDER BY id",
+                (self.last_change,),
+            ).fetchall()
+            for change, key, origin in rows:
+                self.last_change = change
+                if origin == self.origin:
+                    continue
+                if key is None:
+                    self.clear_memory()
+                else:
+                    self.forget(key)
+
+    def remember(self, key, pickled, expires, epoch=None):
+        """
+        Кладёт значение в L1. Прочитанное из L2 передаёт epoch на момент
+        чтения и не кладётся, если с тех пор L1 менялся.
+        """
+        with self.lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            self.forget(key)
+            if len(pickled) > self.max_bytes:
+                return
+            self.memory[key] = (pickled, expires)
+            self.size += len(pickled)
+            while self.size > self.max_bytes:
+                _, (old, _) = self.memory.popitem(last=False)
+                self.size -= len(old)
+
+    def recall(self, key):
+        with self.lock:
+            found = self.memory.get(key)
+            if found is None:
+                return None
+            if found[1] is not None and found[1] <= time.time():
+                self.forget(key)
+                return None
+            self.memory.move_to_end(key)
+            return found
+
+    def forget(self, key):
+        self.epoch += 1
+        found = self.memory.pop(key, None)
+        if found is not None:
+            self.size -= len(found[0])
+
+    def clear_memory(self):
+        self.epoch += 1
+        self.memory.clear()
+        self.size = 0
+
+
+def store_for(path, max_bytes):
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = Store(path, max_bytes)
+        return store
+
+
+class TwoLevelCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.store = store_for(
+            location, options.get("L1_MAX_BYTES", 64 * 1024 * 1024)
+        )
+
+    def key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def db(self):
+        db = self.store.connection()
+        self.store.sync(db)
+        return db
+
+    def write(self, db, statements):
+        """
+        Выполняет запись в L2 одной транзакцией с записью в журнал.
+        L1 меняется внутри неё: писатели идут по одному, и порядок
+        записей в L1 совпадает с порядком в L2.
+        """
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(db)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            # L1 мог уже получить незаписанное значение
+            with self.store.lock:
+                self.store.clear_memory()
+            raise
+        return result
+
+    def log(self, db, keys):
+        db.executemany(
+            "INSERT INTO changes (key, origin) VALUES (?, ?)",
+            [(key, self.store.origin) for key in keys],
+        )
+
+    def fetch(self, db, keys):
+        """{ключ: (pickled, expires)} живых записей L2."""
+        now = time.time()
+        found = {}
+        for start in range(0, len(keys), BATCH):
+            batch = keys[start:start + BATCH]
+            marks = ",".join("?" * len(batch))
+            for key, pickled, expires in db.execute(
+                f"SELECT key, value, expires FROM cache "
+                f"WHERE key IN ({marks})",
+                batch,
+            ):
+                if expires is None or expires > now:
+                    found[key] = (pickled, expires)
+        return found
+
+    def get(self, key, default=None, version=None):
+        key = self.key(key, version)
+        found = self.get_raw([key]).get(key)
+        if found is None:
+            return default
+        return pickle.loads(found[0])
+
+    def get_many(self, keys, version=None):
+        made = {self.key(key, version): key for key in keys}
+        found = self.get_raw(list(made))
+        return {
+            made[key]: pickle.loads(pickled)
+            for key, (pickled, _) in found.items()
+        }
+
+    def get_raw(self, keys):
+        db = self.db()
+        epoch = self.store.epoch
+        found = {}
+        missing = []
+        for key in keys:
+            entry = self.store.recall(key)
+            if entry is None:
+                missing.append(key)
+            else:
+                found[key] = entry
+        if missing:
+            fetched = self.fetch(db, missing)
+            for key, (pickled, expires) in fetched.items():
+                self.store.remember(key, pickled, expires, epoch)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [
+            (self.key(key, version),
+             pickle.dumps(value, self.pickle_protocol), expires)
+            for key, value in data.items()
+        ]
+        db = self.db()
+
+        def statements(db):
+            db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            self.log(db, [key for key, _, _ in rows])
+            for key, pickled, expires in rows:
+                self.store.remember(key, pickled, expires)
+
+        self.write(db, statements)
+        self.written(db, len(rows))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        expires = self.get_backend_timeout(timeout)
+        db = self.db()
+
+        def statements(db):
+            if self.fetch(db, [key]):
+                return False
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) "
+                "VALUES (?, ?, ?)",
+                (key, pickled, expires),
+            )
+            self.log(db, [key])
+            self.store.remember(key, pickled, expires)
+            return True
+
+        added = self.write(db, statements)
+        if added:
+            self.written(db, 1)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        key = self.key(key, version)
+        db = self.db()
+
+        def statements(db):
+            found = self.fetch(db, [key]).get(key)
+            if found is None:
+                return missing
+            value = pickle.loads(found[0]) + delta
+            pickled = pickle.dumps(value, self.pickle_protocol)
+            db.execute(
+                "UPDATE cache SET value = ? WHERE key = ?", (pickled, key)
+            )
+            self.log(db, [key])
+            self.store.remember(key, pickled, found[1])
+            return value
+
+        missing = object()
+        value = self.write(db, statements)
+        if value is missing:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        expires = self.get_backend_timeout(timeout)
+        db = self.db()
+
+        def statements(db):
+            updated = db.execute(
+                "UPDATE cache SET expires = ? WHERE key = ? "
+                "AND (expires IS NULL OR expires > ?)",
+                (expires, key, time.time()),
+            ).rowcount
+            if updated:
+                self.log(db, [key])
+            with self.store.lock:
+                self.store.forget(key)
+            return bool(updated)
+
+        return self.write(db, statements)
+
+    def has_key(self, key, version=None):
+        key = self.key(key, version)
+        return key in self.get_raw([key])
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.key(key, version) for key in keys]
+        db = self.db()
+
+        def statements(db):
+            db.executemany(
+                "DELETE FROM cache WHERE key = ?", [(key,) for key in keys]
+            )
+            self.log(db, keys)
+            with self.store.lock:
+                for key in keys:
+                    self.store.forget(key)
+
+        self.write(db, statements)
+
+    def clear(self):
+        db = self.db()
+
+        def statements(db):
+            db.execute("DELETE FROM cache")
+            # пустой ключ в журнале — очистить L1 целиком
+            self.log(db, [None])
+            with self.store.lock:
+                self.store.clear_memory()
+
+        self.write(db, statements)
+
+    def written(self, db, count):
+        with self.store.lock:
+            self.store.writes += count
+            if self.store.writes < CULL_EVERY:
+                return
+            self.store.writes = 0
+        self.write(db, self.cull)
+
+    def cull(self, db):
+        db.execute(
+            "DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?",
+            (time.time(),),
+        )
+        db.execute(
+            "DELETE FROM changes WHERE id <= "
+            "(SELECT MAX(id) FROM changes) - ?",
+            (CHANGES_KEEP,),
+        )
+        count = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            db.execute("DELETE FROM cache")
+            return
+        # rowid растёт при каждой перезаписи: первыми уходят
+        # давно не записанные ключи
+        db.execute(
+            "DELETE FROM cache WHERE rowid IN "
+            "(SELECT rowid FROM cache ORDER BY rowid LIMIT ?)",
+            (max(count - self._max_entries,
+                 count // self._cull_frequency),),
+        )
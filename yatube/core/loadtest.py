@@ -0,0 +1,396 @@
+"""
+Нагрузочный тест: смесь чтений и записей через WSGI-приложение в одном
+процессе, из пула потоков или процессов.
+
+Каждый рабочий выбирает действие по весам смеси, выполняет запрос
+через yatube.wsgi.application и «думает» экспоненциально
+распределённое время. Собираются задержки по действиям, ответы 5xx,
+ошибки «database is locked» и попадания в кеш по видам ключей.
+Записи (посты, комментарии, подписки) остаются в базе: запускайте
+на копии, наполненной seed_benchmark.
+"""
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connections
+from django.http import HttpRequest
+from django.middleware.csrf import get_token
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import Group, Post
+
+from .benchmark import percentile
+
+User = get_user_model()
+
+DEFAULT_MIX = {
+    "index": 30, "group": 15, "profile": 15, "post": 20, "follow_index": 10,
+    "create": 3, "comment": 5, "follow": 2,
+}
+WRITES = {"create", "comment", "follow"}
+# доля чтений от анонимов: им страницы отдаются из кеша целиком
+ANONYMOUS_SHARE = 0.5
+SAMPLE = 1000
+KEY_KIND = re.compile(r"[a-z\-]+")
+
+_current = threading.local()
+
+
+def parse_mix(text):
+    """«index=30,create=5» -> {"index": 30, "create": 5}."""
+    mix = {}
+    for part in filter(None, text.split(",")):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"неизвестное действие {name!r}")
+        mix[name] = float(weight)
+        if mix[name] < 0:
+            raise ValueError(f"отрицательный вес у {name!r}")
+    if not any(mix.values()):
+        raise ValueError("в смеси нет действий с ненулевым весом")
+    return mix
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.statuses = Counter()
+        self.exceptions = Counter()
+        self.locked = 0
+        self.cache = defaultdict(Counter)
+
+    def request(self, action, status, elapsed):
+        self.latencies[action].append(elapsed * 1000)
+        self.statuses[status // 100 * 100] += 1
+        if status >= 400:
+            self.errors[action] += 1
+
+    def exception(self, error):
+        self.exceptions[type(error).__name__] += 1
+        if isinstance(error, OperationalError) and "locked" in str(error):
+            self.locked += 1
+
+    def cache_lookup(self, key, hit):
+        match = KEY_KIND.match(str(key))
+        kind = match.group() if match else "other"
+        self.cache[kind]["hits" if hit else "misses"] += 1
+
+    def as_dict(self):
+        return {
+            "latencies": dict(self.latencies),
+            "errors": dict(self.errors),
+            "statuses": dict(self.statuses),
+            "exceptions": dict(self.exceptions),
+            "locked": self.locked,
+            "cache": {kind: dict(counts)
+                      for kind, counts in self.cache.items()},
+        }
+
+
+def merge(parts):
+    """Сводит результаты рабочих (as_dict) в один отчёт."""
+    latencies = defaultdict(list)
+    total = {"errors": Counter(), "statuses": Counter(),
+             "exceptions": Counter(), "locked": 0}
+    cache = defaultdict(Counter)
+    for part in parts:
+        for action, samples in part["latencies"].items():
+            latencies[action].extend(samples)
+        for name in ("errors", "statuses", "exceptions"):
+            total[name].update(part[name])
+        total["locked"] += part["locked"]
+        for kind, counts in part["cache"].items():
+            cache[kind].update(counts)
+    return latencies, total, cache
+
+
+def summarize(parts, elapsed):
+    latencies, total, cache = merge(parts)
+    requests = sum(len(samples) for samples in latencies.values())
+
+    def timing(samples):
+        samples = sorted(samples)
+        return {
+            "requests": len(samples),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+        }
+
+    actions = {}
+    for action, samples in sorted(latencies.items()):
+        actions[action] = timing(samples)
+        actions[action]["errors"] = total["errors"][action]
+    every = [sample for samples in latencies.values() for sample in samples]
+    cache_rates = {}
+    for kind, counts in sorted(cache.items()):
+        lookups = counts["hits"] + counts["misses"]
+        cache_rates[kind] = {
+            "lookups": lookups,
+            "hit_rate": round(counts["hits"] / lookups, 3),
+        }
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0,
+        "overall": timing(every) if every else {"requests": 0},
+        "actions": actions,
+        "statuses": {str(status): count
+                     for status, count in sorted(total["statuses"].items())},
+        "exceptions": dict(total["exceptions"]),
+        "database_locked": total["locked"],
+        "cache": cache_rates,
+    }
+
+
+def recorded_exception(sender, request=None, **kwargs):
+    # вызывается из обработчика исключения, поэтому оно ещё доступно
+    stats = getattr(_current, "stats", None)
+    error = sys.exc_info()[1]
+    if stats is not None and error is not None:
+        stats.exception(error)
+
+
+@contextmanager
+def instrumented():
+    """Счётчики исключений запросов и обращений к кешу по видам ключей."""
+    backend = type(caches["default"])
+    get, get_many = backend.get, backend.get_many
+    missing = object()
+
+    def counted_get(self, key, default=None, version=None):
+        value = get(self, key, missing, version=version)
+        stats = getattr(_current, "stats", None)
+        if stats is not None and not getattr(_current, "in_many", False):
+            stats.cache_lookup(key, value is not missing)
+        return default if value is missing else value
+
+    def counted_get_many(self, keys, version=None):
+        keys = list(keys)
+        # get_many по умолчанию сводится к get: не считать дважды
+        _current.in_many = True
+        try:
+            found = get_many(self, keys, version=version)
+        finally:
+            _current.in_many = False
+        stats = getattr(_current, "stats", None)
+        if stats is not None:
+            for key in keys:
+                stats.cache_lookup(key, key in found)
+        return found
+
+    got_request_exception.connect(recorded_exception)
+    try:
+        with mock.patch.object(backend, "get", counted_get), \
+                mock.patch.object(backend, "get_many", counted_get_many):
+            yield
+    finally:
+        got_request_exception.disconnect(recorded_exception)
+
+
+class Target:
+    """Что запрашивать: посты, авторы, группы и сессии пользователей."""
+
+    def __init__(self, users=50, seed=0):
+        rng = random.Random(seed)
+        self.post_ids = list(
+            Post.objects.order_by("-id").values_list("id", flat=True)[
+                :SAMPLE
+            ]
+        )
+        self.usernames = list(
+            User.objects.filter(posts__isnull=False).distinct()
+            .values_list("username", flat=True)[:SAMPLE]
+        )
+        self.slugs = list(
+            Group.objects.values_list("slug", flat=True)[:SAMPLE]
+        )
+        if not (self.post_ids and self.usernames and self.slugs):
+            raise ValueError("нет постов, авторов или групп")
+        readers = list(
+            User.objects.order_by("id").values_list("id", flat=True)[
+                :SAMPLE
+            ]
+        )
+        self.sessions = [
+            self.login(user_id)
+            for user_id in rng.sample(readers, min(users, len(readers)))
+        ]
+
+    def login(self, user_id):
+        client = Client()
+        client.force_login(User.objects.get(pk=user_id))
+        request = HttpRequest()
+        token = get_token(request)
+        cookies = "; ".join([
+            f"{settings.SESSION_COOKIE_NAME}="
+            f"{client.cookies[settings.SESSION_COOKIE_NAME].value}",
+            f"{settings.CSRF_COOKIE_NAME}={request.META['CSRF_COOKIE']}",
+        ])
+        return {"cookies": cookies, "csrf": token}
+
+
+def environ(method, path, session=None, data=None):
+    body = urlencode(data or {}).encode()
+    env = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": "localhost",
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if session is not None:
+        env["HTTP_COOKIE"] = session["cookies"]
+        env["HTTP_X_CSRFTOKEN"] = session["csrf"]
+    return env
+
+
+class Worker:
+    def __init__(self, application, target, mix, think_ms, seed):
+        self.application = application
+        self.target = target
+        self.actions = list(mix)
+        self.weights = list(mix.values())
+        self.think = think_ms / 1000
+        self.random = random.Random(seed)
+        self.stats = Stats()
+
+    def plan(self, action):
+        """Метод, адрес и данные запроса действия."""
+        pick = self.random.choice
+        target = self.target
+        if action == "index":
+            return "GET", reverse("posts:home_page"), None
+        if action == "group":
+            return "GET", reverse("posts:group_posts", args=[
+                pick(target.slugs)
+            ]), None
+        if action == "profile":
+            return "GET", reverse("posts:profile", args=[
+                pick(target.usernames)
+            ]), None
+        if action == "post":
+            return "GET", reverse("posts:post_detail", args=[
+                pick(target.post_ids)
+            ]), None
+        if action == "follow_index":
+            return "GET", reverse("posts:follow_index"), None
+        if action == "create":
+            return "POST", reverse("posts:post_create"), {
+                "text": f"Пост под нагрузкой {self.random.random()}"
+            }
+        if action == "comment":
+            return "POST", reverse("posts:add_comment", args=[
+                pick(target.post_ids)
+            ]), {"text": "Комментарий под нагрузкой"}
+        name = pick(["posts:profile_follow", "posts:profile_unfollow"])
+        return "GET", reverse(name, args=[pick(target.usernames)]), None
+
+    def request(self, action):
+        method, path, data = self.plan(action)
+        session = None
+        if (action in WRITES or action == "follow_index"
+                or self.random.random() >= ANONYMOUS_SHARE):
+            session = self.random.choice(self.target.sessions)
+        status = []
+
+        def start_response(line, headers, exc_info=None):
+            status.append(int(line.split()[0]))
+
+        started = time.perf_counter()
+        result = self.application(environ(method, path, session, data),
+                                  start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            # request_finished: Django закрывает соединения как на сервере
+            if hasattr(result, "close"):
+                result.close()
+        self.stats.request(action, status[0], time.perf_counter() - started)
+
+    def run(self, deadline, limit):
+        _current.stats = self.stats
+        try:
+            done = 0
+            while time.monotonic() < deadline and done < limit:
+                action = self.random.choices(
+                    self.actions, weights=self.weights
+                )[0]
+                self.request(action)
+                done += 1
+                if self.think:
+                    time.sleep(self.random.expovariate(1 / self.think))
+        finally:
+            _current.stats = None
+            connections.close_all()
+        return self.stats.as_dict()
+
+
+def run_process(target, mix, think_ms, seed, duration, limit):
+    # приложение досталось от родителя при fork, передавать его не нужно
+    with instrumented():
+        worker = Worker(_current.application, target, mix, think_ms, seed)
+        return worker.run(time.monotonic() + duration, limit)
+
+
+def run(application, target, mix, workers=4, mode="thread", duration=10,
+        requests=None, think_ms=0, seed=0):
+    """Запускает рабочих и возвращает сводку summarize()."""
+    limits = [float("inf")] * workers
+    if requests is not None:
+        limits = [requests // workers + (number < requests % workers)
+                  for number in range(workers)]
+    started = time.perf_counter()
+    if mode == "process":
+        # дочерние процессы не должны делить соединения родителя
+        connections.close_all()
+        _current.application = application
+        context = multiprocessing.get_context("fork")
+        with context.Pool(workers) as pool:
+            parts = pool.starmap(run_process, [
+                (target, mix, think_ms, seed + number, duration,
+                 limits[number])
+                for number in range(workers)
+            ])
+    else:
+        deadline = time.monotonic() + duration
+        with instrumented(), ThreadPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(
+                    Worker(application, target, mix, think_ms,
+                           seed + number).run,
+                    deadline, limits[number]
+                )
+                for number in range(workers)
+            ]
+            parts = [future.result() for future in futures]
+    return summarize(parts, time.perf_counter() - started)
@@ -0,0 +1,156 @@
+import platform
+import sys
+from fnmatch import fnmatch
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from about import urls as about_urls
+from core import benchmark
+from posts import urls as posts_urls
+from posts.models import AuthorCounters, Follow, Group, Post, PostCounters
+from users import urls as users_urls
+
+User = get_user_model()
+
+URLCONFS = (posts_urls, users_urls, about_urls)
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет p50/p95/p99, число запросов и пик памяти каждой страницы "
+        "posts.urls, users.urls и about.urls через тестовый клиент, "
+        "пишет результаты в JSON и сравнивает их с базовыми"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument(
+            "--cold", action="store_true",
+            help="Очищать кеш перед каждым запросом"
+        )
+        parser.add_argument(
+            "--anonymous", action="store_true",
+            help="Открывать страницы без входа"
+        )
+        parser.add_argument(
+            "--only", action="append", default=[],
+            help="Только страницы с такими именами (можно с *)"
+        )
+        parser.add_argument(
+            "--output", default="benchmark.json",
+            help="Куда записать результаты"
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Файл с базовыми результатами для сравнения"
+        )
+        parser.add_argument(
+            "--threshold", type=float, default=20,
+            help="Рост p95 в процентах, который считается регрессией"
+        )
+
+    def handle(self, *args, **options):
+        if not Post.objects.exists():
+            raise CommandError("Нет данных: сначала запустите seed_benchmark")
+        user, kwargs, query = self.samples()
+        login = None if options["anonymous"] else user
+        client = Client()
+        results = {"meta": self.meta(options), "views": {}}
+        # DEBUG копит все запросы в памяти и включает счётчик бюджета
+        with override_settings(DEBUG=False):
+            for view_name, path in self.view_paths(kwargs, options["only"]):
+                result = benchmark.measure(
+                    client, path, query.get(view_name),
+                    iterations=options["iterations"],
+                    cold=options["cold"],
+                    login=login,
+                )
+                results["views"][view_name] = result
+                self.stdout.write(
+                    f"{view_name:32} p50 {result['p50_ms']:8.2f}  "
+                    f"p95 {result['p95_ms']:8.2f}  "
+                    f"p99 {result['p99_ms']:8.2f} мс  "
+                    f"запросов {result['queries']:3}  "
+                    f"память {result['memory_kb']:8.1f} КБ"
+                )
+        benchmark.dump(results, options["output"])
+        self.stdout.write(f"Результаты записаны в {options['output']}")
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["threshold"])
+
+    def compare(self, results, path, threshold):
+        lines, regressions = benchmark.compare(
+            results, benchmark.load(path), threshold
+        )
+        for line in lines:
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(f"Регрессий: {regressions}")
+
+    def samples(self):
+        """Самые нагруженные объекты: на них страницы тяжелее всего."""
+        reader = Follow.objects.values("user").annotate(
+            n=Count("id")
+        ).order_by("-n").values_list("user", flat=True).first()
+        user = User.objects.get(
+            pk=reader or Post.objects.values_list("author", flat=True)[0]
+        )
+        author_id = AuthorCounters.objects.order_by(
+            "-followers_count"
+        ).values_list("author_id", flat=True).first() or user.pk
+        group = Group.objects.annotate(n=Count("posts")).order_by("-n")[0]
+        post_id = PostCounters.objects.order_by(
+            "-comments_count"
+        ).values_list("post_id", flat=True).first()
+        post = Post.objects.get(
+            pk=post_id or Post.objects.values_list("id", flat=True)[0]
+        )
+        kwargs = {
+            "slug": group.slug,
+            "username": User.objects.get(pk=author_id).username,
+            "post_id": post.pk,
+            "uidb64": urlsafe_base64_encode(force_bytes(user.pk)),
+            "token": default_token_generator.make_token(user),
+        }
+        word = max(post.text.split(), key=len).strip(".,!?")
+        return user, kwargs, {"posts:search": {"q": word}}
+
+    def view_paths(self, kwargs, only):
+        for urlconf in URLCONFS:
+            for pattern in urlconf.urlpatterns:
+                view_name = f"{urlconf.app_name}:{pattern.name}"
+                if only and not any(fnmatch(view_name, name)
+                                    for name in only):
+                    continue
+                names = pattern.pattern.converters.keys()
+                yield view_name, reverse(
+                    view_name, kwargs={name: kwargs[name] for name in names}
+                )
+
+    def meta(self, options):
+        return {
+            "created": timezone.now().isoformat(),
+            "python": sys.version.split()[0],
+            "django": django.get_version(),
+            "platform": platform.platform(),
+            "database": connection.vendor,
+            "iterations": options["iterations"],
+            "cold": options["cold"],
+            "anonymous": options["anonymous"],
+            "objects": {
+                "users": User.objects.count(),
+                "posts": Post.objects.count(),
+                "follows": Follow.objects.count(),
+            },
+        }
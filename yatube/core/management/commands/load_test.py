@@ -0,0 +1,102 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from core import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагружает WSGI-приложение проекта смесью чтений и записей из пула "
+        "потоков или процессов и сообщает пропускную способность, "
+        "задержки, ошибки «database is locked» и попадания в кеш. "
+        "Записи остаются в базе: запускайте на копии после seed_benchmark"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--mode", choices=["thread", "process"], default="thread"
+        )
+        parser.add_argument(
+            "--duration", type=float, default=10,
+            help="Сколько секунд длится нагрузка"
+        )
+        parser.add_argument(
+            "--requests", type=int,
+            help="Остановиться после стольких запросов"
+        )
+        parser.add_argument(
+            "--think-ms", type=float, default=0,
+            help="Среднее время «раздумий» между запросами рабочего"
+        )
+        parser.add_argument(
+            "--mix",
+            default=",".join(
+                f"{name}={weight}"
+                for name, weight in loadtest.DEFAULT_MIX.items()
+            ),
+            help="Веса действий: index, group, profile, post, follow_index, "
+                 "create, comment, follow"
+        )
+        parser.add_argument(
+            "--users", type=int, default=50,
+            help="Сколько пользователей входят на сайт"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Записать отчёт в JSON")
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options["mix"])
+            target = loadtest.Target(options["users"], options["seed"])
+        except ValueError as error:
+            raise CommandError(error)
+        # DEBUG копит все запросы в памяти, показывает отладочные 500
+        # и включает счётчик бюджета: приложение собирается уже без него
+        with override_settings(DEBUG=False):
+            application = get_wsgi_application()
+            report = loadtest.run(
+                application, target, mix,
+                workers=options["workers"],
+                mode=options["mode"],
+                duration=options["duration"],
+                requests=options["requests"],
+                think_ms=options["think_ms"],
+                seed=options["seed"],
+            )
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as stream:
+                json.dump(report, stream, ensure_ascii=False, indent=2)
+
+    def print_report(self, report):
+        overall = report["overall"]
+        self.stdout.write(
+            f"Запросов: {overall['requests']} за {report['elapsed_s']} с, "
+            f"{report['throughput_rps']} в секунду"
+        )
+        if overall["requests"]:
+            self.stdout.write(
+                f"Задержка: p50 {overall['p50_ms']}, p95 {overall['p95_ms']}"
+                f", p99 {overall['p99_ms']} мс"
+            )
+        for action, result in report["actions"].items():
+            self.stdout.write(
+                f"  {action:14} {result['requests']:6}  "
+                f"p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  "
+                f"p99 {result['p99_ms']:8.2f} мс  "
+                f"ошибок {result['errors']}"
+            )
+        self.stdout.write(f"Ответы: {report['statuses']}")
+        self.stdout.write(
+            f"database is locked: {report['database_locked']}, "
+            f"исключения: {report['exceptions'] or 'нет'}"
+        )
+        for kind, cache in report["cache"].items():
+            self.stdout.write(
+                f"Кеш {kind}: {cache['hit_rate']:.0%} попаданий "
+                f"из {cache['lookups']}"
+            )
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import SCALES, Seeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Наполняет базу синтетическими пользователями, группами, постами "
+        "с картинками, комментариями и подписками для benchmark_views"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale", choices=sorted(SCALES), default="10k",
+            help="Готовый масштаб данных"
+        )
+        for name in ("users", "groups", "posts", "comments", "follows"):
+            parser.add_argument(
+                f"--{name}", type=int,
+                help=f"Переопределить число: {name}"
+            )
+        parser.add_argument(
+            "--seed", type=int, default=0,
+            help="Зерно генератора: одинаковое зерно — одинаковые данные"
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        counts = dict(SCALES[options["scale"]])
+        for name in counts:
+            if options[name] is not None:
+                counts[name] = options[name]
+        if min(counts["users"], counts["groups"], counts["posts"]) < 1:
+            raise CommandError(
+                "Нужны хотя бы один пользователь, группа и пост"
+            )
+        Seeder(
+            counts,
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            log=self.stdout.write,
+        ).run()
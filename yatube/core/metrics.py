@@ -0,0 +1,314 @@
+"""
+Метрики процесса в текстовом формате Prometheus.
+
+Счётчики и гистограммы копятся в памяти процесса. Каждый процесс
+периодически сбрасывает их в свой файл в settings.METRICS_DIR,
+а /metrics/ складывает файлы всех процессов, так что один опрос
+видит всё развёртывание. Файлы завершившихся процессов учитываются,
+пока не устареют: файл, не обновлявшийся METRICS_STALE_AFTER секунд,
+опрос удаляет, и Prometheus видит сброс счётчиков.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+THUMBNAIL_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+WRITE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+# блокировку на запись SQLite берёт первый пишущий запрос транзакции
+WRITES = re.compile(r"^\s*(BEGIN|INSERT|UPDATE|DELETE|REPLACE)\b",
+                    re.IGNORECASE)
+
+
+def escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        f'{name}="{escape(value)}"' for name, value in pairs
+    ) + "}"
+
+
+def format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name}: нужны метки {', '.join(self.labelnames)}"
+            )
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        self.registry.add(self.name, self.key(labels), [amount])
+
+    def lines(self, values):
+        for labels, (value,) in sorted(values.items()):
+            yield f"{self.name}{format_labels(labels)} {format_number(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        # значения: число попаданий в каждый интервал, сумма, количество
+        counts = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] = 1
+        self.registry.add(self.name, self.key(labels), counts + [value, 1])
+
+    def lines(self, values):
+        bounds = self.buckets + (float("inf"),)
+        for labels, value in sorted(values.items()):
+            total = 0
+            for bound, count in zip(bounds, value):
+                total += count
+                le = (("le", format_number(bound)),)
+                yield (f"{self.name}_bucket{format_labels(labels, le)} "
+                       f"{total}")
+            yield f"{self.name}_sum{format_labels(labels)} {value[-2]!r}"
+            yield f"{self.name}_count{format_labels(labels)} {value[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.reset()
+        if hasattr(os, "register_at_fork"):
+            # потомок начинает с нуля, иначе значения родителя
+            # посчитаются дважды
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.values = defaultdict(dict)
+        self.name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        self.flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=None):
+        return self.register(Histogram(
+            self, name, help_text, labelnames, buckets or LATENCY_BUCKETS
+        ))
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add(self, name, key, amounts):
+        with self._lock:
+            values = self.values[name]
+            current = values.get(key)
+            if current is None:
+                values[key] = list(amounts)
+            else:
+                for index, amount in enumerate(amounts):
+                    current[index] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: [[list(key), list(value)]
+                       for key, value in values.items()]
+                for name, values in self.values.items()
+            }
+
+    def flush(self, force=False):
+        """Пишет значения процесса в его файл не чаще интервала сброса."""
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or (
+            not force and now - self.flushed < settings.METRICS_FLUSH_INTERVAL
+        ):
+            return
+        self.flushed = now
+        os.makedirs(directory, exist_ok=True)
+        descriptor, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w") as stream:
+            json.dump(self.snapshot(), stream)
+        # читатель видит либо старый файл, либо новый целиком
+        os.replace(path, os.path.join(directory, self.name))
+
+    def snapshots(self):
+        directory = settings.METRICS_DIR
+        if not directory:
+            return [self.snapshot()]
+        self.flush(force=True)
+        stale = time.time() - settings.METRICS_STALE_AFTER
+        result = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < stale:
+                    # процесс давно завершился, или его .tmp брошен
+                    os.remove(path)
+                    continue
+                if not name.endswith(".json"):
+                    continue
+                with open(path) as stream:
+                    result.append(json.load(stream))
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def collect(self):
+        """Сумма значений всех процессов: {имя: {метки: значения}}."""
+        merged = defaultdict(dict)
+        for snapshot in self.snapshots():
+            for name, rows in snapshot.items():
+                values = merged[name]
+                for key, amounts in rows:
+                    key = tuple(tuple(pair) for pair in key)
+                    current = values.setdefault(key, [0] * len(amounts))
+                    for index, amount in enumerate(amounts):
+                        current[index] += amount
+        return merged
+
+    def render(self):
+        merged = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.lines(merged.get(name, {})))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "yatube_requests_total", "Ответы по маршруту и коду.",
+    ["view", "status"],
+)
+REQUEST_SECONDS = registry.histogram(
+    "yatube_request_duration_seconds", "Время ответа по маршруту.",
+    ["view", "method"],
+)
+REQUEST_QUERIES = registry.histogram(
+    "yatube_request_queries", "SQL-запросов на ответ по маршруту.",
+    ["view"], QUERY_BUCKETS,
+)
+PAGE_CACHE = registry.counter(
+    "yatube_page_cache_total",
+    "Обращения к кешу страниц для анонимов: hit, stale (прежняя версия, "
+    "пока пересобирают), wait, refresh (досрочно) или miss.",
+    ["page", "result"],
+)
+CACHE_WARMER = registry.counter(
+    "yatube_cache_warmer_total",
+    "Страницы фонового прогрева: rendered (пересобрана), fresh (уже "
+    "в кеше) или error.",
+    ["result"],
+)
+THUMBNAILS = registry.counter(
+    "yatube_thumbnails_generated_total",
+    "Созданные превью по варианту: ok или error.",
+    ["variant", "result"],
+)
+THUMBNAIL_SECONDS = registry.histogram(
+    "yatube_thumbnail_generation_seconds", "Время создания превью.",
+    ["variant"], THUMBNAIL_BUCKETS,
+)
+DB_WRITE_SECONDS = registry.histogram(
+    "yatube_db_write_seconds",
+    "Время пишущих запросов; ожидание блокировки SQLite попадает сюда.",
+    ["view"], WRITE_BUCKETS,
+)
+DB_LOCK_WAITS = registry.counter(
+    "yatube_db_lock_waits_total",
+    "Пишущие запросы, ждавшие блокировку базы: waited — дольше "
+    "METRICS_LOCK_WAIT_THRESHOLD, locked — не дождались.",
+    ["view", "result"],
+)
+
+
+class RequestMetrics:
+    """Считает запросы к базе внутри with и записывает метрики ответа."""
+
+    def __init__(self):
+        self.queries = 0
+        self.writes = []
+        self.locked = 0
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self.execute)
+        self._wrapper.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self._started
+        self._wrapper.__exit__(*exc_info)
+
+    def execute(self, execute, sql, params, many, context):
+        self.queries += 1
+        if not WRITES.match(sql):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if "locked" in str(error):
+                self.locked += 1
+            raise
+        finally:
+            self.writes.append(time.perf_counter() - started)
+
+    def record(self, request, response):
+        match = request.resolver_match
+        # адрес вместо маршрута раздул бы число рядов
+        view = match.view_name if match else "unresolved"
+        REQUESTS.inc(view=view, status=response.status_code)
+        REQUEST_SECONDS.observe(
+            self.elapsed, view=view, method=request.method
+        )
+        REQUEST_QUERIES.observe(self.queries, view=view)
+        for elapsed in self.writes:
+            DB_WRITE_SECONDS.observe(elapsed, view=view)
+        waited = sum(
+            elapsed >= settings.METRICS_LOCK_WAIT_THRESHOLD
+            for elapsed in self.writes
+        )
+        if waited:
+            DB_LOCK_WAITS.inc(waited, view=view, result="waited")
+        if self.locked:
+            DB_LOCK_WAITS.inc(self.locked, view=view, result="locked")
@@ -0,0 +1,116 @@
+import json
+import logging
+import random
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, slowlog, timing
+from .queries import QueryLog, budget_for
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger("core.timing")
+
+
+def view_name_of(request):
+    match = request.resolver_match
+    return match.view_name if match else request.path
+
+
+class QueryBudgetMiddleware:
+    """
+    При разработке считает запросы каждой страницы, пишет их число
+    в заголовок X-Query-Count и предупреждает в лог, если страница
+    вышла за бюджет из settings.QUERY_BUDGETS или повторяет один
+    и тот же запрос (N+1). В боевом режиме (DEBUG = False) отключается.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # запросы потоковых ответов выполняются позже и сюда не попадают
+        with QueryLog() as log:
+            response = self.get_response(request)
+        view_name = view_name_of(request)
+        response["X-Query-Count"] = str(len(log))
+        logger.debug("%s: %d запросов", view_name, len(log))
+        budget = budget_for(view_name)
+        if budget is not None and len(log) > budget:
+            logger.warning(
+                "%s: %d запросов при бюджете %d\n%s",
+                view_name, len(log), budget, log.report()
+            )
+        for sql, count in log.repeated():
+            logger.warning(
+                "%s: запрос повторяется %d раз (N+1?): %s",
+                view_name, count, sql
+            )
+        return response
+
+
+class ServerTimingMiddleware:
+    """
+    Для доли запросов из settings.SERVER_TIMING_SAMPLE_RATE разбивает
+    время по фазам (core.timing), отдаёт его в заголовке Server-Timing
+    и пишет в лог core.timing строку JSON с именем маршрута.
+    Тело потоковых ответов отдаётся позже и в замер не попадает.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        timing.install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        with timing.Timer() as timer:
+            response = self.get_response(request)
+        response["Server-Timing"] = timer.header()
+        timing_logger.info(json.dumps({
+            "view": view_name_of(request),
+            "method": request.method,
+            "status": response.status_code,
+            **timer.as_dict(),
+        }))
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Пишет в core.metrics время, число запросов к базе и ожидание
+    блокировок для каждого ответа и время от времени сбрасывает
+    метрики процесса в общий каталог.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with metrics.RequestMetrics() as recorder:
+            response = self.get_response(request)
+        recorder.record(request, response)
+        metrics.registry.flush()
+        return response
+
+
+class SlowQueryMiddleware:
+    """Помечает медленные запросы к базе маршрутом страницы (core.slowlog)."""
+
+    def __init__(self, get_response):
+        if settings.SLOW_QUERY_THRESHOLD is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            slowlog.set_view(None)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        slowlog.set_view(request.resolver_match.view_name)
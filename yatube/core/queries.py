@@ -0,0 +1,68 @@
+"""
+Подсчёт SQL-запросов и поиск N+1 для бюджета запросов страниц.
+
+Бюджеты задаются в settings.QUERY_BUDGETS по имени маршрута; их
+читают и QueryBudgetMiddleware при разработке, и проверка в тестах.
+"""
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+# списки параметров IN (%s, %s, ...) разной длины — один и тот же запрос
+PLACEHOLDERS = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+SPACES = re.compile(r"\s+")
+# BEGIN при разработке и SAVEPOINT в тестах: не запросы страницы
+TRANSACTION = re.compile(r"^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b",
+                         re.IGNORECASE)
+
+
+def shape(sql):
+    """SQL без различий в числе параметров и пробелах."""
+    return SPACES.sub(" ", PLACEHOLDERS.sub("(...)", sql)).strip()
+
+
+def budget_for(view_name):
+    return settings.QUERY_BUDGETS.get(view_name)
+
+
+class QueryLog:
+    """Записывает запросы соединения внутри with."""
+
+    def __init__(self):
+        self.queries = []
+        self._wrapper = None
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self.record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def record(self, execute, sql, params, many, context):
+        if not TRANSACTION.match(sql):
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold=None):
+        """Одинаковые по форме запросы, выполненные threshold раз и чаще."""
+        if threshold is None:
+            threshold = settings.QUERY_BUDGET_REPEATS
+        counts = Counter(shape(sql) for sql in self.queries)
+        return [
+            (sql, count) for sql, count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def report(self):
+        lines = [f"{number}. {sql}"
+                 for number, sql in enumerate(self.queries, 1)]
+        for sql, count in self.repeated():
+            lines.append(f"повторяется {count} раз (N+1?): {sql}")
+        return "\n".join(lines)
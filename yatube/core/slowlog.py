@@ -0,0 +1,196 @@
+"""
+Журнал медленных SQL-запросов с планом выполнения.
+
+Каждое соединение с базой получает обёртку, которая замеряет запросы.
+Запрос дольше settings.SLOW_QUERY_THRESHOLD секунд вместе со стеком
+и маршрутом ставится в очередь, а фоновый поток получает для него
+EXPLAIN и пишет в лог core.slowlog — запрос страницы не ждёт ни плана,
+ни записи в лог. Повторы одного и того же запроса (по форме SQL,
+см. core.queries.shape) пишутся не чаще раза в SLOW_QUERY_REPEAT_INTERVAL
+секунд, с числом пропущенных повторов.
+"""
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .queries import TRANSACTION, shape
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE = ("SELECT", "WITH")
+QUEUE_SIZE = 100
+STACK_LIMIT = 15
+
+_current = threading.local()
+_lock = threading.Lock()
+_queue = None
+_worker = None
+_seen = {}
+dropped = 0
+
+
+def reset():
+    """Очередь и поток не переживают fork: потомок заводит свои."""
+    global _queue, _worker, _lock, dropped
+    _lock = threading.Lock()
+    _queue = queue.Queue(QUEUE_SIZE)
+    _worker = None
+    _seen.clear()
+    dropped = 0
+
+
+reset()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset)
+
+
+def fingerprint(sql):
+    return hashlib.md5(shape(sql).encode()).hexdigest()[:12]
+
+
+def current_view():
+    return getattr(_current, "view", None) or "-"
+
+
+def set_view(view_name):
+    _current.view = view_name
+
+
+def project_stack():
+    """Кадры кода проекта без Django и библиотек, внутренний — последним."""
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename != __file__
+    ]
+    own = [
+        frame for frame in frames
+        if frame.filename.startswith(settings.BASE_DIR)
+        and "site-packages" not in frame.filename
+    ]
+    return traceback.format_list((own or frames)[-STACK_LIMIT:])
+
+
+def install(sender, connection, **kwargs):
+    """Обработчик connection_created: обёртка на каждое соединение."""
+    if settings.SLOW_QUERY_THRESHOLD is None:
+        return
+    # обёртка остаётся на объекте соединения и после переподключения
+    if (getattr(_current, "explaining", False)
+            or timed_execute in connection.execute_wrappers):
+        return
+    connection.execute_wrappers.append(timed_execute)
+
+
+def timed_execute(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        if (elapsed >= settings.SLOW_QUERY_THRESHOLD
+                and not TRANSACTION.match(sql)):
+            report(sql, params, many, context["connection"].alias, elapsed)
+
+
+def report(sql, params, many, alias, elapsed):
+    global dropped
+    key = fingerprint(sql)
+    now = time.monotonic()
+    with _lock:
+        last, repeats = _seen.get(key, (None, 0))
+        if last is not None and (
+            now - last < settings.SLOW_QUERY_REPEAT_INTERVAL
+        ):
+            _seen[key] = (last, repeats + 1)
+            return
+        _seen[key] = (now, 0)
+    entry = {
+        "sql": sql,
+        "params": None if many else params,
+        "alias": alias,
+        "elapsed": elapsed,
+        "view": current_view(),
+        "fingerprint": key,
+        "repeats": repeats,
+        "stack": project_stack(),
+    }
+    try:
+        _queue.put_nowait(entry)
+    except queue.Full:
+        dropped += 1
+        return
+    start_worker()
+
+
+def start_worker():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=work, name="slowlog", daemon=True
+            )
+            _worker.start()
+
+
+def work():
+    # у потока своё соединение; его запросы не замеряются
+    _current.explaining = True
+    try:
+        while True:
+            entry = _queue.get()
+            try:
+                write(entry)
+            except Exception:
+                logger.exception("Не удалось записать медленный запрос")
+            finally:
+                _queue.task_done()
+    finally:
+        connections.close_all()
+
+
+def explain(entry):
+    sql = entry["sql"]
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return "план строится только для SELECT"
+    connection = connections[entry["alias"]]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"{connection.ops.explain_query_prefix()} {sql}",
+                entry["params"],
+            )
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return f"план недоступен: {error}"
+    return "\n".join(" ".join(str(value) for value in row) for row in rows)
+
+
+def write(entry):
+    repeats = (
+        f", ещё {entry['repeats']} раз с прошлой записи"
+        if entry["repeats"] else ""
+    )
+    logger.warning(
+        "Медленный запрос %s: %.0f мс, %s%s\n%s\nПараметры: %r\n"
+        "План:\n%s\nСтек:\n%s",
+        entry["fingerprint"], entry["elapsed"] * 1000, entry["view"],
+        repeats, entry["sql"], entry["params"], explain(entry),
+        "".join(entry["stack"]),
+        extra={
+            "fingerprint": entry["fingerprint"],
+            "view": entry["view"],
+            "duration_ms": round(entry["elapsed"] * 1000, 3),
+        },
+    )
+
+
+def wait():
+    """Ждёт, пока фоновый поток запишет всё из очереди."""
+    _queue.join()
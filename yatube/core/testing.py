@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+
+from .queries import QueryLog, budget_for
+
+
+class QueryBudgetMixin:
+    """Проверка бюджета запросов страницы для TestCase."""
+
+    @contextmanager
+    def assertQueryBudget(self, view_name):
+        budget = budget_for(view_name)
+        if budget is None:
+            self.fail(f"Для {view_name} не задан QUERY_BUDGETS")
+        with QueryLog() as log:
+            yield log
+        if len(log) > budget:
+            self.fail(
+                f"{view_name}: {len(log)} запросов при бюджете {budget}\n"
+                f"{log.report()}"
+            )
+        if log.repeated():
+            self.fail(f"{view_name}: похоже на N+1\n{log.report()}")
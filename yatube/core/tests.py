@@ -0,0 +1,513 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError
+from django.test import (Client, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+from PIL import Image
+
+from core import benchmark, loadtest, metrics, slowlog
+from core.cache import Store, TwoLevelCache
+from posts import images, thumbnails
+from posts.models import (AuthorCounters, Comment, Follow, Post,
+                          StoredImage, TimelineEntry)
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+TINY = {"users": 30, "groups": 3, "posts": 200, "comments": 100,
+        "follows": 100}
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class BenchmarkTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        benchmark.Seeder(TINY, seed=1).run()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.output = os.path.join(self.directory, "results.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_benchmark(self, *args):
+        out = StringIO()
+        call_command(
+            "benchmark_views", "--iterations", "3",
+            "--output", self.output, *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_seeded_data(self):
+        """Данные созданы вместе со счётчиками, лентами и картинками"""
+        self.assertEqual(Post.objects.count(), TINY["posts"])
+        self.assertEqual(Comment.objects.count(), TINY["comments"])
+        self.assertTrue(Follow.objects.exists())
+        self.assertEqual(AuthorCounters.objects.count(), TINY["users"])
+        self.assertTrue(TimelineEntry.objects.exists())
+        self.assertTrue(StoredImage.objects.exists())
+        newest = Post.objects.order_by("-id").first()
+        oldest = Post.objects.order_by("id").first()
+        self.assertGreater(newest.pub_date, oldest.pub_date)
+
+    def test_skewed_distribution(self):
+        """Подписчики достаются немногим популярным авторам"""
+        top = AuthorCounters.objects.order_by(
+            "-followers_count"
+        ).values_list("followers_count", flat=True)
+        self.assertGreater(top[0], 5 * top[len(top) // 2])
+
+    def test_every_view_is_measured(self):
+        """Замеряются все страницы posts, users и about"""
+        self.run_benchmark()
+        with open(self.output, encoding="utf-8") as stream:
+            results = json.load(stream)
+        self.assertIn("posts:home_page", results["views"])
+        self.assertIn("users:password_reset_confirm", results["views"])
+        self.assertIn("about:tech", results["views"])
+        result = results["views"]["posts:post_detail"]
+        self.assertEqual(result["status"], 200)
+        self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+        self.assertGreater(result["queries"], 0)
+        self.assertGreater(result["memory_kb"], 0)
+
+    def test_requests_are_rolled_back(self):
+        """Замеры не меняют данные: подписки и выходы откатываются"""
+        follows = Follow.objects.count()
+        self.run_benchmark("--only", "posts:profile_*")
+        self.assertEqual(Follow.objects.count(), follows)
+
+    def test_baseline_comparison(self):
+        """Рост p95 или числа запросов против базовых — регрессия"""
+        self.run_benchmark("--only", "about:*")
+        baseline = benchmark.load(self.output)
+        same = os.path.join(self.directory, "same.json")
+        benchmark.dump(baseline, same)
+        for result in baseline["views"].values():
+            result["p95_ms"] /= 100
+        faster = os.path.join(self.directory, "faster.json")
+        benchmark.dump(baseline, faster)
+        with self.assertRaisesMessage(CommandError, "Регрессий: 2"):
+            self.run_benchmark("--only", "about:*", "--baseline", faster)
+        out = self.run_benchmark(
+            "--only", "about:*", "--baseline", same, "--threshold", "1000"
+        )
+        self.assertIn("about:tech: p95", out)
+        self.assertNotIn("РЕГРЕССИЯ", out)
+
+    def test_percentile(self):
+        """Перцентиль берётся по ближайшему рангу"""
+        samples = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(samples, 50), 50)
+        self.assertEqual(benchmark.percentile(samples, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+
+
+# превью создаются без фоновых потоков, чтобы отчёт не зависел от них
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0, CACHE_WARMER_PAGES=0
+)
+class LoadTestTests(TransactionTestCase):
+    def setUp(self):
+        benchmark.Seeder(TINY, seed=2).run()
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.output = os.path.join(self.directory, "load.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def load_test(self, *args, workers=1):
+        call_command(
+            "load_test", "--workers", str(workers), "--users", "5",
+            "--output", self.output, *args, stdout=StringIO()
+        )
+        return benchmark.load(self.output)
+
+    def test_mixed_workload(self):
+        """Смесь чтений и записей идёт через WSGI-приложение"""
+        posts = Post.objects.count()
+        report = self.load_test(
+            "--requests", "30", "--mix", "index=5,post=5,create=2,follow=1"
+        )
+        self.assertEqual(report["overall"]["requests"], 30)
+        self.assertLessEqual(set(report["actions"]),
+                             {"index", "post", "create", "follow"})
+        created = report["actions"].get("create", {"requests": 0})
+        self.assertEqual(
+            Post.objects.count() - posts,
+            created["requests"] - created.get("errors", 0)
+        )
+        self.assertIn("gen", report["cache"])
+        self.assertGreater(report["throughput_rps"], 0)
+
+    def test_concurrent_writes_wait_for_lock(self):
+        """Одновременные записи ждут блокировку базы, а не падают"""
+        posts = Post.objects.count()
+        report = self.load_test(
+            "--requests", "80", "--mix", "create=1,comment=1", workers=4
+        )
+        self.assertEqual(report["database_locked"], 0)
+        self.assertEqual(report["statuses"], {"300": 80})
+        created = report["actions"]["create"]["requests"]
+        self.assertEqual(Post.objects.count() - posts, created)
+
+    def test_locked_database_is_reported(self):
+        """Ошибки «database is locked» считаются отдельно"""
+        error = OperationalError("database is locked")
+        with mock.patch("posts.views.counters.for_author",
+                        side_effect=error):
+            report = self.load_test("--requests", "4", "--mix", "profile=1")
+        self.assertEqual(report["database_locked"], 4)
+        self.assertEqual(report["statuses"], {"500": 4})
+        self.assertEqual(report["actions"]["profile"]["errors"], 4)
+
+    def test_parse_mix(self):
+        """Смесь задаётся весами действий"""
+        self.assertEqual(loadtest.parse_mix("index=3, post=1"),
+                         {"index": 3.0, "post": 1.0})
+        for text in ("index", "index=x", "index=0", "index=-1"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    loadtest.parse_mix(text)
+
+    def test_bad_mix(self):
+        """Неизвестное действие в смеси — ошибка команды"""
+        with self.assertRaisesMessage(CommandError, "неизвестное действие"):
+            self.load_test("--mix", "index=1,delete=1")
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.settings = override_settings(METRICS_DIR=self.directory)
+        self.settings.enable()
+        metrics.registry.reset()
+        cache.clear()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def scrape(self):
+        response = Client().get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"].split(";")[0],
+                         "text/plain")
+        return response.content.decode()
+
+    def test_text_format(self):
+        """Счётчики и гистограммы выводятся в формате Prometheus"""
+        registry = metrics.Registry()
+        hits = registry.counter("hits_total", "Попадания.", ["page"])
+        latency = registry.histogram(
+            "latency_seconds", "Время.", ["view"], (0.1, 1)
+        )
+        hits.inc(page='a"b')
+        hits.inc(2, page='a"b')
+        latency.observe(0.05, view="x")
+        latency.observe(0.5, view="x")
+        text = registry.render()
+        self.assertIn("# TYPE hits_total counter", text)
+        self.assertIn('hits_total{page="a\\"b"} 3', text)
+        self.assertIn('latency_seconds_bucket{view="x",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{view="x",le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{view="x",le="+Inf"} 2', text)
+        self.assertIn('latency_seconds_sum{view="x"} 0.55', text)
+        self.assertIn('latency_seconds_count{view="x"} 2', text)
+        with self.assertRaises(ValueError):
+            hits.inc(view="x")
+
+    def test_workers_are_summed(self):
+        """Опрос складывает значения всех процессов из общего каталога"""
+        workers = [metrics.Registry() for _ in range(2)]
+        for number, registry in enumerate(workers, start=1):
+            registry.counter("jobs_total", "Задачи.").inc(number)
+        workers[0].flush(force=True)
+        self.assertIn("jobs_total 3", workers[1].render())
+
+    def test_stale_files_are_pruned(self):
+        """Давно не обновлявшиеся файлы процессов опрос удаляет"""
+        workers = [metrics.Registry() for _ in range(2)]
+        for registry in workers:
+            registry.counter("jobs_total", "Задачи.").inc()
+            registry.flush(force=True)
+        stale = os.path.join(self.directory, workers[0].name)
+        moment = time.time() - settings.METRICS_STALE_AFTER - 1
+        os.utime(stale, (moment, moment))
+        self.assertIn("jobs_total 1", workers[1].render())
+        self.assertFalse(os.path.exists(stale))
+
+    def test_tests_use_own_directory(self):
+        """Метрики тестов не пишутся в каталог сервера"""
+        self.settings.disable()
+        try:
+            self.assertTrue(
+                settings.METRICS_DIR.startswith(settings.TEST_DIR)
+            )
+        finally:
+            self.settings.enable()
+
+    def test_endpoint(self):
+        """Страницы, кеш страниц и запросы к базе попадают в /metrics/"""
+        user = get_user_model().objects.create_user(username="auth")
+        guest = Client()
+        for _ in range(2):
+            guest.get(reverse("posts:home_page"))
+        author = Client()
+        author.force_login(user)
+        author.post(reverse("posts:post_create"), {"text": "Новый пост"})
+        text = self.scrape()
+        self.assertIn(
+            'yatube_page_cache_total{page="index",result="hit"} 1', text
+        )
+        self.assertIn(
+            'yatube_page_cache_total{page="index",result="miss"} 1', text
+        )
+        self.assertIn('yatube_requests_total{view="posts:home_page",'
+                      'status="200"} 2', text)
+        self.assertIn('yatube_request_duration_seconds_count{'
+                      'view="posts:home_page",method="GET"} 2', text)
+        self.assertIn('yatube_request_queries_count{'
+                      'view="posts:home_page"} 2', text)
+        self.assertIn('yatube_db_write_seconds_count{'
+                      'view="posts:post_create"}', text)
+
+    def test_lock_waits(self):
+        """Долгие и неудавшиеся из-за блокировки записи считаются"""
+        recorder = metrics.RequestMetrics()
+
+        def locked(*args):
+            raise OperationalError("database is locked")
+
+        with override_settings(METRICS_LOCK_WAIT_THRESHOLD=0):
+            with recorder:
+                recorder.execute(lambda *args: None, "UPDATE x", (),
+                                 False, {})
+                with self.assertRaises(OperationalError):
+                    recorder.execute(locked, "INSERT x", (), False, {})
+            request = mock.Mock(resolver_match=None, method="POST")
+            recorder.record(request, mock.Mock(status_code=500))
+        text = metrics.registry.render()
+        self.assertIn('yatube_db_lock_waits_total{view="unresolved",'
+                      'result="waited"} 2', text)
+        self.assertIn('yatube_db_lock_waits_total{view="unresolved",'
+                      'result="locked"} 1', text)
+
+    def test_thumbnail_generation(self):
+        """Созданные превью считаются по вариантам"""
+        buffer = BytesIO()
+        Image.new("RGB", (640, 226)).save(buffer, "JPEG")
+        with override_settings(MEDIA_ROOT=self.directory):
+            name = images.storage().save(
+                "posts/metrics.jpg", ContentFile(buffer.getvalue())
+            )
+            thumbnails.generate(name, "320x113")
+        text = metrics.registry.render()
+        self.assertIn('yatube_thumbnails_generated_total{'
+                      'variant="320x113",result="ok"} 1', text)
+        self.assertIn('yatube_thumbnail_generation_seconds_count{'
+                      'variant="320x113"} 1', text)
+
+    def test_only_for_collector(self):
+        """Чужим адресам метрики не отдаются"""
+        response = Client().get(reverse("metrics"), REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(SLOW_QUERY_REPEAT_INTERVAL=600)
+class SlowQueryTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(username="auth")
+        Post.objects.create(author=cls.user, text="Пост")
+
+    def setUp(self):
+        slowlog.reset()
+        cache.clear()
+
+    def logged(self, action):
+        # медленными считаются все запросы, но только внутри action
+        with self.assertLogs("core.slowlog", "WARNING") as logs:
+            with override_settings(SLOW_QUERY_THRESHOLD=0):
+                action()
+            slowlog.wait()
+        return [record.getMessage() for record in logs.records]
+
+    def test_plan_view_and_stack(self):
+        """В лог попадают план, маршрут и место вызова в коде проекта"""
+        messages = self.logged(lambda: Client().get(
+            reverse("posts:profile", args=["auth"])
+        ))
+        message = next(
+            message for message in messages
+            if "posts_post" in message and "posts:profile" in message
+        )
+        self.assertIn("План:", message)
+        self.assertRegex(message, r"SCAN|SEARCH")
+        self.assertIn("posts/views.py", message)
+        self.assertNotIn("site-packages", message.split("Стек:")[1])
+
+    def test_repeats_are_deduplicated(self):
+        """Повторы одного запроса пишутся раз в интервал с их числом"""
+        def query(limit):
+            list(Post.objects.filter(id__in=range(limit)))
+
+        messages = self.logged(lambda: [query(limit) for limit in (1, 2, 3)])
+        self.assertEqual(len(messages), 1)
+        with override_settings(SLOW_QUERY_REPEAT_INTERVAL=0):
+            messages = self.logged(lambda: query(4))
+        self.assertIn("ещё 2 раз с прошлой записи", messages[0])
+
+    def test_request_does_not_wait(self):
+        """Запрос не ждёт записи в лог"""
+        release = threading.Event()
+        with mock.patch("core.slowlog.write",
+                        side_effect=lambda entry: release.wait(5)):
+            with override_settings(SLOW_QUERY_THRESHOLD=0):
+                list(Post.objects.all())
+            self.assertFalse(release.is_set())
+            release.set()
+            slowlog.wait()
+
+
+def write_in_child(cache, results):
+    results.put(cache.get("key"))
+    cache.set("key", "из потомка")
+
+
+class TwoLevelCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.path = os.path.join(self.directory, "cache.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def process(self, **options):
+        """Кеш с собственным L1, как в отдельном процессе сервера."""
+        backend = TwoLevelCache(self.path, {"OPTIONS": options})
+        backend.store = Store(self.path, options.get("L1_MAX_BYTES", 10 ** 6))
+        return backend
+
+    def test_cache_api(self):
+        """Бэкенд ведёт себя как обычный кеш Django"""
+        cache = self.process()
+        cache.set("key", {"a": 1})
+        self.assertEqual(cache.get("key"), {"a": 1})
+        self.assertFalse(cache.add("key", "other"))
+        self.assertTrue(cache.add("new", 1))
+        self.assertEqual(cache.incr("new", 5), 6)
+        with self.assertRaises(ValueError):
+            cache.incr("missing")
+        cache.set_many({"x": 1, "y": 2})
+        self.assertEqual(cache.get_many(["x", "y", "z"]), {"x": 1, "y": 2})
+        cache.delete("x")
+        self.assertFalse(cache.has_key("x"))
+        self.assertEqual(cache.get("x", "default"), "default")
+        cache.clear()
+        self.assertIsNone(cache.get("key"))
+
+    def test_ttl(self):
+        """Просроченные ключи не отдаются ни из L1, ни из L2"""
+        cache, other = self.process(), self.process()
+        now = time.time()
+        cache.set("key", "value", 10)
+        self.assertTrue(cache.touch("key", 100))
+        with mock.patch("time.time", return_value=now + 50):
+            self.assertEqual(cache.get("key"), "value")
+            self.assertEqual(other.get("key"), "value")
+        with mock.patch("time.time", return_value=now + 150):
+            self.assertIsNone(cache.get("key"))
+            self.assertIsNone(other.get("key"))
+            self.assertFalse(cache.touch("key"))
+        cache.set("gone", "value", 0)
+        self.assertIsNone(cache.get("gone"))
+
+    def test_shared_between_processes(self):
+        """Записанное одним процессом видно другим"""
+        first, second = self.process(), self.process()
+        first.set("page", "ответ")
+        self.assertEqual(second.get("page"), "ответ")
+        self.assertIn(second.make_key("page"), second.store.memory)
+
+    def test_forked_worker(self):
+        """Процесс, порождённый fork, делит кеш с родителем"""
+        cache = self.process()
+        cache.set("key", "из родителя")
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        child = context.Process(target=write_in_child, args=(cache, results))
+        child.start()
+        child.join()
+        self.assertEqual(results.get(timeout=5), "из родителя")
+        self.assertEqual(cache.get("key"), "из потомка")
+
+    def test_invalidation(self):
+        """Изменения другого процесса выбрасывают ключ из L1"""
+        first, second = self.process(), self.process()
+        first.set("generation", 1)
+        self.assertEqual(second.get("generation"), 1)
+        first.incr("generation")
+        self.assertEqual(second.get("generation"), 2)
+        first.set("generation", 10)
+        self.assertEqual(second.get("generation"), 10)
+        first.delete("generation")
+        self.assertIsNone(second.get("generation"))
+        second.set("page", "ответ")
+        self.assertEqual(first.get("page"), "ответ")
+        first.clear()
+        self.assertIsNone(second.get("page"))
+
+    def test_l1_serves_repeated_reads(self):
+        """Повторное чтение не обращается к файлу"""
+        cache = self.process()
+        cache.set("key", "value")
+        self.process().get("key")
+        with mock.patch.object(cache, "fetch") as fetch:
+            self.assertEqual(cache.get("key"), "value")
+        fetch.assert_not_called()
+
+    def test_l1_is_bounded(self):
+        """L1 вытесняет давно не читанные значения сверх L1_MAX_BYTES"""
+        cache = self.process(L1_MAX_BYTES=1000)
+        for number in range(20):
+            cache.set(f"key{number}", "x" * 200)
+        self.assertLessEqual(cache.store.size, 1000)
+        self.assertNotIn(cache.make_key("key0"), cache.store.memory)
+        self.assertIn(cache.make_key("key19"), cache.store.memory)
+        self.assertEqual(cache.get("key0"), "x" * 200)
+
+    def test_l2_is_bounded(self):
+        """L2 удаляет старые записи сверх MAX_ENTRIES"""
+        cache = self.process(MAX_ENTRIES=10, CULL_FREQUENCY=2)
+        with mock.patch("core.cache.CULL_EVERY", 1):
+            for number in range(30):
+                cache.set(f"key{number}", number)
+        count = cache.store.connection().execute(
+            "SELECT COUNT(*) FROM cache"
+        ).fetchone()[0]
+        self.assertLessEqual(count, 10)
+        self.assertEqual(self.process().get("key29"), 29)
+        self.assertIsNone(self.process().get("key0"))
@@ -0,0 +1,118 @@
+"""
+Разбивка времени запроса по фазам для заголовка Server-Timing.
+
+Фазы: db (SQL), template (рендеринг шаблонов), cache (обращения
+к кешу Django) и thumbnail (поиск и создание превью). Замер включён
+только внутри with Timer(), поэтому без выборки хуки стоят одну
+проверку thread-local. Фазы вложены друг в друга: запрос к базе
+из шаблона попадает и в db, и в template.
+"""
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.template.base import Template
+
+PHASES = ("db", "template", "cache", "thumbnail")
+CACHE_METHODS = ("get", "get_many", "set", "set_many", "add", "delete")
+
+_current = threading.local()
+_installed = False
+_lock = threading.Lock()
+
+
+def current():
+    return getattr(_current, "timer", None)
+
+
+class Timer:
+    """Копит время и число вызовов фаз в текущем потоке."""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._depth = defaultdict(int)
+        self._started = None
+        self.total = 0.0
+
+    def __enter__(self):
+        _current.timer = self
+        self._wrapper = connection.execute_wrapper(self.execute)
+        self._wrapper.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total = time.perf_counter() - self._started
+        self._wrapper.__exit__(*exc_info)
+        _current.timer = None
+
+    def call(self, name, func, *args, **kwargs):
+        # повторный вход в ту же фазу (include в шаблоне) не считается
+        self._depth[name] += 1
+        if self._depth[name] > 1:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._depth[name] -= 1
+        self.counts[name] += 1
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.durations[name] += time.perf_counter() - started
+            self._depth[name] -= 1
+
+    def execute(self, execute, sql, params, many, context):
+        return self.call("db", execute, sql, params, many, context)
+
+    def as_dict(self):
+        data = {"total_ms": round(self.total * 1000, 3)}
+        for name in PHASES:
+            data[f"{name}_ms"] = round(self.durations[name] * 1000, 3)
+            data[f"{name}_count"] = self.counts[name]
+        return data
+
+    def header(self):
+        """Значение Server-Timing: dur в миллисекундах."""
+        entries = [
+            f'{name};dur={self.durations[name] * 1000:.1f};'
+            f'desc="{self.counts[name]}"'
+            for name in PHASES if self.counts[name]
+        ]
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def timed(name):
+    """Декоратор: время функции идёт в фазу name, если замер включён."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            timer = current()
+            if timer is None:
+                return func(*args, **kwargs)
+            return timer.call(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def install():
+    """Ставит хуки на шаблоны и бэкенды кеша, один раз на процесс."""
+    global _installed
+    with _lock:
+        if _installed:
+            return
+        Template.render = timed("template")(Template.render)
+        backends = {type(caches[alias]) for alias in settings.CACHES}
+        for backend in backends:
+            for method in CACHE_METHODS:
+                # у наследника метод может быть унаследован от базового
+                # класса: оборачиваем его на самом бэкенде
+                setattr(backend, method,
+                        timed("cache")(getattr(backend, method)))
+        _installed = True
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from .models import Post
 from .models import Group
+from . import search
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -10,6 +11,12 @@ class PostAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
     list_editable = ("group",)
 
+    def get_search_results(self, request, queryset, search_term):
+        # вместо LIKE '%term%' по всей таблице ищем через индекс FTS5
+        if not search_term:
+            return queryset, False
+        return search.matching(queryset, search_term), False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
@@ -0,0 +1,188 @@
+"""
+JSON-версии лент и страницы поста, только для чтения.
+
+Строки читаются через values() — только нужные столбцы, без объектов
+моделей — одним запросом ещё в представлении, чтобы он попал в бюджет
+запросов, метрики и Server-Timing. В JSON они сериализуются по одной
+в StreamingHttpResponse, поэтому даже страница с большим limit
+не собирается в памяти одной строкой.
+Листание — теми же курсорами, что и в HTML (?after= / ?before=).
+"""
+import json
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+
+from . import images
+from .models import Comment, Group, Post
+from .paginator import CursorPaginator, InvalidCursor, decode_cursor
+from .utils import POSTS_PER_PAGE
+
+User = get_user_model()
+
+MAX_LIMIT = 1000
+
+POST_FIELDS = (
+    "id", "text", "pub_date", "image", "author__username", "group__slug",
+    "counters__comments_count",
+)
+COMMENT_FIELDS = ("id", "text", "created", "author__username")
+
+
+def dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def bad_request(detail):
+    return JsonResponse({"detail": detail}, status=400)
+
+
+def not_found():
+    return JsonResponse({"detail": "Не найдено"}, status=404)
+
+
+def post_data(row):
+    return {
+        "id": row["id"],
+        "author": row["author__username"],
+        "group": row["group__slug"],
+        "text": row["text"],
+        "pub_date": row["pub_date"],
+        "image": images.storage().url(row["image"]) if row["image"] else None,
+        "comments": row["counters__comments_count"] or 0,
+        "url": reverse("posts:api_post", kwargs={"post_id": row["id"]}),
+    }
+
+
+def comment_data(row):
+    return {
+        "id": row["id"],
+        "author": row["author__username"],
+        "text": row["text"],
+        "created": row["created"],
+    }
+
+
+def page_url(request, **cursor):
+    query = request.GET.copy()
+    query.pop("after", None)
+    query.pop("before", None)
+    query.update(cursor)
+    return f"{request.path}?{urlencode(sorted(query.items()))}"
+
+
+def page_limit(request):
+    try:
+        limit = int(request.GET.get("limit", POSTS_PER_PAGE))
+    except ValueError:
+        raise ValueError("limit должен быть числом")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit должен быть от 1 до {MAX_LIMIT}")
+    return limit
+
+
+def page_links(request, paginator, first, last, has_next, has_previous):
+    links = {"next": None, "previous": None}
+    if has_next and last is not None:
+        links["next"] = page_url(request, after=paginator.cursor_for(last))
+    if has_previous and first is not None:
+        links["previous"] = page_url(
+            request, before=paginator.cursor_for(first)
+        )
+    return links
+
+
+def stream_page(request, queryset, serialize, ordering=("-pub_date", "-id")):
+    """
+    Отдаёт страницу queryset как {"results": [...], "next", "previous"}.
+    Страница (не больше MAX_LIMIT + 1 строк) читается до ответа: поток
+    отдаётся уже после замеров и проверок посредников.
+    """
+    try:
+        limit = page_limit(request)
+    except ValueError as error:
+        return bad_request(str(error))
+    paginator = CursorPaginator(queryset, limit, ordering)
+    before = request.GET.get("before")
+    token = before or request.GET.get("after")
+    try:
+        cursor = decode_cursor(token) if token else None
+        rows = paginator.rows_after(cursor, backwards=bool(before))
+    except InvalidCursor:
+        return bad_request("Неверный курсор")
+    rows = list(rows)
+    if before:
+        # назад строки идут в обратном порядке
+        has_previous = len(rows) > limit
+        has_next = True
+        rows = rows[:limit][::-1]
+    else:
+        has_previous = cursor is not None
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+    def content():
+        yield '{"results": ['
+        for number, row in enumerate(rows):
+            yield ("," if number else "") + dumps(serialize(row))
+        first, last = (rows[0], rows[-1]) if rows else (None, None)
+        links = page_links(
+            request, paginator, first, last, has_next, has_previous
+        )
+        yield "], " + dumps(links)[1:]
+
+    return StreamingHttpResponse(
+        content(), content_type="application/json; charset=utf-8"
+    )
+
+
+def posts(queryset):
+    return queryset.values(*POST_FIELDS)
+
+
+def index(request):
+    return stream_page(request, posts(Post.objects.all()), post_data)
+
+
+def group_posts(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        "id", flat=True
+    ).first()
+    if group_id is None:
+        return not_found()
+    queryset = posts(Post.objects.filter(group_id=group_id))
+    return stream_page(request, queryset, post_data)
+
+
+def profile(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        "id", flat=True
+    ).first()
+    if author_id is None:
+        return not_found()
+    queryset = posts(Post.objects.filter(author_id=author_id))
+    return stream_page(request, queryset, post_data)
+
+
+def post_detail(request, post_id):
+    row = posts(Post.objects.filter(id=post_id)).first()
+    if row is None:
+        return not_found()
+    data = post_data(row)
+    data["comments_url"] = reverse(
+        "posts:api_comments", kwargs={"post_id": post_id}
+    )
+    return JsonResponse(data, json_dumps_params={"ensure_ascii": False})
+
+
+def comments(request, post_id):
+    if not Post.objects.filter(id=post_id).exists():
+        return not_found()
+    ordering = ("created", "id")
+    queryset = Comment.objects.filter(post_id=post_id).order_by(
+        *ordering
+    ).values(*COMMENT_FIELDS)
+    return stream_page(request, queryset, comment_data, ordering)
@@ -0,0 +1,318 @@
+"""
+Кеш страниц с инвалидацией через поколения.
+
+У каждой области (общая лента, группа, автор, пост) есть
+счётчик-поколение. Номера поколений входят в ключи закешированных
+страниц и фрагментов, а сигналы моделей увеличивают счётчики
+затронутых областей. Старые записи становятся недостижимыми
+и вытесняются сами, поэтому TTL может быть длинным.
+
+Страницу, которой нет в кеше, пересобирает один запрос (single_flight),
+а остальные тем временем получают прежнюю копию или недолго ждут.
+Горячие страницы обновляются заранее, до мягкого срока, поэтому
+под нагрузкой не истекают, а самые посещаемые ещё и пересобираются
+в фоне после смены поколения (posts.warmer).
+"""
+import hashlib
+import math
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.utils.cache import (cc_delim_re, get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+from core.metrics import PAGE_CACHE
+
+from . import warmer
+
+FEED = "feed"
+# сколько держится блокировка пересборки, если пересобиравший процесс упал
+LOCK_TIMEOUT = 30
+# сколько ждать чужую пересборку, когда отдать нечего, и как часто проверять
+WAIT = 2.0
+POLL = 0.05
+# чем больше, тем раньше начинается досрочное обновление (XFetch)
+EARLY_REFRESH_BETA = 1.0
+
+
+def group_scope(slug):
+    return f"group:{slug}"
+
+
+def author_scope(username):
+    return f"author:{username}"
+
+
+def post_scope(post_id):
+    return f"post:{post_id}"
+
+
+def post_scopes(post_id, username, group_slug):
+    """Области, от которых зависит страница поста."""
+    scopes = [post_scope(post_id), author_scope(username)]
+    if group_slug:
+        scopes.append(group_scope(group_slug))
+    return scopes
+
+
+def generation_key(scope):
+    # слаг и имя пользователя могут содержать недопустимые для ключа символы
+    return "gen:" + hashlib.md5(scope.encode()).hexdigest()
+
+
+def modified_key(scope):
+    return "mod:" + hashlib.md5(scope.encode()).hexdigest()
+
+
+def new_generation():
+    # после вытеснения счётчика нельзя начинать снова с 1: ключи
+    # со старыми номерами могли остаться в кеше
+    return int(time.time() * 1000)
+
+
+def generations(*scopes):
+    keys = [generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for scope, key in zip(scopes, keys):
+        if key not in found:
+            # что менялось до вытеснения счётчика, неизвестно:
+            # считаем, что область изменилась только что
+            cache.add(modified_key(scope), int(time.time()), None)
+            cache.add(key, new_generation(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    scopes = set(scopes)
+    cache.set_many(
+        {modified_key(scope): int(time.time()) for scope in scopes}, None
+    )
+    for scope in scopes:
+        key = generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, new_generation(), None)
+    warmer.schedule()
+
+
+def last_modified(*scopes):
+    """Время последнего изменения областей или None, если оно забыто."""
+    keys = [modified_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return None
+    return max(found.values())
+
+
+def versions_key(*scopes):
+    return ",".join(
+        f"{scope}={version}"
+        for scope, version in zip(scopes, generations(*scopes))
+    )
+
+
+def cursor_key(request):
+    """Часть ключа кеша, по которой различаются страницы ленты."""
+    return "{}|{}".format(
+        request.GET.get("after", ""), request.GET.get("before", "")
+    )
+
+
+def feed_key(request, *scopes):
+    return f"{versions_key(*scopes)}|{cursor_key(request)}"
+
+
+def page_key(prefix, request, scopes):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"page:{prefix}:{path}:{versions_key(*scopes)}"
+
+
+def last_page_key(prefix, request):
+    """Ключ последней собранной версии страницы, любого поколения."""
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"page:{prefix}:{path}:last"
+
+
+def refresh_due(refresh_at, delta, now):
+    """
+    Вероятностное досрочное обновление (XFetch): чем ближе мягкий срок
+    и чем дольше пересборка, тем вероятнее, что запрос начнёт её сейчас.
+    """
+    return now - delta * EARLY_REFRESH_BETA * math.log(
+        1 - random.random()
+    ) >= refresh_at
+
+
+def single_flight(key, compute, timeout, grace=0, stale_key=None,
+                  cacheable=lambda value: True, refresh_within=0):
+    """
+    Значение по key или результат compute(), который одновременно
+    вычисляет только один запрос. Запись свежая timeout секунд и ещё
+    grace секунд отдаётся устаревшей, пока её пересобирают.
+    Возвращает значение и откуда оно: hit, stale (прежняя копия, в том
+    числе из stale_key), wait (дождались чужой пересборки), refresh
+    или miss (вычислено в этом запросе). Запись, которой до мягкого
+    срока осталось меньше refresh_within секунд, обновляется сразу.
+    """
+    entry = cache.get(key)
+    now = time.time()
+    if (entry is not None and entry[1] - now > refresh_within
+            and not refresh_due(*entry[1:], now)):
+        return entry[0], "hit"
+    lock = "lock:" + key
+    if not cache.add(lock, True, LOCK_TIMEOUT):
+        if entry is not None:
+            return entry[0], "stale"
+        stale = cache.get(stale_key) if stale_key else None
+        if stale is not None:
+            return stale, "stale"
+        deadline = time.monotonic() + WAIT
+        while time.monotonic() < deadline:
+            time.sleep(POLL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0], "wait"
+        # не дождались: считаем сами, но не мешаем пересборке
+        return compute(), "miss"
+    try:
+        started = time.monotonic()
+        value = compute()
+        if cacheable(value):
+            delta = time.monotonic() - started
+            cache.set(
+                key, (value, time.time() + timeout, delta), timeout + grace
+            )
+            if stale_key:
+                cache.set(stale_key, value, timeout + grace)
+    finally:
+        cache.delete(lock)
+    return value, "miss" if entry is None else "refresh"
+
+
+def shareable(request, response):
+    """
+    Можно ли отдавать ответ всем анонимам. Как и UpdateCacheMiddleware,
+    не кешируем ответы с куками, с Vary (ключ страницы заголовков
+    запроса не учитывает) и частные; страница с токеном CSRF тоже
+    своя у каждого посетителя.
+    """
+    if (response.status_code != 200 or response.streaming
+            or response.cookies or response.has_header("Vary")
+            or request.META.get("CSRF_COOKIE_USED")):
+        return False
+    directives = {
+        directive.split("=")[0].strip().lower()
+        for directive in cc_delim_re.split(response.get("Cache-Control", ""))
+    }
+    return not directives & {"private", "no-store"}
+
+
+def cache_page_for_anonymous(timeout, prefix, scopes=lambda request: [FEED],
+                             warm=False):
+    """
+    Кеширует страницу целиком только для анонимных посетителей: у них
+    одинаковая шапка, поэтому ответ общий для всех. Авторизованные
+    получают свежую шапку, а тяжёлая часть берётся из кеша фрагментов.
+    scopes(request, **kwargs) перечисляет области, от которых зависит
+    страница. Пока новое поколение страницы собирается, другие анонимы
+    получают предыдущее. Страницы с warm=True учитываются в posts.warmer
+    и пересобираются в фоне, если их часто запрашивают. Личные ответы
+    (см. shareable) не кешируются.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ("GET", "HEAD")
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+            # запрос фонового прогрева, а не посетителя
+            ahead = getattr(request, "warming_ahead", None)
+            response, result = single_flight(
+                page_key(prefix, request, scopes(request, **kwargs)),
+                lambda: view(request, *args, **kwargs),
+                timeout,
+                settings.PAGE_CACHE_GRACE,
+                stale_key=last_page_key(prefix, request),
+                cacheable=lambda response: shareable(request, response),
+                refresh_within=ahead or 0,
+            )
+            request.page_cache_result = result
+            if ahead is None:
+                PAGE_CACHE.inc(page=prefix, result=result)
+                if warm and response.status_code == 200:
+                    warmer.record(request.get_full_path())
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional(prefix, scopes=lambda request: [FEED]):
+    """
+    Отвечает 304 на If-None-Match / If-Modified-Since, не вызывая
+    представление: ETag складывается из адреса страницы, пользователя
+    с его токеном CSRF и поколений её областей, Last-Modified (только
+    для анонимов) — время их последнего изменения. Ни запроса ленты,
+    ни рендера шаблона при совпадении нет.
+    Временная копия из single_flight (stale, wait) уходит без валидаторов
+    и с no-store, чтобы браузер не держал её до следующего изменения.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            page_scopes = scopes(request, **kwargs)
+            user = request.user
+            personal = ""
+            if user.is_authenticated:
+                # в формах страницы токен CSRF, а он меняется при входе:
+                # старая страница с ним подтверждалась бы 304. get_token
+                # выдаёт токен и тем, кто пришёл без куки; сам он каждый
+                # раз маскируется заново, поэтому берём значение куки
+                get_token(request)
+                personal = "{}|{}".format(
+                    user.pk, request.META["CSRF_COOKIE"]
+                )
+            raw = "|".join([
+                prefix,
+                request.get_full_path(),
+                personal,
+                versions_key(*page_scopes),
+            ])
+            etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+            # время изменения смену токена не отражает: только ETag
+            modified = None if user.is_authenticated else last_modified(
+                *page_scopes
+            )
+            response = get_conditional_response(
+                request, etag=etag, last_modified=modified
+            )
+            if response is None:
+                response = view(request, *args, **kwargs)
+            # копия, отданная на время чужой пересборки, может быть
+            # прежнего поколения: с новым ETag её потом подтверждали бы 304
+            provisional = getattr(request, "page_cache_result", None) in (
+                "stale", "wait"
+            )
+            if response.status_code in (200, 304) and not provisional:
+                response["ETag"] = etag
+                if modified is not None:
+                    response["Last-Modified"] = http_date(modified)
+            # браузер переспрашивает каждый раз, а ответ зависит от входа
+            control = {"no_cache": True}
+            if provisional:
+                control["no_store"] = True
+            if user.is_authenticated:
+                control["private"] = True
+            patch_cache_control(response, **control)
+            patch_vary_headers(response, ("Cookie",))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,203 @@
+"""
+Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным UPDATE ... SET n = n + 1 в обработчиках
+сигналов, поэтому страницы читают готовые числа вместо COUNT(*).
+Расхождения чинит команда rebuild_counters.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import AuthorCounters, Comment, Follow, Post, PostCounters
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+def count_of(model, field):
+    rows = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def author_counts():
+    return User.objects.annotate(
+        posts_count=count_of(Post, "author"),
+        followers_count=count_of(Follow, "author"),
+        following_count=count_of(Follow, "user"),
+    )
+
+
+def post_counts():
+    return Post.objects.annotate(comments_count=count_of(Comment, "post"))
+
+
+def recount_author(author_id):
+    author = author_counts().filter(pk=author_id).first()
+    if author is None:
+        return
+    AuthorCounters.objects.update_or_create(
+        author_id=author_id,
+        defaults={
+            "posts_count": author.posts_count,
+            "followers_count": author.followers_count,
+            "following_count": author.following_count,
+        }
+    )
+
+
+def recount_post(post_id):
+    post = post_counts().filter(pk=post_id).first()
+    if post is None:
+        return
+    PostCounters.objects.update_or_create(
+        post_id=post_id,
+        defaults={"comments_count": post.comments_count}
+    )
+
+
+def pulled_for(followers_count, was_pulled=False):
+    """
+    Читать ли посты автора при чтении лент, а не раскладывать
+    (posts.timeline): с TIMELINE_FANOUT_LIMIT подписчиков, а для автора,
+    который уже в этом режиме, — пока он не опустится ещё на
+    TIMELINE_FANOUT_MARGIN.
+    """
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    if was_pulled:
+        limit -= settings.TIMELINE_FANOUT_MARGIN
+    return followers_count >= limit
+
+
+def recreate_authors(authors):
+    """Заново создаёт строки счётчиков, сохраняя режим ленты авторов."""
+    authors = list(authors)
+    pks = [author.pk for author in authors]
+    was_pulled = set(AuthorCounters.objects.filter(
+        pk__in=pks, pulled=True
+    ).values_list("pk", flat=True))
+    AuthorCounters.objects.filter(pk__in=pks).delete()
+    AuthorCounters.objects.bulk_create(
+        AuthorCounters(
+            author_id=author.pk,
+            posts_count=author.posts_count,
+            followers_count=author.followers_count,
+            following_count=author.following_count,
+            pulled=pulled_for(
+                author.followers_count, author.pk in was_pulled
+            ),
+        )
+        for author in authors
+    )
+
+
+def recount_authors(author_ids):
+    """recount_author для многих авторов одним запросом."""
+    recreate_authors(author_counts().filter(pk__in=author_ids))
+
+
+def recount_posts(post_ids):
+    posts = list(post_counts().filter(pk__in=post_ids))
+    PostCounters.objects.filter(pk__in=post_ids).delete()
+    PostCounters.objects.bulk_create(
+        PostCounters(post_id=post.pk, comments_count=post.comments_count)
+        for post in posts
+    )
+
+
+def change(model, pk, recount, **deltas):
+    """
+    Сдвигает счётчики строки model на deltas. Если строки ещё нет,
+    при увеличении она пересчитывается с нуля; при уменьшении
+    отсутствующая строка пропускается, чтобы не создавать её для
+    объекта, который сейчас удаляется каскадом.
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(pk=pk).update(**changes):
+        return
+    if all(delta > 0 for delta in deltas.values()):
+        recount(pk)
+
+
+def post_added(post):
+    change(AuthorCounters, post.author_id, recount_author, posts_count=1)
+
+
+def post_removed(post):
+    change(AuthorCounters, post.author_id, recount_author, posts_count=-1)
+
+
+def comment_added(comment):
+    change(PostCounters, comment.post_id, recount_post, comments_count=1)
+
+
+def comment_removed(comment):
+    change(PostCounters, comment.post_id, recount_post, comments_count=-1)
+
+
+def follow_added(follow):
+    change(AuthorCounters, follow.author_id, recount_author,
+           followers_count=1)
+    change(AuthorCounters, follow.user_id, recount_author,
+           following_count=1)
+
+
+def follow_removed(follow):
+    change(AuthorCounters, follow.author_id, recount_author,
+           followers_count=-1)
+    change(AuthorCounters, follow.user_id, recount_author,
+           following_count=-1)
+
+
+def for_author(author):
+    try:
+        return author.counters
+    except AuthorCounters.DoesNotExist:
+        recount_author(author.pk)
+        return AuthorCounters.objects.get(pk=author.pk)
+
+
+def for_post(post):
+    try:
+        return post.counters
+    except PostCounters.DoesNotExist:
+        recount_post(post.pk)
+        return PostCounters.objects.get(pk=post.pk)
+
+
+def followers_of(author_id):
+    return AuthorCounters.objects.filter(pk=author_id).values_list(
+        "followers_count", flat=True
+    ).first() or 0
+
+
+def in_batches(queryset):
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by("pk")[
+            :BATCH_SIZE
+        ])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def rebuild():
+    PostCounters.objects.all().delete()
+    # строки авторов заменяются пачками: так сохраняется их режим ленты
+    for authors in in_batches(author_counts()):
+        recreate_authors(authors)
+    for posts in in_batches(post_counts()):
+        PostCounters.objects.bulk_create(
+            PostCounters(post_id=post.pk, comments_count=post.comments_count)
+            for post in posts
+        )
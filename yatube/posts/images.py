@@ -0,0 +1,77 @@
+"""
+Учёт ссылок на файлы картинок постов.
+
+Одинаковые загрузки хранятся одним файлом (posts.storage), поэтому
+удалять файл можно, только когда на него не ссылается ни один пост.
+Счётчики меняются в сигналах Post, а файл вместе с превью удаляется
+после коммита, если счётчик дошёл до нуля. Загрузка, которая нашла
+такой файл на диске, блокирует его строку учёта (pin) до коммита, а collect
+удаляет файл в той же транзакции, что и строку: одновременно файл
+не может быть и переиспользован, и удалён.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from sorl.thumbnail import delete
+from sorl.thumbnail.images import ImageFile
+
+from .models import Post, StoredImage
+
+
+def storage():
+    return Post._meta.get_field("image").storage
+
+
+def acquire(name):
+    if not name:
+        return
+    updated = StoredImage.objects.filter(name=name).update(
+        refs=F("refs") + 1
+    )
+    if not updated:
+        stored, created = StoredImage.objects.get_or_create(
+            name=name, defaults={"refs": 1}
+        )
+        if not created:
+            StoredImage.objects.filter(name=name).update(
+                refs=F("refs") + 1
+            )
+
+
+def pin(name):
+    """
+    Блокирует строку учёта ссылок на файл до конца транзакции: пока
+    новый пост, переиспользующий файл, не сохранён, collect ждёт.
+    """
+    # пустой UPDATE: select_for_update в SQLite ничего не блокирует
+    StoredImage.objects.filter(name=name).update(refs=F("refs"))
+
+
+def release(name):
+    if not name:
+        return
+    StoredImage.objects.filter(name=name, refs__gt=0).update(
+        refs=F("refs") - 1
+    )
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    """Удаляет файл и его превью, если ссылок на него не осталось."""
+    with transaction.atomic():
+        deleted, _ = StoredImage.objects.filter(name=name, refs=0).delete()
+        if deleted:
+            delete(ImageFile(name, storage()))
+
+
+def rebuild():
+    """Пересчитывает ссылки по постам."""
+    refs = dict(
+        Post.objects.exclude(image="").exclude(image=None)
+        .order_by().values("image").annotate(n=Count("id"))
+        .values_list("image", "n")
+    )
+    StoredImage.objects.exclude(name__in=refs).delete()
+    for name, n in refs.items():
+        StoredImage.objects.update_or_create(
+            name=name, defaults={"refs": n}
+        )
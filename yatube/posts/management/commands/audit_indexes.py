@@ -0,0 +1,119 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import urls
+from posts.models import Follow, Group, Post
+from posts.paginator import encode_cursor
+
+User = get_user_model()
+
+# Выпадающий список групп в форме поста читает всю таблицу намеренно.
+ALLOWED_SCANS = {"posts_group"}
+
+FULL_SCAN = re.compile(
+    r"^SCAN (?:TABLE )?(\w+)(?!.* USING (?:COVERING )?INDEX)"
+)
+TEMP_SORT = re.compile(r"USE TEMP B-TREE")
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет EXPLAIN QUERY PLAN для запросов каждой страницы "
+        "posts.urls и падает, если план читает таблицу целиком "
+        "или сортирует во временном B-дереве"
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Аудит рассчитан на планы SQLite")
+        problems = []
+        try:
+            with transaction.atomic():
+                for view_name, sql, detail in self.audit():
+                    problems.append((view_name, sql, detail))
+                raise Rollback
+        except Rollback:
+            pass
+        for view_name, sql, detail in problems:
+            self.stderr.write(f"{view_name}: {detail}\n    {sql}")
+        if problems:
+            raise CommandError(f"Планов без индекса: {len(problems)}")
+        self.stdout.write("Все запросы страниц используют индексы")
+
+    def audit(self):
+        user, kwargs = self.sample_objects()
+        client = Client()
+        client.force_login(user)
+        cursor = encode_cursor([timezone.now(), 0])
+        for view_name, path in self.view_paths(kwargs):
+            for query in ({}, {"after": cursor}):
+                for sql, params in self.capture(client, path, query):
+                    for detail in self.explain(sql, params):
+                        if self.is_problem(detail):
+                            yield view_name, sql, detail
+
+    def sample_objects(self):
+        user = User.objects.create_user(username="audit_reader")
+        author = User.objects.create_user(username="audit_author")
+        group = Group.objects.create(
+            title="audit", slug="audit-group", description="audit"
+        )
+        post = Post.objects.create(author=author, group=group, text="audit")
+        Follow.objects.create(user=user, author=author)
+        return user, {
+            "slug": group.slug,
+            "username": author.username,
+            "post_id": post.id,
+        }
+
+    def view_paths(self, kwargs):
+        for pattern in urls.urlpatterns:
+            names = pattern.pattern.converters.keys()
+            view_name = f"{urls.app_name}:{pattern.name}"
+            path = reverse(
+                view_name, kwargs={name: kwargs[name] for name in names}
+            )
+            yield view_name, path
+
+    def capture(self, client, path, query):
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith("SELECT"):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        dummy_cache = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.dummy.DummyCache"
+            }
+        }
+        with override_settings(CACHES=dummy_cache):
+            with connection.execute_wrapper(record):
+                response = client.get(path, query)
+                if response.streaming:
+                    # запросы JSON-API выполняются при чтении тела
+                    b"".join(response.streaming_content)
+        return queries
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def is_problem(self, detail):
+        if TEMP_SORT.search(detail):
+            return True
+        match = FULL_SCAN.search(detail)
+        return match is not None and match.group(1) not in ALLOWED_SCANS
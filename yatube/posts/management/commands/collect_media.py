@@ -0,0 +1,164 @@
+import json
+import posixpath
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts import images
+from posts.models import Post, StoredImage
+from posts.utils import chunked
+
+
+def walk(storage, path):
+    """Файлы каталога хранилища по одному, каталог за каталогом."""
+    if not storage.exists(path):
+        return
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield posixpath.join(path, name)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет картинки, на которые не ссылается ни один пост, их превью "
+        "и записи sorl о них, а также превью без записей в хранилище "
+        "ключей. Хранилище обходится по частям, не целиком в памяти"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только показать, что было бы удалено"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=500,
+            help="Сколько файлов или записей сверять одним запросом"
+        )
+        parser.add_argument(
+            "--rate", type=float, default=0,
+            help="Не больше стольких удалений в секунду (0 — без ограничения)"
+        )
+        parser.add_argument(
+            "--min-age", type=int, default=60 * 60,
+            help=(
+                "Не трогать файлы моложе стольких секунд: картинка "
+                "сохраняется раньше, чем пост попадает в базу"
+            )
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        self.dry_run = options["dry_run"]
+        self.chunk_size = options["chunk_size"]
+        self.pause = 1 / options["rate"] if options["rate"] else 0
+        self.born_before = timezone.now() - timedelta(
+            seconds=options["min_age"]
+        )
+        self.stats = {"originals": 0, "entries": 0, "thumbnails": 0}
+        self.freed = 0
+        self.collect_originals()
+        self.collect_entries()
+        self.collect_thumbnails()
+        verb = "Найдено" if self.dry_run else "Удалено"
+        self.stdout.write(
+            f"{verb}: картинок {self.stats['originals']}, "
+            f"записей sorl {self.stats['entries']}, "
+            f"превью {self.stats['thumbnails']}; "
+            f"освобождено байт: {self.freed}"
+        )
+
+    def collect_originals(self):
+        storage = images.storage()
+        upload_to = Post._meta.get_field("image").upload_to
+        for names in chunked(walk(storage, upload_to), self.chunk_size):
+            used = set(
+                Post.objects.filter(image__in=names)
+                .values_list("image", flat=True)
+            )
+            for name in names:
+                if name in used or not self.old_enough(storage, name):
+                    continue
+                self.remove("originals", name, storage)
+                if not self.dry_run:
+                    StoredImage.objects.filter(name=name).delete()
+                    # вместе с записями sorl об исходнике и его превью
+                    default.kvstore.delete(ImageFile(name, storage))
+
+    def collect_entries(self):
+        """Записи sorl об исходниках, которых больше нет в постах."""
+        prefix = add_prefix("")
+        last_key = prefix
+        while True:
+            entries = list(
+                KVStoreModel.objects.filter(
+                    key__gt=last_key, key__startswith=prefix
+                ).order_by("key").values_list("key", "value")[
+                    :self.chunk_size
+                ]
+            )
+            if not entries:
+                return
+            last_key = entries[-1][0]
+            sources = {}
+            for key, value in entries:
+                name = json.loads(value)["name"]
+                if not name.startswith(sorl_settings.THUMBNAIL_PREFIX):
+                    sources[name] = value
+            used = set(
+                Post.objects.filter(image__in=list(sources))
+                .values_list("image", flat=True)
+            )
+            for name, value in sources.items():
+                if name in used:
+                    continue
+                self.report("entries", name)
+                if not self.dry_run:
+                    default.kvstore.delete(deserialize_image_file(value))
+                    self.throttle()
+
+    def collect_thumbnails(self):
+        """Файлы превью, о которых sorl ничего не знает."""
+        storage = default.storage
+        files = walk(storage, sorl_settings.THUMBNAIL_PREFIX.rstrip("/"))
+        for names in chunked(files, self.chunk_size):
+            keys = {
+                add_prefix(ImageFile(name, storage).key): name
+                for name in names
+            }
+            known = set(
+                KVStoreModel.objects.filter(key__in=list(keys))
+                .values_list("key", flat=True)
+            )
+            for key, name in keys.items():
+                if key in known or not self.old_enough(storage, name):
+                    continue
+                self.remove("thumbnails", name, storage)
+
+    def old_enough(self, storage, name):
+        return storage.get_modified_time(name) < self.born_before
+
+    def report(self, kind, name):
+        self.stats[kind] += 1
+        if self.verbosity > 1:
+            self.stdout.write(f"{kind}: {name}")
+
+    def remove(self, kind, name, storage):
+        self.report(kind, name)
+        self.freed += storage.size(name)
+        if self.dry_run:
+            return
+        storage.delete(name)
+        self.throttle()
+
+    def throttle(self):
+        if self.pause:
+            time.sleep(self.pause)
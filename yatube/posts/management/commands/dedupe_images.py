@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import images
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит картинки, загруженные до хранения по содержимому, "
+        "под имена из хеша: одинаковые файлы становятся одним"
+    )
+
+    def handle(self, *args, **options):
+        storage = images.storage()
+        names = (
+            Post.objects.exclude(image="").exclude(image=None)
+            .order_by().values_list("image", flat=True).distinct()
+        )
+        moved = missing = 0
+        for name in list(names):
+            if not storage.exists(name):
+                missing += 1
+                continue
+            # файл под новым именем сохраняется в одной транзакции
+            # с постами, иначе его может удалить images.collect
+            with storage.open(name) as content, transaction.atomic():
+                new_name = storage.content_name(name, content)
+                if new_name == name:
+                    continue
+                storage.save(name, content)
+                # сигналы Post переносят ссылку и удалят старый файл
+                for post in Post.objects.filter(image=name):
+                    post.image = new_name
+                    post.save(update_fields=["image"])
+            moved += 1
+        self.stdout.write(
+            f"Перенесено файлов: {moved}, не найдено: {missing}"
+        )
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.importer import BATCH_SIZE, Importer, InvalidRecord
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает группы, посты, комментарии и подписки из JSONL пачками "
+        "через bulk_create, сохраняя даты источника. Повторный запуск "
+        "продолжает с места сбоя"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл JSONL или - для stdin")
+        parser.add_argument(
+            "--batch-size", type=int, default=BATCH_SIZE,
+            help="Строк в одной транзакции"
+        )
+        parser.add_argument(
+            "--source",
+            help=(
+                "Имя источника для продолжения и сопоставления id постов; "
+                "по умолчанию — абсолютный путь к файлу"
+            )
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        source = options["source"]
+        if source is None:
+            if path == "-":
+                raise CommandError("Для stdin укажите --source")
+            source = os.path.abspath(path)
+        importer = Importer(source, options["batch_size"])
+        start = importer.lines_done()
+        if start:
+            self.stdout.write(f"Продолжаем после строки {start}")
+        started = time.monotonic()
+        stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        try:
+            with stream:
+                for line in importer.run(stream, start):
+                    self.report(importer, line - start, started)
+        except InvalidRecord as error:
+            raise CommandError(
+                f"Импорт остановлен, {error}. Записанные пачки сохранены, "
+                "после исправления запустите команду снова"
+            )
+        except FileNotFoundError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS("Импорт завершён"))
+
+    def report(self, importer, lines, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rows = sum(importer.imported.values())
+        details = ", ".join(
+            f"{kind}: {count}"
+            for kind, count in importer.imported.items() if count
+        )
+        self.stdout.write(
+            f"Строк: {lines}, записей: {rows} ({details}), "
+            f"{rows / elapsed:.0f} записей/с"
+        )
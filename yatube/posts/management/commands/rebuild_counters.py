@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+from posts.models import AuthorCounters, PostCounters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики постов, комментариев и подписок с нуля"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            counters.rebuild()
+        self.stdout.write(
+            f"Авторов: {AuthorCounters.objects.count()}, "
+            f"постов: {PostCounters.objects.count()}"
+        )
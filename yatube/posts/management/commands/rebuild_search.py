@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Создаёт полнотекстовый индекс FTS5 и перестраивает его по постам"
+
+    def handle(self, *args, **options):
+        search.install()
+        if not search.installed():
+            raise CommandError("База данных не поддерживает FTS5")
+        search.rebuild()
+        self.stdout.write("Поисковый индекс перестроен")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+from posts.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = "Пересобирает ленты подписок (TimelineEntry) из Follow и Post"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            timeline.rebuild()
+        self.stdout.write(
+            f"Записей в лентах: {TimelineEntry.objects.count()}"
+        )
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from posts import warmer
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогревает кеш страниц по сохранённому списку горячих страниц "
+        "(после выкладки или очистки кеша)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="*",
+            help="Адреса страниц; по умолчанию — из CACHE_WARMER_STATE"
+        )
+        parser.add_argument(
+            "--limit", type=int, default=settings.CACHE_WARMER_PAGES,
+            help="Сколько самых частых страниц из списка прогреть"
+        )
+
+    def handle(self, *args, **options):
+        paths = options["paths"]
+        if not paths:
+            saved = warmer.load()
+            paths = sorted(saved, key=lambda path: -saved[path])
+            paths = paths[:options["limit"]]
+            home = reverse("posts:home_page")
+            if home not in paths:
+                paths.insert(0, home)
+        results = warmer.warm(paths)
+        self.stdout.write(
+            f"Страниц: {len(paths)}, пересобрано: {results['rendered']}, "
+            f"уже в кеше: {results['fresh']}, ошибок: {results['error']}"
+        )
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled(apps, schema_editor):
+    AuthorCounters = apps.get_model('posts', 'AuthorCounters')
+    AuthorCounters.objects.filter(
+        followers_count__gte=settings.TIMELINE_FANOUT_LIMIT
+    ).update(pulled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_imports'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorcounters',
+            name='pulled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_pulled, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -41,6 +43,7 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True,
         help_text='Загрузите картинку'
@@ -51,6 +54,20 @@ class Post(models.Model):
 
     class Meta:
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(
+                fields=["-pub_date", "-id"],
+                name="post_pub_date_idx"
+            ),
+            models.Index(
+                fields=["author", "-pub_date", "-id"],
+                name="post_author_pub_date_idx"
+            ),
+            models.Index(
+                fields=["group", "-pub_date", "-id"],
+                name="post_group_pub_date_idx"
+            ),
+        ]
 
 
 class Comment(models.Model):
@@ -76,6 +93,14 @@ class Comment(models.Model):
         auto_now_add=True
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["post", "created", "id"],
+                name="comment_post_created_idx"
+            ),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -88,3 +113,114 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name="following"
     )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "author"],
+                name="follow_user_author_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["author", "user"],
+                name="follow_author_user_idx"
+            ),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """
+    Строка материализованной ленты подписок: пост автора, на которого
+    подписан user. Заполняется при публикации (fan-out on write).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="timeline"
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries"
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"],
+                name="timeline_user_post_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-pub_date", "-post"],
+                name="timeline_user_pub_date_idx"
+            ),
+            models.Index(
+                fields=["user", "author"],
+                name="timeline_user_author_idx"
+            ),
+        ]
+
+
+class AuthorCounters(models.Model):
+    """Счётчики автора, которые обновляются вместе с записью."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="counters"
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # посты автора подмешиваются при чтении лент (posts.timeline)
+    pulled = models.BooleanField(default=False)
+
+
+class PostCounters(models.Model):
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="counters"
+    )
+    comments_count = models.PositiveIntegerField(default=0)
+
+
+class StoredImage(models.Model):
+    """Число постов, ссылающихся на файл картинки."""
+    name = models.CharField(max_length=255, primary_key=True)
+    refs = models.PositiveIntegerField(default=0)
+
+
+class ImportProgress(models.Model):
+    """Сколько строк источника уже загружено командой import_jsonl."""
+    source = models.CharField(max_length=255, primary_key=True)
+    lines = models.PositiveIntegerField(default=0)
+
+
+class ImportedPost(models.Model):
+    """Id поста в исходной системе: по нему импорт находит пост."""
+    source = models.CharField(max_length=255)
+    external_id = models.CharField(max_length=64)
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source", "external_id"],
+                name="imported_post_uniq"
+            ),
+        ]
@@ -0,0 +1,214 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    """Упаковывает значения ключа сортировки в непрозрачный токен."""
+    payload = [
+        {"dt": value.isoformat()} if isinstance(value, datetime.datetime)
+        else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def parse_moment(value):
+    moment = None
+    if isinstance(value, str):
+        try:
+            moment = parse_datetime(value)
+        except ValueError:
+            # формат верный, но такой даты нет: 2020-13-40
+            pass
+    if moment is None:
+        raise InvalidCursor(value)
+    return moment
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw.decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+    if not isinstance(payload, list):
+        raise InvalidCursor(token)
+    values = []
+    for value in payload:
+        if isinstance(value, dict):
+            value = parse_moment(value.get("dt"))
+        values.append(value)
+    return values
+
+
+def reverse_ordering(ordering):
+    return tuple(
+        field[1:] if field.startswith("-") else "-" + field
+        for field in ordering
+    )
+
+
+def keyset_filter(ordering, values):
+    """
+    Условие «строго после курсора» для заданной сортировки:
+    (a, b) после (x, y) <=> a > x или (a = x и b > y).
+    """
+    if len(values) != len(ordering):
+        raise InvalidCursor(values)
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition |= Q(**equal, **{f"{name}__{lookup}": value})
+        equal[name] = value
+    return condition
+
+
+def clean_cursor(model, ordering, values):
+    """
+    Приводит значения курсора к типам полей сортировки. Токен подделать
+    легко: чужой тип или null — неверный курсор, а не ошибка базы.
+    """
+    if len(values) != len(ordering):
+        raise InvalidCursor(values)
+    cleaned = []
+    for field, value in zip(ordering, values):
+        if value is None or isinstance(value, (list, dict)):
+            raise InvalidCursor(values)
+        model_field = model._meta.get_field(field.lstrip("-"))
+        try:
+            cleaned.append(model_field.to_python(value))
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(values)
+    return cleaned
+
+
+def sort_key(item, ordering):
+    values = []
+    for field in ordering:
+        name = field.lstrip("-")
+        if isinstance(item, dict):
+            values.append(item[name])
+        else:
+            values.append(getattr(item, name))
+    return values
+
+
+class CursorPaginator(Paginator):
+    """
+    Постраничная навигация по ключу сортировки (keyset) вместо
+    OFFSET/COUNT: страница — это per_page строк строго после
+    (или до) курсора, поэтому глубокие страницы не медленнее первой.
+    """
+
+    def __init__(self, object_list, per_page, ordering=("-pub_date", "-id")):
+        super().__init__(object_list, per_page)
+        self.ordering = tuple(ordering)
+
+    def get_page(self, after=None, before=None):
+        try:
+            return self.page(after=after, before=before)
+        except InvalidCursor:
+            return self.page()
+
+    def page(self, after=None, before=None):
+        if before:
+            rows = self.fetch(decode_cursor(before), backwards=True)
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            return CursorPage(rows, self, has_next=True,
+                              has_previous=has_previous)
+        cursor = decode_cursor(after) if after else None
+        rows = self.fetch(cursor, backwards=False)
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, has_next=has_next,
+                          has_previous=cursor is not None)
+
+    def rows_after(self, cursor, backwards):
+        """Ещё не выполненный запрос до per_page + 1 строк после курсора."""
+        ordering = self.ordering
+        if backwards:
+            ordering = reverse_ordering(ordering)
+        queryset = self.object_list.order_by(*ordering)
+        if cursor is not None:
+            cursor = clean_cursor(self.object_list.model, ordering, cursor)
+            queryset = queryset.filter(keyset_filter(ordering, cursor))
+        return queryset[:self.per_page + 1]
+
+    def fetch(self, cursor, backwards):
+        """Возвращает до per_page + 1 строк после курсора."""
+        return list(self.rows_after(cursor, backwards))
+
+    def cursor_for(self, item):
+        return encode_cursor(sort_key(item, self.ordering))
+
+
+NO_NUMBERS = (
+    "У страницы по курсору нет номера: используйте next_cursor "
+    "и previous_cursor"
+)
+
+
+class CursorPage(Page):
+    """
+    Страница CursorPaginator. Номер, индексы строк и номера соседних
+    страниц потребовали бы COUNT и OFFSET, поэтому их нет: обращение
+    к ним — ошибка, а не None в адресе ссылки.
+    """
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return "<CursorPage of %s items>" % len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def number(self):
+        raise NotImplementedError(NO_NUMBERS)
+
+    def next_page_number(self):
+        raise NotImplementedError(NO_NUMBERS)
+
+    def previous_page_number(self):
+        raise NotImplementedError(NO_NUMBERS)
+
+    def start_index(self):
+        raise NotImplementedError(NO_NUMBERS)
+
+    def end_index(self):
+        raise NotImplementedError(NO_NUMBERS)
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.cursor_for(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.cursor_for(self.object_list[0])
+        return None
@@ -0,0 +1,166 @@
+"""
+Полнотекстовый поиск по Post.text на SQLite FTS5.
+
+Индекс posts_post_fts — внешний контент-индекс над posts_post, его
+синхронизируют триггеры. Таблица и триггеры создаются после migrate
+(пересоздание posts_post в миграциях SQLite удаляет триггеры), а
+команда rebuild_search перестраивает индекс из существующих постов.
+"""
+import re
+
+from django.db import OperationalError, connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+from .paginator import CursorPaginator, InvalidCursor, encode_cursor
+
+TABLE = "posts_post_fts"
+
+SCHEMA = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        text, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_delete
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {TABLE}({TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_update
+    AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {TABLE}({TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+)
+
+TERMS = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def installed():
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def install(**kwargs):
+    if connection.vendor != "sqlite":
+        return
+    created = not installed()
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+    except OperationalError:
+        # SQLite собран без FTS5: поиск работает через LIKE
+        return
+    if created:
+        rebuild()
+
+
+def rebuild():
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('rebuild')")
+
+
+def to_match(query):
+    """
+    Переводит запрос пользователя в синтаксис FTS5: "фраза в кавычках"
+    ищется целиком, слово* — по префиксу, остальные слова — все сразу.
+    """
+    terms = []
+    for phrase, word in TERMS.findall(query):
+        if phrase.strip():
+            terms.append('"{}"'.format(phrase.strip()))
+            continue
+        word = word.replace('"', "")
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"{}"{}'.format(word, "*" if prefix else ""))
+    return " ".join(terms)
+
+
+def matching(queryset, query):
+    """Сужает queryset постов до подходящих под запрос (для админки)."""
+    match = to_match(query)
+    if not match:
+        return queryset.none()
+    if not installed():
+        return queryset.filter(text__icontains=query)
+    return queryset.filter(id__in=RawSQL(
+        f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [match]
+    ))
+
+
+def ranked_ids(match, cursor, backwards, limit):
+    """
+    id и ранг (bm25, меньше — лучше) подходящих постов в порядке
+    релевантности строго после курсора (rank, id).
+    """
+    sql = (
+        f"SELECT id, rank FROM ("
+        f"SELECT rowid AS id, bm25({TABLE}) AS rank "
+        f"FROM {TABLE} WHERE {TABLE} MATCH %s)"
+    )
+    params = [match]
+    compare, order = (">", "ASC") if not backwards else ("<", "DESC")
+    if cursor is not None:
+        rank, post_id = cursor
+        sql += f" WHERE rank {compare} %s OR (rank = %s AND id {compare} %s)"
+        params += [rank, rank, post_id]
+    sql += f" ORDER BY rank {order}, id {order} LIMIT %s"
+    params.append(limit)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        return db_cursor.fetchall()
+
+
+class SearchPaginator(CursorPaginator):
+    """Листает результаты поиска по релевантности, ключ — (rank, id)."""
+
+    def __init__(self, query, per_page):
+        super().__init__(query, per_page, ordering=("rank", "id"))
+        self.match = to_match(query)
+
+    def fetch(self, cursor, backwards):
+        if not self.match:
+            return []
+        if cursor is not None and (
+            len(cursor) != 2
+            or not all(
+                isinstance(value, (int, float))
+                and not isinstance(value, bool) for value in cursor
+            )
+        ):
+            raise InvalidCursor(cursor)
+        rows = ranked_ids(self.match, cursor, backwards, self.per_page + 1)
+        posts = Post.objects.select_related("author", "group").in_bulk(
+            [post_id for post_id, rank in rows]
+        )
+        found = []
+        for post_id, rank in rows:
+            if post_id in posts:
+                posts[post_id].rank = rank
+                found.append(posts[post_id])
+        return found
+
+    def cursor_for(self, item):
+        return encode_cursor([item.rank, item.id])
+
+
+def paginator_for(query, per_page):
+    if installed():
+        return SearchPaginator(query, per_page)
+    return CursorPaginator(
+        Post.objects.filter(text__icontains=query), per_page
+    )
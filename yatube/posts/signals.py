@@ -0,0 +1,147 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import cache, counters, images, timeline
+from .models import (AuthorCounters, Comment, Follow, Group, Post,
+                     PostCounters)
+
+User = get_user_model()
+
+
+def invalidate_post(post):
+    scopes = cache.post_scopes(
+        post.id, post.author.username, post.group and post.group.slug
+    )
+    if getattr(post, "_old_group_slug", None):
+        scopes.append(cache.group_scope(post._old_group_slug))
+    cache.bump(cache.FEED, *scopes)
+
+
+def login_only(update_fields):
+    # вход пользователя сохраняет только время входа: страниц это не меняет
+    return update_fields is not None and set(update_fields) == {"last_login"}
+
+
+def user_scopes(user):
+    """Области страниц, на которых видно имя пользователя."""
+    scopes = [cache.FEED, cache.author_scope(user.username)]
+    scopes += [
+        cache.group_scope(slug) for slug in Group.objects.filter(
+            posts__author=user
+        ).values_list("slug", flat=True).distinct()
+    ]
+    scopes += [
+        cache.post_scope(post_id) for post_id in Comment.objects.filter(
+            author=user
+        ).values_list("post_id", flat=True).distinct()
+    ]
+    return scopes
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    if instance.pk and not login_only(update_fields):
+        instance._old_username = User.objects.filter(
+            pk=instance.pk
+        ).values_list("username", flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        AuthorCounters.objects.get_or_create(author=instance)
+        return
+    if login_only(update_fields):
+        return
+    scopes = user_scopes(instance)
+    old_username = getattr(instance, "_old_username", None)
+    if old_username and old_username != instance.username:
+        # по старому адресу профиля теперь должна быть 404
+        scopes.append(cache.author_scope(old_username))
+    cache.bump(*scopes)
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+    if instance.pk:
+        instance._old_group_slug, instance._old_image = Post.objects.filter(
+            pk=instance.pk
+        ).values_list("group__slug", "image").first() or (None, None)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        PostCounters.objects.get_or_create(post=instance)
+        counters.post_added(instance)
+        timeline.fan_out(instance)
+    old_image = getattr(instance, "_old_image", None)
+    if instance.image.name != old_image:
+        images.acquire(instance.image.name)
+        images.release(old_image)
+    invalidate_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.post_removed(instance)
+    images.release(instance.image.name)
+    invalidate_post(instance)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, **kwargs):
+    cache.bump(cache.FEED, cache.group_scope(instance.slug))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # после удаления у постов группы уже не будет: авторов запоминаем до
+    instance._authors = list(User.objects.filter(
+        posts__group=instance
+    ).values_list("username", flat=True).distinct())
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    cache.bump(
+        cache.FEED, cache.group_scope(instance.slug),
+        *map(cache.author_scope, getattr(instance, "_authors", [])),
+    )
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.comment_added(instance)
+    cache.bump(cache.post_scope(instance.post_id))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.comment_removed(instance)
+    cache.bump(cache.post_scope(instance.post_id))
+
+
+def invalidate_follow(follow):
+    cache.bump(
+        cache.author_scope(follow.author.username),
+        cache.author_scope(follow.user.username),
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.follow_added(instance)
+        timeline.followed(instance.user_id, instance.author_id)
+    invalidate_follow(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.follow_removed(instance)
+    timeline.unfollowed(instance.user_id, instance.author_id)
+    invalidate_follow(instance)
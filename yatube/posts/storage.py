@@ -0,0 +1,57 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.transaction import TransactionManagementError
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранит файл под именем из SHA-256 его содержимого: одинаковые
+    загрузки становятся одним файлом (и одним набором превью).
+    Из исходного имени остаются только каталог и расширение.
+    Сохранять файл можно только в транзакции, которая сохраняет и пост.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in iter(lambda: content.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        key = digest.hexdigest()
+        return os.path.join(directory, key[:2], key[2:4], key + extension)
+
+    def get_available_name(self, name, max_length=None):
+        # настоящее имя выбирает _save по содержимому
+        return name
+
+    def _save(self, name, content):
+        # images импортирует модели, а модели — это хранилище
+        from . import images
+
+        # блокировка pin держится до коммита: без внешней транзакции
+        # она снялась бы раньше, чем пост сошлётся на файл (images.acquire)
+        if not transaction.get_connection().in_atomic_block:
+            raise TransactionManagementError(
+                "Картинку поста сохраняют в transaction.atomic вместе с постом"
+            )
+        name = self.content_name(name, content)
+        # файл без ссылок может удаляться прямо сейчас (images.collect):
+        # сначала блокировка учёта ссылок, потом проверка файла
+        images.pin(name)
+        if self.exists(name):
+            return name
+        # пишем во временный файл и атомарно переименовываем: двое
+        # одновременно загрузивших одну картинку не помешают друг другу
+        temp = super()._save(f"{name}.{uuid.uuid4().hex}.tmp", content)
+        os.replace(self.path(temp), self.path(name))
+        return name
@@ -0,0 +1,13 @@
+from django import template
+
+from .. import thumbnails
+
+register = template.Library()
+
+# ширина ленты: на узких экранах во всю ширину, иначе не больше 960px
+FEED_SIZES = "(max-width: 960px) 100vw, 960px"
+
+
+@register.inclusion_tag("posts/includes/post_image.html")
+def post_picture(image, sizes=FEED_SIZES):
+    return {"sizes": sizes, **thumbnails.srcsets(image)}
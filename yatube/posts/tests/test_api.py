@@ -0,0 +1,169 @@
+import json
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Comment, Group, Post
+from ..paginator import encode_cursor
+
+User = get_user_model()
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.group = Group.objects.create(
+            title="Коты", slug="cats", description="Мяу"
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user,
+                group=cls.group if number % 2 else None,
+                text=f"Пост {number}",
+            )
+            for number in range(5)
+        ]
+        start = timezone.now() - timedelta(days=5)
+        for number, post in enumerate(cls.posts):
+            Post.objects.filter(pk=post.pk).update(
+                pub_date=start + timedelta(days=number)
+            )
+        cls.post = cls.posts[-1]
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f"Комментарий {number}"
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def get(self, url, **params):
+        response = self.guest_client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            return json.loads(b"".join(response.streaming_content))
+        return json.loads(response.content)
+
+    def ids(self, data):
+        return [item["id"] for item in data["results"]]
+
+    def test_feed_is_streamed(self):
+        """Лента отдаётся потоком, свежие посты первыми"""
+        response = self.guest_client.get(reverse("posts:api_index"))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"].split(";")[0],
+                         "application/json")
+        data = self.get(reverse("posts:api_index"))
+        self.assertEqual(
+            self.ids(data), [post.id for post in reversed(self.posts)]
+        )
+        item = data["results"][0]
+        self.assertEqual(item["author"], "auth")
+        self.assertEqual(item["text"], "Пост 4")
+        self.assertEqual(item["comments"], 3)
+        self.assertIsNone(item["image"])
+        self.assertIsNone(data["next"])
+        self.assertIsNone(data["previous"])
+
+    def test_page_is_read_before_streaming(self):
+        """Запрос страницы выполняется в представлении, а не в потоке"""
+        response = self.guest_client.get(reverse("posts:api_index"))
+        with self.assertNumQueries(0):
+            data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(data["results"]), len(self.posts))
+
+    def test_cursor_paging(self):
+        """Ссылки next и previous листают ленту в обе стороны"""
+        url = reverse("posts:api_index")
+        first = self.get(url, limit=2)
+        self.assertEqual(self.ids(first), [self.posts[4].id, self.posts[3].id])
+        self.assertIsNone(first["previous"])
+        second = self.get(first["next"])
+        self.assertEqual(
+            self.ids(second), [self.posts[2].id, self.posts[1].id]
+        )
+        last = self.get(second["next"])
+        self.assertEqual(self.ids(last), [self.posts[0].id])
+        self.assertIsNone(last["next"])
+        back = self.get(last["previous"])
+        self.assertEqual(self.ids(back), self.ids(second))
+        self.assertEqual(self.ids(self.get(back["previous"])),
+                         self.ids(first))
+
+    def test_group_and_profile(self):
+        """Лента группы и автора содержит только их посты"""
+        group = self.get(reverse("posts:api_group", args=["cats"]))
+        self.assertEqual(
+            self.ids(group), [self.posts[3].id, self.posts[1].id]
+        )
+        self.assertTrue(all(item["group"] == "cats"
+                            for item in group["results"]))
+        profile = self.get(reverse("posts:api_profile", args=["auth"]))
+        self.assertEqual(len(profile["results"]), 5)
+        for name, args in (
+            ("posts:api_group", ["dogs"]),
+            ("posts:api_profile", ["nobody"]),
+            ("posts:api_post", [0]),
+            ("posts:api_comments", [0]),
+        ):
+            with self.subTest(name=name):
+                response = self.guest_client.get(reverse(name, args=args))
+                self.assertEqual(response.status_code, 404)
+
+    def test_post_and_comments(self):
+        """Пост отдаётся целиком, комментарии — по порядку создания"""
+        data = self.get(reverse("posts:api_post", args=[self.post.id]))
+        self.assertEqual(data["text"], "Пост 4")
+        comments = self.get(data["comments_url"], limit=2)
+        self.assertEqual(
+            self.ids(comments),
+            [comment.id for comment in self.comments[:2]]
+        )
+        rest = self.get(comments["next"])
+        self.assertEqual(self.ids(rest), [self.comments[2].id])
+        self.assertEqual(rest["results"][0]["text"], "Комментарий 2")
+
+    def test_only_needed_columns(self):
+        """Страница ленты читается одним запросом без лишних столбцов"""
+        with self.assertNumQueries(1) as queries:
+            self.get(reverse("posts:api_index"))
+        sql = queries.captured_queries[0]["sql"]
+        self.assertNotIn("password", sql)
+        self.assertNotIn("description", sql)
+
+    def test_bad_parameters(self):
+        """Неверные limit и курсор дают 400"""
+        url = reverse("posts:api_index")
+        for params in ({"limit": "x"}, {"limit": 0}, {"limit": 10 ** 6},
+                       {"after": "мусор"}, {"after": "WzFd"}):
+            with self.subTest(params=params):
+                response = self.guest_client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_cursor_of_wrong_types(self):
+        """Курсор с чужими типами значений даёт 400, а не 500"""
+        moment = {"dt": timezone.now().isoformat()}
+        urls = (
+            reverse("posts:api_index"),
+            reverse("posts:api_comments", args=[self.post.id]),
+        )
+        for url in urls:
+            for values in (["abc", 1], [moment, None], [[1], 2],
+                           [moment, "x"]):
+                for direction in ("after", "before"):
+                    with self.subTest(url=url, values=values):
+                        response = self.guest_client.get(
+                            url, {direction: encode_cursor(values)}
+                        )
+                        self.assertEqual(response.status_code, 400)
+                        self.assertEqual(
+                            json.loads(response.content)["detail"],
+                            "Неверный курсор",
+                        )
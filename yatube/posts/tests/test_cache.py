@@ -0,0 +1,357 @@
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from .. import cache as cache_module
+from ..cache import cache_page_for_anonymous, single_flight
+from ..models import Group, Post
+
+User = get_user_model()
+
+
+class IndexCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="first_reader")
+        cls.user2 = User.objects.create_user(username="second_reader")
+        cls.post = Post.objects.create(author=cls.user, text="Старый пост")
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.first_client = Client()
+        self.first_client.force_login(self.user)
+        self.second_client = Client()
+        self.second_client.force_login(self.user2)
+
+    def test_anonymous_page_is_shared(self):
+        """Анонимы получают общую закешированную страницу"""
+        self.guest_client.get(reverse("posts:home_page"))
+        Post.objects.filter(pk=self.post.pk).update(text="Тихая правка")
+        response = Client().get(reverse("posts:home_page"))
+        self.assertIsNone(response.context)
+        self.assertContains(response, "Старый пост")
+
+    def test_feed_is_shared_but_header_is_personal(self):
+        """Лента общая для всех, шапка у каждого своя"""
+        self.first_client.get(reverse("posts:home_page"))
+        Post.objects.filter(pk=self.post.pk).update(text="Тихая правка")
+        response = self.second_client.get(reverse("posts:home_page"))
+        self.assertContains(response, "Старый пост")
+        self.assertContains(response, "second_reader")
+        self.assertNotContains(response, "first_reader")
+
+    def test_pages_are_cached_separately(self):
+        """Каждая страница ленты кешируется под своим курсором"""
+        response = self.first_client.get(
+            reverse("posts:home_page"), {"after": "garbage"}
+        )
+        self.assertContains(response, "Старый пост")
+        Post.objects.filter(pk=self.post.pk).update(text="Тихая правка")
+        response = self.first_client.get(reverse("posts:home_page"))
+        self.assertContains(response, "Тихая правка")
+
+
+class InvalidationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.reader = User.objects.create_user(username="reader")
+        cls.group = Group.objects.create(
+            title="Тестовая группа",
+            slug="Test_slug",
+            description="Тестовое описание",
+        )
+        cls.other_group = Group.objects.create(
+            title="Другая группа",
+            slug="Other_slug",
+            description="Тестовое описание",
+        )
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text="Старый пост"
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.urls = {
+            "index": reverse("posts:home_page"),
+            "group": reverse(
+                "posts:group_posts", kwargs={"slug": self.group.slug}
+            ),
+            "profile": reverse(
+                "posts:profile", kwargs={"username": "auth"}
+            ),
+            "detail": reverse(
+                "posts:post_detail", kwargs={"post_id": self.post.id}
+            ),
+        }
+
+    def warm(self, *names):
+        for name in names:
+            self.guest_client.get(self.urls[name])
+            self.reader_client.get(self.urls[name])
+
+    def assert_everyone_sees(self, name, text):
+        for client in (self.guest_client, self.reader_client):
+            with self.subTest(page=name, client=client):
+                self.assertContains(client.get(self.urls[name]), text)
+
+    def test_edit_invalidates_pages(self):
+        """Правка поста сразу видна на всех закешированных страницах"""
+        self.warm(*self.urls)
+        self.authorized_client.post(
+            reverse("posts:post_edit", kwargs={"post_id": self.post.id}),
+            data={"text": "Исправленный пост", "group": self.group.id}
+        )
+        for name in self.urls:
+            self.assert_everyone_sees(name, "Исправленный пост")
+
+    def test_moving_post_invalidates_old_group(self):
+        """Перенос поста в другую группу обновляет страницу старой"""
+        self.warm("group")
+        self.authorized_client.post(
+            reverse("posts:post_edit", kwargs={"post_id": self.post.id}),
+            data={"text": "Старый пост", "group": self.other_group.id}
+        )
+        response = self.guest_client.get(self.urls["group"])
+        self.assertNotContains(response, "Старый пост")
+
+    def test_comment_invalidates_post_detail(self):
+        """Новый комментарий сразу виден на странице поста"""
+        self.warm("detail")
+        self.authorized_client.post(
+            reverse("posts:add_comment", kwargs={"post_id": self.post.id}),
+            data={"text": "Свежий комментарий"}
+        )
+        self.assert_everyone_sees("detail", "Свежий комментарий")
+
+    def test_follow_invalidates_profile(self):
+        """Подписка сразу меняет счётчик подписчиков в профиле"""
+        self.warm("profile")
+        self.reader_client.get(
+            reverse("posts:profile_follow", kwargs={"username": "auth"})
+        )
+        self.assert_everyone_sees("profile", "Подписчиков: 1")
+
+    def test_new_post_invalidates_feeds(self):
+        """Новый пост сразу появляется в лентах"""
+        self.warm("index", "group", "profile")
+        Post.objects.create(author=self.user, group=self.group, text="Новый")
+        for name in ("index", "group", "profile"):
+            self.assert_everyone_sees(name, "Новый")
+
+    def test_user_change_invalidates_pages(self):
+        """Новое имя автора сразу видно на всех его страницах"""
+        self.warm(*self.urls)
+        author = User.objects.get(pk=self.user.pk)
+        author.first_name = "Лев"
+        author.last_name = "Толстой"
+        author.save()
+        for name in self.urls:
+            self.assert_everyone_sees(name, "Лев Толстой")
+
+    def test_rename_invalidates_old_profile(self):
+        """Кеш профиля по старому имени сбрасывается при переименовании"""
+        self.warm("profile")
+        old_scope = cache_module.author_scope("auth")
+        before = cache_module.versions_key(old_scope)
+        author = User.objects.get(pk=self.user.pk)
+        author.username = "renamed"
+        author.save()
+        self.assertNotEqual(cache_module.versions_key(old_scope), before)
+        self.assertContains(
+            self.guest_client.get(
+                reverse("posts:profile", kwargs={"username": "renamed"})
+            ),
+            "Старый пост"
+        )
+
+    def test_login_keeps_pages(self):
+        """Вход пользователя не сбрасывает кеш страниц"""
+        self.warm("index")
+        with mock.patch("posts.cache.bump") as bump:
+            self.client.force_login(self.user)
+        bump.assert_not_called()
+
+    def test_group_delete_invalidates_pages(self):
+        """Удалённая группа пропадает из ленты и профиля автора"""
+        self.warm("index", "group", "profile")
+        group_scope = cache_module.group_scope(self.group.slug)
+        before = cache_module.versions_key(group_scope)
+        Group.objects.filter(pk=self.group.pk).delete()
+        self.assertNotEqual(cache_module.versions_key(group_scope), before)
+        for name in ("index", "profile"):
+            with self.subTest(page=name):
+                self.assertNotContains(
+                    self.guest_client.get(self.urls[name]), "все записи группы"
+                )
+
+
+class ShareableResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def render_twice(self, prefix, personalize):
+        calls = []
+
+        @cache_page_for_anonymous(60, prefix)
+        def view(request):
+            calls.append(request)
+            response = HttpResponse("Страница")
+            personalize(response)
+            return response
+
+        for _ in range(2):
+            request = RequestFactory().get("/page/")
+            request.user = AnonymousUser()
+            self.assertContains(view(request), "Страница")
+        return len(calls)
+
+    def test_personal_responses_are_not_cached(self):
+        """Ответы с куками, Vary и private не отдаются другим анонимам"""
+        personal = {
+            "cookie": lambda response: response.set_cookie("seen", "1"),
+            "vary": lambda response: patch_vary_headers(
+                response, ["Accept-Language"]
+            ),
+            "private": lambda response: patch_cache_control(
+                response, private=True
+            ),
+        }
+        for name, personalize in personal.items():
+            with self.subTest(name=name):
+                self.assertEqual(self.render_twice(name, personalize), 2)
+        self.assertEqual(self.render_twice("plain", lambda response: None), 1)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value="новое", delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_one_request_recomputes(self):
+        """Одновременные промахи пересобирают значение один раз"""
+        results = []
+
+        def request():
+            results.append(single_flight(
+                "key", self.compute(delay=0.2), 60
+            ))
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({value for value, _ in results}, {"новое"})
+        self.assertEqual(
+            sorted(result for _, result in results),
+            ["miss", "wait", "wait", "wait", "wait"],
+        )
+
+    def test_stale_copy_while_recomputing(self):
+        """Пока пересобирают, отдаётся прежняя копия"""
+        cache.set("key", ("старое", time.time() - 1, 0.1))
+        cache.set("last", "прошлое поколение")
+        cache.add("lock:key", True)
+        cache.add("lock:other", True)
+        self.assertEqual(
+            single_flight("key", self.compute(), 60), ("старое", "stale")
+        )
+        self.assertEqual(
+            single_flight("other", self.compute(), 60, stale_key="last"),
+            ("прошлое поколение", "stale"),
+        )
+        self.assertEqual(self.calls, 0)
+
+    def test_gives_up_waiting(self):
+        """Не дождавшись чужой пересборки, запрос считает сам"""
+        cache.add("lock:key", True)
+        with mock.patch("posts.cache.WAIT", 0.1):
+            self.assertEqual(
+                single_flight("key", self.compute(), 60), ("новое", "miss")
+            )
+        self.assertIsNone(cache.get("key"))
+
+    def test_early_refresh(self):
+        """Горячее значение обновляется до срока, медленное — раньше"""
+        single_flight("key", self.compute("первое"), 60)
+        self.assertEqual(
+            single_flight("key", self.compute(), 60), ("первое", "hit")
+        )
+        # пересборка занимала бы минуту: до срока 60 секунд рискованно
+        cache.set("key", ("первое", time.time() + 50, 60))
+        with mock.patch("posts.cache.random.random", return_value=0.9):
+            self.assertEqual(
+                single_flight("key", self.compute(), 60),
+                ("новое", "refresh"),
+            )
+        self.assertEqual(cache.get("key")[0], "новое")
+
+    def test_uncacheable_value(self):
+        """Неподходящее значение не кешируется, блокировка снимается"""
+        single_flight("key", self.compute(None), 60,
+                      cacheable=lambda value: value is not None)
+        self.assertIsNone(cache.get("key"))
+        self.assertIsNone(cache.get("lock:key"))
+
+
+class StaleWhileRevalidateTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        Post.objects.create(author=cls.user, text="Старый пост")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_previous_generation_while_rebuilding(self):
+        """Пока новая лента собирается, анонимы видят предыдущую"""
+        url = reverse("posts:home_page")
+        Client().get(url)
+        Post.objects.create(author=self.user, text="Новый пост")
+        with mock.patch("posts.cache.cache.add", return_value=False):
+            response = Client().get(url)
+        self.assertNotContains(response, "Новый пост")
+        self.assertContains(Client().get(url), "Новый пост")
+
+    def test_previous_generation_is_not_validated(self):
+        """Прежнюю копию браузер не сохраняет и не подтверждает по ETag"""
+        url = reverse("posts:home_page")
+        Client().get(url)
+        Post.objects.create(author=self.user, text="Новый пост")
+        with mock.patch("posts.cache.cache.add", return_value=False):
+            response = Client().get(url)
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+        self.assertIn("no-store", response["Cache-Control"])
+        fresh = Client().get(url)
+        self.assertContains(fresh, "Новый пост")
+        self.assertIn("ETag", fresh)
+        self.assertNotIn("no-store", fresh["Cache-Control"])
+        response = Client().get(url, HTTP_IF_NONE_MATCH=fresh["ETag"])
+        self.assertEqual(response.status_code, 304)
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .. import images, thumbnails
+from ..models import Post, StoredImage
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def uploaded(color=b"\xFF"):
+    content = SMALL_GIF.replace(b"\xFF\xFF\xFF", b"\xFF\xFF" + color)
+    return SimpleUploadedFile(
+        name="small.gif", content=content, content_type="image/gif"
+    )
+
+
+def age(storage, name, seconds=2 * 60 * 60):
+    """Делает файл старше, чем порог --min-age по умолчанию."""
+    past = time.time() - seconds
+    os.utime(storage.path(name), (past, past))
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_WORKERS=0,
+    THUMBNAIL_VARIANTS={"960x339": {"crop": "center", "upscale": True}},
+)
+class CollectMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        cache.clear()
+        default.kvstore.local.clear()
+        self.storage = images.storage()
+        self.kept = Post.objects.create(
+            author=self.user, text="Живой пост", image=uploaded()
+        )
+        gone = Post.objects.create(
+            author=self.user, text="Удалённый пост",
+            image=uploaded(color=b"\x00")
+        )
+        for post in (self.kept, gone):
+            thumbnails.generate(post.image.name, "960x339")
+        self.kept_thumbnail = thumbnails.cached(self.kept.image, "960x339")
+        self.gone_thumbnail = thumbnails.cached(gone.image, "960x339")
+        self.gone_name = gone.image.name
+        # пост пропадает, а файл остаётся — как до учёта ссылок
+        Post.objects.filter(pk=gone.pk).update(image=None)
+        gone.delete()
+        self.stray_thumbnail = default.storage.save(
+            "cache/ab/cd/stray.gif", ContentFile(SMALL_GIF)
+        )
+        for name in (self.kept.image.name, self.gone_name):
+            age(self.storage, name)
+        for name in (
+            self.kept_thumbnail.name,
+            self.gone_thumbnail.name,
+            self.stray_thumbnail,
+        ):
+            age(default.storage, name)
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command("collect_media", *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        """--dry-run только сообщает о сиротах"""
+        out = self.collect("--dry-run")
+        self.assertIn("картинок 1", out)
+        self.assertIn("превью 1", out)
+        self.assertTrue(self.storage.exists(self.gone_name))
+        self.assertTrue(default.storage.exists(self.stray_thumbnail))
+
+    def test_orphans_are_deleted(self):
+        """Сироты удаляются, используемые файлы остаются"""
+        self.collect()
+        self.assertFalse(self.storage.exists(self.gone_name))
+        self.assertFalse(self.gone_thumbnail.exists())
+        self.assertFalse(default.storage.exists(self.stray_thumbnail))
+        self.assertFalse(
+            StoredImage.objects.filter(name=self.gone_name).exists()
+        )
+        self.assertTrue(self.storage.exists(self.kept.image.name))
+        self.assertTrue(self.kept_thumbnail.exists())
+        self.assertIsNotNone(thumbnails.cached(self.kept.image, "960x339"))
+
+    def test_entries_of_missing_sources_are_deleted(self):
+        """Записи sorl об исходниках без постов удаляются"""
+        self.storage.delete(self.gone_name)
+        self.collect()
+        keys = KVStoreModel.objects.values_list("value", flat=True)
+        self.assertFalse(any(self.gone_name in value for value in keys))
+        self.assertFalse(self.gone_thumbnail.exists())
+
+    def test_fresh_files_are_kept(self):
+        """Свежие файлы не трогаются: пост может быть ещё не сохранён"""
+        fresh = self.storage.save("posts/new.gif", uploaded(color=b"\x01"))
+        self.collect()
+        self.assertTrue(self.storage.exists(fresh))
+        self.collect("--min-age", "0")
+        self.assertFalse(self.storage.exists(fresh))
+
+    def test_rate_limit(self):
+        """--rate выдерживает паузу после каждого удаления"""
+        with mock.patch("time.sleep") as sleep:
+            self.collect("--rate", "4", "--chunk-size", "1")
+        self.assertTrue(sleep.called)
+        sleep.assert_called_with(0.25)
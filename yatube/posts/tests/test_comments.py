@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Post
+
+User = get_user_model()
+
+
+@mock.patch("posts.utils.COMMENTS_PER_PAGE", 2)
+class CommentPagesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.post = Post.objects.create(author=cls.user, text="Тестовый пост")
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.create_user(username=f"reader{number}"),
+                text=f"Комментарий {number}",
+            )
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_first_chunk_is_inline(self):
+        """На странице поста только первая порция комментариев"""
+        response = self.guest_client.get(
+            reverse("posts:post_detail", args=[self.post.id])
+        )
+        self.assertEqual(list(response.context["comments"]),
+                         self.comments[:2])
+        self.assertContains(response, "Комментарий 1")
+        self.assertNotContains(response, "Комментарий 2")
+        self.assertContains(response, "Показать ещё комментарии")
+
+    def test_fragment_continues_after_cursor(self):
+        """Фрагмент отдаёт следующие порции до конца обсуждения"""
+        page = self.guest_client.get(
+            reverse("posts:post_detail", args=[self.post.id])
+        ).context["comments"]
+        url = reverse("posts:post_comments", args=[self.post.id])
+        response = self.guest_client.get(url, {"after": page.next_cursor})
+        self.assertTemplateUsed(response, "posts/includes/comments.html")
+        self.assertNotContains(response, "<html")
+        self.assertEqual(list(response.context["comments"]),
+                         self.comments[2:4])
+        last = self.guest_client.get(
+            url, {"after": response.context["comments"].next_cursor}
+        )
+        self.assertEqual(list(last.context["comments"]), self.comments[4:])
+        self.assertNotContains(last, "Показать ещё комментарии")
+
+    def test_queries_do_not_grow_with_comments(self):
+        """Число запросов не зависит от размера обсуждения"""
+        url = reverse("posts:post_detail", args=[self.post.id])
+        with CaptureQueriesContext(connection) as few:
+            self.guest_client.get(url)
+        for number in range(20):
+            Comment.objects.create(
+                post=self.post, author=self.user, text=f"Ещё {number}"
+            )
+        cache.clear()
+        with mock.patch("posts.utils.COMMENTS_PER_PAGE", 10):
+            with CaptureQueriesContext(connection) as many:
+                self.guest_client.get(url)
+        self.assertEqual(len(many), len(few))
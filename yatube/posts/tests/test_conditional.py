@@ -0,0 +1,120 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Group, Post
+
+User = get_user_model()
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.reader = User.objects.create_user(username="reader")
+        cls.group = Group.objects.create(
+            title="Тестовая группа",
+            slug="Test_slug",
+            description="Тестовое описание",
+        )
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text="Тестовый пост"
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.urls = [
+            reverse("posts:group_posts", args=[self.group.slug]),
+            reverse("posts:profile", args=[self.user.username]),
+            reverse("posts:post_detail", args=[self.post.id]),
+        ]
+
+    def revalidate(self, client, url, response, **params):
+        return client.get(
+            url, params, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+
+    def test_not_modified(self):
+        """Совпавший ETag даёт 304 без тела"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn("no-cache", response["Cache-Control"])
+                self.assertTrue(response.has_header("Last-Modified"))
+                again = self.revalidate(self.guest_client, url, response)
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again.content, b"")
+                self.assertEqual(again["ETag"], response["ETag"])
+
+    def test_if_modified_since(self):
+        """Без ETag работает If-Modified-Since"""
+        url = self.urls[0]
+        response = self.guest_client.get(url)
+        again = self.guest_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(again.status_code, 304)
+
+    def test_no_feed_query_on_304(self):
+        """304 отдаётся до запроса ленты и рендера шаблона"""
+        url = self.urls[0]
+        response = self.guest_client.get(url)
+        with self.assertNumQueries(0):
+            again = self.revalidate(self.guest_client, url, response)
+        self.assertEqual(again.status_code, 304)
+        self.assertIsNone(again.context)
+
+    def test_changes_break_validator(self):
+        """Новый пост, правка и комментарий меняют ETag"""
+        changes = (
+            lambda: Post.objects.create(
+                author=self.user, group=self.group, text="Новый пост"
+            ),
+            lambda: self.post.save(),
+            lambda: Comment.objects.create(
+                post=self.post, author=self.reader, text="Комментарий"
+            ),
+        )
+        url = self.urls[2]
+        for change in changes:
+            response = self.guest_client.get(url)
+            change()
+            again = self.revalidate(self.guest_client, url, response)
+            self.assertEqual(again.status_code, 200)
+
+    def test_validator_depends_on_page_and_user(self):
+        """ETag различается для страниц ленты и для пользователей"""
+        url = self.urls[0]
+        guest = self.guest_client.get(url)
+        reader = self.reader_client.get(url)
+        self.assertNotEqual(guest["ETag"], reader["ETag"])
+        self.assertIn("private", reader["Cache-Control"])
+        other_page = self.revalidate(
+            self.guest_client, url, guest, after="x"
+        )
+        self.assertEqual(other_page.status_code, 200)
+        self.assertEqual(
+            self.revalidate(self.reader_client, url, guest).status_code, 200
+        )
+
+    def test_relogin_breaks_validator(self):
+        """После нового входа страница с формой приходит заново"""
+        url = self.urls[2]
+        client = Client()
+        client.force_login(self.reader)
+        response = client.get(url)
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertEqual(
+            self.revalidate(client, url, response).status_code, 304
+        )
+        client.logout()
+        client.force_login(self.reader)
+        again = self.revalidate(client, url, response)
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again["ETag"], response["ETag"])
@@ -0,0 +1,84 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import AuthorCounters, Comment, Post, PostCounters
+
+User = get_user_model()
+
+
+class CountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.author = User.objects.create_user(username="author")
+        cls.post = Post.objects.create(author=cls.author, text="Пост")
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def author_counters(self, user):
+        return AuthorCounters.objects.get(author=user)
+
+    def test_post_counter(self):
+        """Счётчик постов автора меняется при создании и удалении"""
+        self.assertEqual(self.author_counters(self.author).posts_count, 1)
+        post = Post.objects.create(author=self.author, text="Ещё")
+        self.assertEqual(self.author_counters(self.author).posts_count, 2)
+        post.delete()
+        self.assertEqual(self.author_counters(self.author).posts_count, 1)
+
+    def test_comment_counter(self):
+        """Счётчик комментариев поста меняется при добавлении и удалении"""
+        self.client.post(
+            reverse("posts:add_comment", kwargs={"post_id": self.post.id}),
+            data={"text": "Комментарий"}
+        )
+        counters = PostCounters.objects.get(post=self.post)
+        self.assertEqual(counters.comments_count, 1)
+        Comment.objects.all().delete()
+        counters.refresh_from_db()
+        self.assertEqual(counters.comments_count, 0)
+
+    def test_follow_counters(self):
+        """Подписка и отписка меняют счётчики обоих пользователей"""
+        self.client.get(
+            reverse("posts:profile_follow", kwargs={"username": "author"})
+        )
+        self.assertEqual(self.author_counters(self.author).followers_count, 1)
+        self.assertEqual(self.author_counters(self.user).following_count, 1)
+        self.client.get(
+            reverse("posts:profile_unfollow", kwargs={"username": "author"})
+        )
+        self.assertEqual(self.author_counters(self.author).followers_count, 0)
+        self.assertEqual(self.author_counters(self.user).following_count, 0)
+
+    def test_pages_read_counters(self):
+        """Страницы показывают значения из счётчиков"""
+        AuthorCounters.objects.filter(author=self.author).update(
+            posts_count=42
+        )
+        response = self.client.get(
+            reverse("posts:profile", kwargs={"username": "author"})
+        )
+        self.assertEqual(response.context["counters"].posts_count, 42)
+        response = self.client.get(
+            reverse("posts:post_detail", kwargs={"post_id": self.post.id})
+        )
+        self.assertEqual(response.context["author_counters"].posts_count, 42)
+
+    def test_rebuild_command(self):
+        """rebuild_counters исправляет расхождения"""
+        AuthorCounters.objects.update(posts_count=42)
+        PostCounters.objects.all().delete()
+        call_command("rebuild_counters", stdout=StringIO())
+        self.assertEqual(self.author_counters(self.author).posts_count, 1)
+        self.assertEqual(self.author_counters(self.user).posts_count, 0)
+        self.assertEqual(
+            PostCounters.objects.get(post=self.post).comments_count, 0
+        )
@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import search
+from ..importer import Importer
+from ..models import (AuthorCounters, Comment, Follow, Group, ImportedPost,
+                      Post, PostCounters, TimelineEntry)
+
+User = get_user_model()
+
+RECORDS = [
+    {"type": "group", "slug": "cats", "title": "Коты", "description": "Мяу"},
+    {"type": "follow", "user": "reader", "author": "writer"},
+    {"type": "post", "id": 1, "author": "writer", "group": "cats",
+     "text": "Старый пост про котов", "pub_date": "2015-03-01T10:00:00"},
+    {"type": "post", "id": 2, "author": "writer", "group": None,
+     "text": "Второй пост", "pub_date": "2015-03-02T10:00:00+03:00"},
+    {"type": "comment", "post": 1, "author": "reader",
+     "text": "Хороший пост", "created": "2015-03-03T12:00:00"},
+    {"type": "post", "id": 3, "author": "reader",
+     "text": "Пост читателя", "pub_date": "2016-01-01T00:00:00"},
+]
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.path = os.path.join(self.directory, "export.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, lines):
+        with open(self.path, "w", encoding="utf-8") as stream:
+            for line in lines:
+                if not isinstance(line, str):
+                    line = json.dumps(line, ensure_ascii=False)
+                stream.write(line + "\n")
+
+    def run_import(self, *args):
+        out = StringIO()
+        call_command("import_jsonl", self.path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_objects_are_imported(self):
+        """Группы, посты, комментарии и подписки попадают в базу"""
+        self.write(RECORDS)
+        out = self.run_import("--batch-size", "2")
+        self.assertIn("записей/с", out)
+        writer = User.objects.get(username="writer")
+        reader = User.objects.get(username="reader")
+        self.assertFalse(writer.has_usable_password())
+        self.assertEqual(Post.objects.filter(author=writer).count(), 2)
+        self.assertEqual(
+            Post.objects.get(text="Старый пост про котов").group,
+            Group.objects.get(slug="cats")
+        )
+        self.assertTrue(
+            Follow.objects.filter(user=reader, author=writer).exists()
+        )
+        comment = Comment.objects.get()
+        self.assertEqual(comment.post.text, "Старый пост про котов")
+
+    def test_timestamps_are_preserved(self):
+        """Даты берутся из источника, а не из auto_now_add"""
+        self.write(RECORDS)
+        self.run_import()
+        post = Post.objects.get(text="Второй пост")
+        self.assertEqual(
+            post.pub_date,
+            datetime(2015, 3, 2, 7, tzinfo=timezone.utc)
+        )
+        self.assertEqual(Comment.objects.get().created.year, 2015)
+        self.assertTrue(
+            Post._meta.get_field("pub_date").auto_now_add
+        )
+
+    def test_deleted_ids_are_not_reused(self):
+        """Импортированные посты не получают id удалённых"""
+        writer = User.objects.create_user(username="writer")
+        deleted = Post.objects.create(author=writer, text="Удалённый").id
+        Post.objects.filter(id=deleted).delete()
+        self.write(RECORDS)
+        self.run_import("--batch-size", "2")
+        self.assertFalse(Post.objects.filter(id__lte=deleted).exists())
+        self.assertEqual(
+            dict(ImportedPost.objects.values_list(
+                "external_id", "post__text"
+            )),
+            {
+                "1": "Старый пост про котов",
+                "2": "Второй пост",
+                "3": "Пост читателя",
+            }
+        )
+
+    def test_existing_follows_are_not_counted(self):
+        """Уже существующие подписки не считаются импортированными"""
+        Follow.objects.create(
+            user=User.objects.create_user(username="reader"),
+            author=User.objects.create_user(username="writer"),
+        )
+        importer = Importer("export.jsonl")
+        list(importer.run(json.dumps(record) for record in RECORDS))
+        self.assertEqual(importer.imported["follow"], 0)
+        self.assertEqual(importer.imported["post"], 3)
+
+    def test_derived_data_is_updated(self):
+        """Счётчики, ленты и поиск учитывают импортированное"""
+        self.write(RECORDS)
+        self.run_import("--batch-size", "3")
+        writer = User.objects.get(username="writer")
+        reader = User.objects.get(username="reader")
+        counters = AuthorCounters.objects.get(author=writer)
+        self.assertEqual(counters.posts_count, 2)
+        self.assertEqual(counters.followers_count, 1)
+        self.assertEqual(
+            AuthorCounters.objects.get(author=reader).following_count, 1
+        )
+        post = Post.objects.get(text="Старый пост про котов")
+        self.assertEqual(PostCounters.objects.get(post=post).comments_count, 1)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=reader).count(), 2
+        )
+        self.assertEqual(
+            list(search.matching(Post.objects.all(), "котов")), [post]
+        )
+
+    def test_resume_after_failure(self):
+        """После ошибки повторный запуск продолжает с места сбоя"""
+        broken = RECORDS[:4] + ["{не json"] + RECORDS[4:]
+        self.write(broken)
+        with self.assertRaisesMessage(CommandError, "строка 5"):
+            self.run_import("--batch-size", "2")
+        self.assertEqual(Post.objects.count(), 2)
+        self.write(RECORDS[:4] + [""] + RECORDS[4:])
+        out = self.run_import("--batch-size", "2")
+        self.assertIn("Продолжаем после строки 4", out)
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_rerun_does_not_duplicate(self):
+        """Повторный запуск того же файла ничего не дублирует"""
+        self.write(RECORDS)
+        self.run_import()
+        out = self.run_import()
+        self.assertIn("Продолжаем после строки 6", out)
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(Group.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_unknown_post_in_comment(self):
+        """Комментарий к неизвестному посту останавливает импорт"""
+        self.write([
+            {"type": "comment", "post": 42, "author": "reader", "text": "?"}
+        ])
+        with self.assertRaisesMessage(CommandError, "нет поста 42"):
+            self.run_import()
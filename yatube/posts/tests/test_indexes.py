@@ -0,0 +1,26 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from ..models import Follow
+
+User = get_user_model()
+
+
+class IndexTests(TestCase):
+    def test_feed_queries_use_indexes(self):
+        """audit_indexes не находит полных сканов и временных сортировок"""
+        stdout = StringIO()
+        call_command("audit_indexes", stdout=stdout, stderr=StringIO())
+        self.assertIn("используют индексы", stdout.getvalue())
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на автора запрещена на уровне БД"""
+        user = User.objects.create_user(username="auth")
+        author = User.objects.create_user(username="author")
+        Follow.objects.create(user=user, author=author)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=user, author=author)
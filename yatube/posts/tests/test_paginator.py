@@ -0,0 +1,143 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Group, Post
+from ..paginator import CursorPaginator, encode_cursor
+
+User = get_user_model()
+
+
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.group = Group.objects.create(
+            title="Тестовая группа",
+            slug="Test_slug",
+            description="Тестовое описание",
+        )
+        Post.objects.bulk_create(
+            Post(author=cls.user, group=cls.group, text=f"Пост {i}")
+            for i in range(13)
+        )
+        # у части постов одинаковое время, порядок держится на id
+        now = timezone.now()
+        for i, post in enumerate(Post.objects.order_by("id")):
+            post.pub_date = now - timedelta(minutes=i // 2)
+            post.save()
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def expected_order(self):
+        return list(Post.objects.order_by("-pub_date", "-id"))
+
+    def test_pages_follow_each_other(self):
+        """Страницы по курсору идут подряд без пропусков и повторов"""
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        seen = []
+        page = paginator.get_page()
+        self.assertFalse(page.has_previous())
+        while True:
+            seen.extend(page.object_list)
+            if not page.has_next():
+                break
+            page = paginator.get_page(after=page.next_cursor)
+        self.assertEqual(seen, self.expected_order())
+
+    def test_previous_page(self):
+        """Курсор before возвращает на предыдущую страницу"""
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        first = paginator.get_page()
+        second = paginator.get_page(after=first.next_cursor)
+        back = paginator.get_page(before=second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_page_has_no_numbers(self):
+        """Номер и индексы страницы по курсору дают понятную ошибку"""
+        page = CursorPaginator(Post.objects.all(), 5).get_page()
+        for name in ("next_page_number", "previous_page_number",
+                     "start_index", "end_index"):
+            with self.subTest(name=name):
+                with self.assertRaisesMessage(NotImplementedError, "курсор"):
+                    getattr(page, name)()
+        with self.assertRaises(NotImplementedError):
+            page.number
+
+    def test_empty_page_has_no_none_links(self):
+        """На пустой странице нет ссылок с курсором None"""
+        oldest = self.expected_order()[-1]
+        cursor = encode_cursor([oldest.pub_date, oldest.id])
+        newest = self.expected_order()[0]
+        for params in (
+            {"before": encode_cursor([newest.pub_date, newest.id])},
+            {"after": cursor},
+        ):
+            with self.subTest(params=params):
+                cache.clear()
+                response = self.guest_client.get(
+                    reverse("posts:home_page"), params
+                )
+                self.assertEqual(len(response.context["page_obj"]), 0)
+                self.assertNotContains(response, "=None")
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        """Битый курсор открывает первую страницу"""
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        for token in ("garbage", encode_cursor([1]), "W10"):
+            with self.subTest(token=token):
+                page = paginator.get_page(after=token)
+                self.assertEqual(list(page), self.expected_order()[:5])
+
+    def test_cursor_of_wrong_types(self):
+        """Курсор с чужими типами значений открывает первую страницу"""
+        moment = {"dt": timezone.now().isoformat()}
+        tokens = [
+            encode_cursor(values) for values in (
+                ["abc", 1], [moment, None], [[1], 2], [moment, "x"],
+                [{"dt": 1}, 1], [{"dt": "2020-13-40T00:00:00"}, 1],
+                [1, 2],
+            )
+        ]
+        urls = (
+            reverse("posts:home_page"),
+            reverse("posts:group_posts", kwargs={"slug": self.group.slug}),
+            reverse("posts:profile", kwargs={"username": "auth"}),
+        )
+        for url in urls:
+            for token in tokens:
+                with self.subTest(url=url, token=token):
+                    cache.clear()
+                    response = self.guest_client.get(url, {"after": token})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(
+                        list(response.context["page_obj"]),
+                        self.expected_order()[:10],
+                    )
+
+    def test_feed_pages_use_cursor(self):
+        """Ленты отдают 10 постов и ссылку на следующую страницу"""
+        urls = (
+            reverse("posts:home_page"),
+            reverse("posts:group_posts", kwargs={"slug": self.group.slug}),
+            reverse("posts:profile", kwargs={"username": "auth"}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                cache.clear()
+                response = self.guest_client.get(url)
+                page_obj = response.context["page_obj"]
+                self.assertEqual(len(page_obj), 10)
+                response = self.guest_client.get(
+                    url, {"after": page_obj.next_cursor}
+                )
+                self.assertEqual(len(response.context["page_obj"]), 3)
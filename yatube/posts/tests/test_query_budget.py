@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core.testing import QueryBudgetMixin
+
+from .. import urls
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# страницам, которым нужны параметры запроса
+QUERY = {"posts:search": {"q": "пост"}}
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        authors = [cls.user] + [
+            User.objects.create_user(username=f"author{number}")
+            for number in range(3)
+        ]
+        groups = [
+            Group.objects.create(
+                title=f"Группа {number}",
+                slug=f"group{number}",
+                description="Тестовое описание",
+            )
+            for number in range(3)
+        ]
+        posts = [
+            Post.objects.create(
+                author=authors[number % len(authors)],
+                group=groups[number % len(groups)],
+                text=f"Тестовый пост {number}",
+            )
+            for number in range(8)
+        ]
+        for author in authors[1:]:
+            Follow.objects.create(user=cls.user, author=author)
+        cls.post = posts[0]
+        for author in authors[1:]:
+            Comment.objects.create(
+                post=cls.post, author=author, text="Комментарий"
+            )
+        cls.kwargs = {
+            "slug": groups[0].slug,
+            "username": authors[1].username,
+            "post_id": cls.post.id,
+        }
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_views_stay_within_budget(self):
+        """Каждая страница posts.urls укладывается в свой бюджет"""
+        for pattern in urls.urlpatterns:
+            view_name = f"{urls.app_name}:{pattern.name}"
+            names = pattern.pattern.converters.keys()
+            path = reverse(
+                view_name, kwargs={name: self.kwargs[name] for name in names}
+            )
+            with self.subTest(view_name=view_name):
+                # страница целиком, без кеша фрагментов
+                cache.clear()
+                with self.assertQueryBudget(view_name):
+                    response = self.authorized_client.get(
+                        path, QUERY.get(view_name, {})
+                    )
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                self.assertIn(response.status_code, (200, 302))
+
+    @override_settings(DEBUG=True, QUERY_BUDGETS={"posts:home_page": 0})
+    def test_middleware_reports_overrun(self):
+        """При разработке превышение бюджета попадает в лог"""
+        cache.clear()
+        with self.assertLogs("core.middleware", "WARNING") as logs:
+            response = Client().get(reverse("posts:home_page"))
+        self.assertEqual(response["X-Query-Count"], "1")
+        self.assertIn("posts:home_page: 1 запросов при бюджете 0",
+                      logs.output[0])
+
+    def test_middleware_is_off_in_production(self):
+        """Без DEBUG счётчик не подключается"""
+        response = Client().get(reverse("posts:home_page"))
+        self.assertFalse(response.has_header("X-Query-Count"))
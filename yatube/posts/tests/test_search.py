@@ -0,0 +1,103 @@
+from io import StringIO
+
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase
+from django.urls import reverse
+
+from .. import search
+from ..models import Post
+
+User = get_user_model()
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.cat = Post.objects.create(
+            author=cls.user, text="Рыжий кот спит на тёплом подоконнике"
+        )
+        cls.cats = Post.objects.create(
+            author=cls.user, text="Кот и кот: два кота и котёнок"
+        )
+        cls.dog = Post.objects.create(
+            author=cls.user, text="Собака спит у двери"
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        response = self.guest_client.get(
+            reverse("posts:search"), {"q": query, **params}
+        )
+        return response.context["page_obj"]
+
+    def test_index_is_installed(self):
+        """После migrate в базе есть индекс FTS5"""
+        self.assertTrue(search.installed())
+
+    def test_ranked_results(self):
+        """Результаты упорядочены по релевантности"""
+        self.assertEqual(list(self.search("кот")), [self.cats, self.cat])
+
+    def test_phrase_and_prefix(self):
+        """Поддерживаются фразы в кавычках и поиск по префиксу"""
+        self.assertEqual(list(self.search('"спит у двери"')), [self.dog])
+        self.assertEqual(list(self.search('"у двери спит"')), [])
+        self.assertEqual(list(self.search("кот*")), [self.cats, self.cat])
+        self.assertCountEqual(self.search("спит"), [self.cat, self.dog])
+
+    def test_index_follows_edits(self):
+        """Правка и удаление поста сразу отражаются в поиске"""
+        Post.objects.filter(pk=self.dog.pk).update(text="Собака лает")
+        self.assertEqual(list(self.search("лает")), [self.dog])
+        self.assertEqual(list(self.search("двери")), [])
+        Post.objects.filter(pk=self.cat.pk).delete()
+        self.assertEqual(list(self.search("подоконнике")), [])
+
+    def test_results_are_paginated(self):
+        """Результаты листаются курсором без повторов"""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f"ёжик номер {i}") for i in range(13)
+        )
+        page = self.search("ёжик")
+        self.assertEqual(len(page), 10)
+        second = self.search("ёжик", after=page.next_cursor)
+        self.assertEqual(len(second), 3)
+        self.assertFalse(set(page) & set(second))
+        back = self.search("ёжик", before=second.previous_cursor)
+        self.assertEqual(list(back), list(page))
+
+    def test_query_syntax_is_escaped(self):
+        """Служебные символы FTS5 в запросе не ломают поиск"""
+        for query in ('кот OR', 'NEAR(', '"', '***', 'кот"'):
+            with self.subTest(query=query):
+                response = self.guest_client.get(
+                    reverse("posts:search"), {"q": query}
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт через индекс"""
+        admin = site._registry[Post]
+        request = RequestFactory().get("/admin/posts/post/")
+        queryset, _ = admin.get_search_results(
+            request, Post.objects.all(), "двери"
+        )
+        self.assertEqual(list(queryset), [self.dog])
+
+    def test_rebuild_command(self):
+        """rebuild_search восстанавливает индекс"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {search.TABLE}({search.TABLE}) "
+                "VALUES ('delete-all')"
+            )
+        self.assertEqual(list(self.search("собака")), [])
+        call_command("rebuild_search", stdout=StringIO())
+        self.assertEqual(list(self.search("собака")), [self.dog])
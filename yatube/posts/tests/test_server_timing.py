@@ -0,0 +1,95 @@
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def phases(response):
+    """{"db": ["dur=1.2", 'desc="3"'], ...} из заголовка Server-Timing."""
+    result = {}
+    for entry in response["Server-Timing"].split(", "):
+        name, *params = entry.split(";")
+        result[name] = params
+    return result
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, SERVER_TIMING_SAMPLE_RATE=1.0
+)
+class ServerTimingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        image = SimpleUploadedFile(
+            name="small.gif", content=SMALL_GIF, content_type="image/gif"
+        )
+        cls.post = Post.objects.create(
+            author=cls.user, text="Пост с картинкой", image=image
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_phases_in_header(self):
+        """Заголовок разбивает время на SQL, шаблоны, кеш и превью"""
+        response = self.guest_client.get(reverse("posts:home_page"))
+        found = phases(response)
+        self.assertEqual(
+            set(found), {"db", "template", "cache", "thumbnail", "total"}
+        )
+        self.assertTrue(found["total"][0].startswith("dur="))
+        # вложенные шаблоны не считаются отдельными рендерингами
+        self.assertEqual(found["template"][1], 'desc="1"')
+
+    def test_log_line(self):
+        """В лог уходит строка JSON с именем маршрута"""
+        with self.assertLogs("core.timing", "INFO") as logs:
+            self.guest_client.get(
+                reverse("posts:profile", args=[self.user.username])
+            )
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "posts:profile")
+        self.assertEqual(record["status"], 200)
+        self.assertGreater(record["db_count"], 0)
+        self.assertGreaterEqual(record["total_ms"], record["db_ms"])
+
+    def test_sampling(self):
+        """Запросы вне выборки не замеряются"""
+        url = reverse("posts:post_detail", args=[self.post.id])
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=0.5):
+            with mock.patch("core.middleware.random.random",
+                            return_value=0.7):
+                response = Client().get(url)
+        self.assertNotIn("Server-Timing", response)
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=0):
+            response = Client().get(url)
+        self.assertNotIn("Server-Timing", response)
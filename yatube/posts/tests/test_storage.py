@@ -0,0 +1,157 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.transaction import TransactionManagementError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .. import images, thumbnails
+from ..models import Post, StoredImage
+from ..storage import ContentAddressedStorage
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def uploaded(name="small.gif", color=b"\xFF"):
+    content = SMALL_GIF.replace(b"\xFF\xFF\xFF", b"\xFF\xFF" + color)
+    return SimpleUploadedFile(
+        name=name, content=content, content_type="image/gif"
+    )
+
+
+def run_on_commit():
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, image):
+        return Post.objects.create(author=self.user, text="Пост", image=image)
+
+    def refs(self, name):
+        return StoredImage.objects.get(name=name).refs
+
+    def test_identical_uploads_share_file(self):
+        """Одинаковые загрузки хранятся одним файлом"""
+        first = self.create_post(uploaded("first.gif"))
+        second = self.create_post(uploaded("second.GIF"))
+        other = self.create_post(uploaded("first.gif", color=b"\x00"))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertTrue(first.image.name.startswith("posts/"))
+        self.assertTrue(first.image.name.endswith(".gif"))
+        self.assertEqual(self.refs(first.image.name), 2)
+        self.assertEqual(self.refs(other.image.name), 1)
+
+    def test_upload_pins_file_before_reusing_it(self):
+        """Загрузка блокирует учёт ссылок раньше, чем доверяет файлу"""
+        first = self.create_post(uploaded())
+        name = first.image.name
+        first.delete()
+        seen = []
+        exists = ContentAddressedStorage.exists
+
+        def checked(storage, path):
+            seen.append(list(queries.captured_queries))
+            return exists(storage, path)
+
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(ContentAddressedStorage, "exists", checked):
+            second = self.create_post(uploaded())
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(any(
+            query["sql"].startswith('UPDATE "posts_storedimage"')
+            for query in seen[0]
+        ))
+        # collect после коммита видит новую ссылку и файл не трогает
+        run_on_commit()
+        self.assertEqual(self.refs(name), 1)
+        self.assertTrue(images.storage().exists(name))
+
+    def test_file_is_deleted_with_last_reference(self):
+        """Файл и превью удаляются вместе с последним постом"""
+        first = self.create_post(uploaded())
+        second = self.create_post(uploaded())
+        name = first.image.name
+        thumbnails.generate(name, "960x339")
+        thumbnail = thumbnails.cached(first.image, "960x339")
+        storage = images.storage()
+        first.delete()
+        run_on_commit()
+        self.assertTrue(storage.exists(name))
+        second.delete()
+        run_on_commit()
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(thumbnail.exists())
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+
+    def test_replacing_image_releases_old_file(self):
+        """Замена картинки освобождает старый файл"""
+        post = self.create_post(uploaded())
+        old_name = post.image.name
+        post.image = uploaded(color=b"\x00")
+        post.save()
+        run_on_commit()
+        self.assertEqual(self.refs(post.image.name), 1)
+        self.assertFalse(images.storage().exists(old_name))
+
+    def test_dedupe_moves_legacy_files(self):
+        """dedupe_images сводит старые копии к одному файлу"""
+        legacy = FileSystemStorage()
+        content = uploaded().read()
+        for name in ("posts/small_a.gif", "posts/small_b.gif"):
+            saved = legacy.save(name, ContentFile(content))
+            post = self.create_post(None)
+            Post.objects.filter(pk=post.pk).update(image=saved)
+        images.rebuild()
+        call_command("dedupe_images", stdout=StringIO())
+        run_on_commit()
+        names = {post.image.name for post in Post.objects.all()}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertEqual(self.refs(name), 2)
+        self.assertFalse(legacy.exists("posts/small_a.gif"))
+        self.assertFalse(legacy.exists("posts/small_b.gif"))
+        self.assertEqual(StoredImage.objects.count(), 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class UploadTransactionTests(TransactionTestCase):
+    def test_upload_requires_transaction(self):
+        """Без транзакции блокировка pin снялась бы до ссылки поста"""
+        user = User.objects.create_user(username="auth")
+        with self.assertRaises(TransactionManagementError):
+            Post.objects.create(author=user, text="Пост", image=uploaded())
+        self.assertFalse(Post.objects.exists())
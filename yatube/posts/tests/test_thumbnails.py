@@ -0,0 +1,264 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import default, get_thumbnail
+
+from .. import thumbnails
+from ..models import Group, Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def uploaded(name="small.gif", color=b"\xFF"):
+    """Картинка 2x1; разный цвет даёт разное содержимое файла."""
+    content = SMALL_GIF.replace(b"\xFF\xFF\xFF", b"\xFF\xFF" + color)
+    return SimpleUploadedFile(
+        name=name, content=content, content_type="image/gif"
+    )
+
+
+def run_on_commit():
+    """Выполняет отложенные до коммита действия внутри TestCase."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        default.kvstore.local.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_page_shows_original_until_thumbnail_is_ready(self):
+        """Пока превью нет, страница показывает оригинал и не ждёт его"""
+        post = Post.objects.create(
+            author=self.user, text="Пост", image=uploaded()
+        )
+        response = self.authorized_client.get(reverse("posts:home_page"))
+        self.assertContains(response, post.image.url)
+        self.assertIsNone(thumbnails.cached(post.image, "960x339"))
+        run_on_commit()
+        thumbnail = thumbnails.cached(post.image, "960x339")
+        self.assertIsNotNone(thumbnail)
+        cache.clear()
+        response = self.authorized_client.get(reverse("posts:home_page"))
+        self.assertContains(response, thumbnail.url)
+
+    def test_page_offers_webp_and_widths(self):
+        """Готовые варианты отдаются через srcset, WebP — отдельно"""
+        post = Post.objects.create(
+            author=self.user, text="Пост", image=uploaded()
+        )
+        thumbnails.schedule(post.image)
+        run_on_commit()
+        response = self.authorized_client.get(reverse("posts:home_page"))
+        small = thumbnails.cached(post.image, "320x113")
+        webp = thumbnails.cached(post.image, "320x113 webp")
+        self.assertTrue(webp.name.endswith(".webp"))
+        self.assertTrue(small.name.endswith(".gif"))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, f"{webp.url} 320w")
+        self.assertContains(response, f"{small.url} 320w")
+        self.assertContains(
+            response,
+            f'src="{thumbnails.cached(post.image, "960x339").url}"'
+        )
+
+    def test_cached_pages_pick_up_thumbnails(self):
+        """Страница из кеша получает srcset, как только превью готовы"""
+        group = Group.objects.create(
+            title="Группа", slug="pictures", description="-"
+        )
+        post = Post.objects.create(
+            author=self.user, group=group, text="Пост", image=uploaded()
+        )
+        url = reverse("posts:group_posts", args=[group.slug])
+        clients = {"guest": Client(), "reader": self.authorized_client}
+        for name, client in clients.items():
+            with self.subTest(client=name):
+                response = client.get(url)
+                self.assertContains(response, post.image.url)
+                self.assertNotContains(response, "srcset=")
+        run_on_commit()
+        small = thumbnails.cached(post.image, "320x113")
+        webp = thumbnails.cached(post.image, "320x113 webp")
+        for name, client in clients.items():
+            with self.subTest(client=name):
+                response = client.get(url)
+                self.assertContains(response, f"{small.url} 320w")
+                self.assertContains(response, f"{webp.url} 320w")
+
+    def test_upload_schedules_all_variants(self):
+        """Загрузка картинки ставит в очередь все варианты превью"""
+        variants = {
+            "960x339": {"crop": "center", "upscale": True},
+            "100x100": {"crop": "center"},
+        }
+        with self.settings(THUMBNAIL_VARIANTS=variants):
+            self.authorized_client.post(
+                reverse("posts:post_create"),
+                data={"text": "С картинкой", "image": uploaded()}
+            )
+            run_on_commit()
+            post = Post.objects.get(text="С картинкой")
+            for geometry in variants:
+                with self.subTest(geometry=geometry):
+                    self.assertIsNotNone(
+                        thumbnails.cached(post.image, geometry)
+                    )
+
+    def test_edit_without_new_image_schedules_nothing(self):
+        """Правка текста не пересоздаёт превью"""
+        post = Post.objects.create(
+            author=self.user, text="Пост", image=uploaded()
+        )
+        run_on_commit()
+        with mock.patch.object(thumbnails, "schedule") as schedule:
+            self.authorized_client.post(
+                reverse("posts:post_edit", kwargs={"post_id": post.id}),
+                data={"text": "Новый текст"}
+            )
+        schedule.assert_not_called()
+
+    def test_name_matches_sorl(self):
+        """Имя превью совпадает с тем, что создаёт sorl"""
+        post = Post.objects.create(
+            author=self.user, text="Пост", image=uploaded()
+        )
+        expected = get_thumbnail(
+            post.image, "960x339", crop="center", upscale=True
+        )
+        thumbnail = default.backend.thumbnail_file(
+            post.image, "960x339", crop="center", upscale=True
+        )
+        self.assertEqual(thumbnail.name, expected.name)
+
+    def test_pending_thumbnail_is_queued_once(self):
+        """Превью, уже стоящее в очереди, повторно не ставится"""
+        pool = mock.Mock()
+        with self.settings(THUMBNAIL_WORKERS=2), \
+                mock.patch.object(thumbnails, "executor", return_value=pool):
+            thumbnails.submit("posts/small.gif", "960x339")
+            thumbnails.submit("posts/small.gif", "960x339")
+        self.assertEqual(pool.submit.call_count, 1)
+        thumbnails._pending.clear()
+
+    def test_failed_thumbnail_is_not_retried(self):
+        """Превью битого файла не ставится в очередь на каждом показе"""
+        broken = SimpleUploadedFile(
+            name="broken.gif", content=b"not a gif",
+            content_type="image/gif"
+        )
+        post = Post.objects.create(author=self.user, text="Пост", image=broken)
+        with self.assertLogs("posts.thumbnails", "ERROR"):
+            thumbnails.srcsets(post.image)
+            run_on_commit()
+        with mock.patch.object(thumbnails, "submit") as submit:
+            thumbnails.srcsets(post.image)
+            run_on_commit()
+            submit.assert_not_called()
+            # после срока попытка повторяется
+            cache.clear()
+            thumbnails.srcsets(post.image)
+            run_on_commit()
+        self.assertEqual(
+            submit.call_count, len(settings.THUMBNAIL_VARIANTS)
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailLookupTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        for i in range(3):
+            post = Post.objects.create(
+                author=cls.user, text=f"Пост {i}", image=uploaded()
+            )
+            for variant in settings.THUMBNAIL_VARIANTS:
+                thumbnails.generate(post.image.name, variant)
+        Post.objects.create(
+            author=cls.user, text="Ещё без превью",
+            image=uploaded(color=b"\x00")
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        default.kvstore.local.clear()
+        self.guest_client = Client()
+
+    def kvstore_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_client.get(reverse("posts:home_page"))
+        self.assertEqual(response.status_code, 200)
+        return [
+            query for query in queries
+            if "thumbnail_kvstore" in query["sql"]
+        ]
+
+    def test_page_reads_thumbnails_in_one_query(self):
+        """Сведения о превью всей страницы читаются одним запросом"""
+        self.assertEqual(len(self.kvstore_queries()), 1)
+
+    def test_local_cache_spares_shared_store(self):
+        """Готовые превью повторно берутся из памяти процесса"""
+        self.kvstore_queries()
+        cache.clear()
+        queries = self.kvstore_queries()
+        # заново спрашиваются только превью, которые ещё не созданы
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            queries[0]["sql"].count("sorl-thumbnail"),
+            len(settings.THUMBNAIL_VARIANTS)
+        )
+
+    def test_page_links_ready_thumbnails(self):
+        """Готовые превью попадают на страницу, остальные — оригиналом"""
+        response = self.guest_client.get(reverse("posts:home_page"))
+        for post in response.context["page_obj"]:
+            with self.subTest(post=post.text):
+                thumbnail = post.image._thumbnails["960x339"]
+                if post.text == "Ещё без превью":
+                    self.assertIsNone(thumbnail)
+                    self.assertContains(response, post.image.url)
+                else:
+                    self.assertContains(response, thumbnail.url)
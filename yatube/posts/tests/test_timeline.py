@@ -0,0 +1,150 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import timeline
+from ..models import Follow, Post, TimelineEntry
+from .test_warmer import run_on_commit
+
+User = get_user_model()
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username="reader")
+        cls.author = User.objects.create_user(username="author")
+        cls.other = User.objects.create_user(username="other")
+        cls.old_post = Post.objects.create(author=cls.author, text="Старый")
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def follow(self, author):
+        self.client.get(
+            reverse("posts:profile_follow", kwargs={"username": author})
+        )
+
+    def feed(self):
+        response = self.client.get(reverse("posts:follow_index"))
+        return list(response.context["page_obj"])
+
+    def test_follow_backfills_timeline(self):
+        """Подписка переносит в ленту уже опубликованные посты"""
+        self.follow("author")
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=self.old_post
+        ).exists())
+        self.assertEqual(self.feed(), [self.old_post])
+
+    def test_new_post_fans_out(self):
+        """Новый пост раскладывается по лентам подписчиков"""
+        self.follow("author")
+        post = Post.objects.create(author=self.author, text="Новый")
+        Post.objects.create(author=self.other, text="Чужой")
+        self.assertEqual(self.feed(), [post, self.old_post])
+
+    def test_unfollow_prunes_timeline(self):
+        """Отписка убирает посты автора из ленты"""
+        self.follow("author")
+        self.client.get(
+            reverse("posts:profile_unfollow", kwargs={"username": "author"})
+        )
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists()
+        )
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_popular_author_is_pulled_on_read(self):
+        """Посты популярного автора не раскладываются, а читаются из Post"""
+        self.follow("author")
+        post = Post.objects.create(author=self.author, text="Новый")
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), [post, self.old_post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_pulled_and_stored_posts_are_merged(self):
+        """Лента смешивает разложенные и подмешанные посты по дате"""
+        Follow.objects.create(user=self.other, author=self.author)
+        self.follow("author")
+        self.follow("other")
+        posts = [
+            Post.objects.create(author=author, text=str(i))
+            for i, author in enumerate([self.author, self.other] * 6)
+        ]
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 6
+        )
+        first = self.client.get(reverse("posts:follow_index"))
+        page_obj = first.context["page_obj"]
+        second = self.client.get(
+            reverse("posts:follow_index"), {"after": page_obj.next_cursor}
+        )
+        second_page = second.context["page_obj"]
+        self.assertEqual(
+            list(page_obj) + list(second_page),
+            posts[::-1] + [self.old_post]
+        )
+        back = self.client.get(
+            reverse("posts:follow_index"),
+            {"before": second_page.previous_cursor}
+        )
+        self.assertEqual(list(back.context["page_obj"]), list(page_obj))
+
+    @override_settings(
+        TIMELINE_FANOUT_LIMIT=2, TIMELINE_FANOUT_MARGIN=0, TIMELINE_WORKERS=0
+    )
+    def test_author_below_limit_is_backfilled(self):
+        """После отписки ниже порога посты автора остаются в лентах"""
+        self.follow("author")
+        Follow.objects.create(user=self.other, author=self.author)
+        post = Post.objects.create(author=self.author, text="Новый")
+        self.assertEqual(self.feed(), [post, self.old_post])
+        Follow.objects.filter(user=self.other).delete()
+        # раскладка идёт после коммита отписки
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+        run_on_commit()
+        self.assertEqual(self.feed(), [post, self.old_post])
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2
+        )
+
+    @override_settings(
+        TIMELINE_FANOUT_LIMIT=3, TIMELINE_FANOUT_MARGIN=1, TIMELINE_WORKERS=0
+    )
+    def test_pulled_author_keeps_mode_within_margin(self):
+        """У самого порога автор не переключается обратно"""
+        readers = [
+            User.objects.create_user(username=f"reader{number}")
+            for number in range(2)
+        ]
+        self.follow("author")
+        for reader in readers:
+            Follow.objects.create(user=reader, author=self.author)
+        self.assertTrue(timeline.is_pulled(self.author.id))
+        post = Post.objects.create(author=self.author, text="Новый")
+        Follow.objects.filter(user=readers[0]).delete()
+        run_on_commit()
+        self.assertTrue(timeline.is_pulled(self.author.id))
+        Follow.objects.create(user=readers[0], author=self.author)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        Follow.objects.filter(user__in=readers).delete()
+        run_on_commit()
+        self.assertFalse(timeline.is_pulled(self.author.id))
+        self.assertEqual(self.feed(), [post, self.old_post])
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=post
+        ).exists())
+
+    def test_rebuild_command(self):
+        """Команда rebuild_timeline восстанавливает ленты"""
+        self.follow("author")
+        TimelineEntry.objects.all().delete()
+        call_command("rebuild_timeline", stdout=StringIO())
+        self.assertEqual(self.feed(), [self.old_post])
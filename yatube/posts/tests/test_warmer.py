@@ -0,0 +1,211 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import (Client, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+
+from .. import warmer
+from ..models import Group, Post
+
+User = get_user_model()
+
+TEMP_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+STATE = os.path.join(TEMP_DIR, "hot.json")
+
+
+def run_on_commit():
+    """Выполняет отложенные до коммита действия внутри TestCase."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
+class FrequencySketchTests(SimpleTestCase):
+    def test_estimate_is_never_low(self):
+        """Оценка частоты не меньше настоящей"""
+        sketch = warmer.FrequencySketch(width=64, depth=4, sample=10 ** 6)
+        for number in range(200):
+            for _ in range(number % 7):
+                sketch.add(f"/page/{number}/")
+        for number in range(200):
+            self.assertGreaterEqual(
+                sketch.estimate(f"/page/{number}/"), number % 7
+            )
+
+    def test_aging(self):
+        """Со временем счётчики делятся пополам"""
+        sketch = warmer.FrequencySketch(width=64, depth=4, sample=10)
+        for _ in range(9):
+            sketch.add("/")
+        self.assertEqual(sketch.estimate("/"), 9)
+        sketch.add("/")
+        self.assertEqual(sketch.estimate("/"), 5)
+
+    def test_hot_pages(self):
+        """В списке остаются самые частые адреса"""
+        pages = warmer.HotPages(3)
+        for number in range(1, 50):
+            # адрес /n/ запрошен n раз, вперемешку с остальными
+            for repeat in range(number):
+                pages.record(f"/{number}/")
+                pages.record(f"/rare/{number}/{repeat}/")
+        self.assertEqual(set(pages.paths()), {"/49/", "/48/", "/47/"})
+
+
+@override_settings(CACHE_WARMER_STATE=STATE, CACHE_WARMER_PAGES=10)
+class CacheWarmerTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="auth")
+        cls.group = Group.objects.create(
+            title="Тестовая группа", slug="test_slug", description="-"
+        )
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text="Первый пост"
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        if os.path.exists(STATE):
+            os.remove(STATE)
+        warmer.reset()
+        self.addCleanup(warmer.reset)
+        # фоновый поток в тестах не нужен: прогрев вызывается напрямую
+        patcher = mock.patch.object(warmer, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = reverse("posts:home_page")
+        self.group_url = reverse("posts:group_posts", args=["test_slug"])
+
+    def test_records_anonymous_feed_pages(self):
+        """Учитываются только анонимные запросы лент"""
+        for _ in range(3):
+            Client().get(self.index)
+        Client().get(self.group_url)
+        Client().get(reverse("posts:post_detail", args=[self.post.id]))
+        authorized = Client()
+        authorized.force_login(self.user)
+        for _ in range(5):
+            authorized.get(reverse("posts:profile", args=["auth"]))
+        self.assertEqual(warmer.hot().paths(), [self.index, self.group_url])
+
+    def test_warm_renders_missing_page(self):
+        """Прогретую страницу аноним получает из кеша"""
+        self.assertEqual(warmer.warm_page(self.index), "rendered")
+        self.assertEqual(warmer.warm_page(self.index), "fresh")
+        Post.objects.filter(pk=self.post.pk).update(text="Тихая правка")
+        response = Client().get(self.index)
+        self.assertIsNone(response.context)
+        self.assertContains(response, "Первый пост")
+        # прогрев не считается посещением
+        self.assertEqual(warmer.hot().paths(), [self.index])
+
+    def test_warm_ahead_of_expiry(self):
+        """Страница, срок которой скоро истечёт, пересобирается заранее"""
+        warmer.warm_page(self.index)
+        with mock.patch("posts.cache.time.time",
+                        return_value=time.time()
+                        + settings.PAGE_CACHE_TIMEOUT - 30):
+            self.assertEqual(warmer.warm_page(self.index), "fresh")
+            self.assertEqual(warmer.warm_page(self.index, 60), "rendered")
+
+    def test_warm_unknown_page(self):
+        """Несуществующая страница не кешируется"""
+        self.assertEqual(warmer.warm_page("/no/such/page/"), "error")
+        self.assertEqual(
+            warmer.warm_page(reverse("posts:group_posts", args=["x"])),
+            "error"
+        )
+
+    def test_new_post_wakes_warmer(self):
+        """Новый пост после коммита будит прогрев горячих страниц"""
+        Client().get(self.index)
+        Post.objects.create(author=self.user, text="Второй пост")
+        self.assertFalse(warmer._wake.is_set())
+        run_on_commit()
+        self.assertTrue(warmer._wake.is_set())
+        warmer.warm(warmer.hot().paths())
+        response = Client().get(self.index)
+        self.assertIsNone(response.context)
+        self.assertContains(response, "Второй пост")
+
+    def test_state_survives_restart(self):
+        """Новый процесс начинает со списка, сохранённого прежним"""
+        for _ in range(2):
+            Client().get(self.group_url)
+        Client().get(self.index)
+        warmer.save()
+        with open(STATE) as stream:
+            self.assertEqual(
+                json.load(stream), {self.group_url: 2, self.index: 1}
+            )
+        warmer.reset()
+        self.assertEqual(warmer.hot().paths(), [self.group_url, self.index])
+
+    def test_warm_cache_command(self):
+        """warm_cache прогревает сохранённые страницы и главную"""
+        with open(STATE, "w") as stream:
+            json.dump({self.group_url: 5, "/no/such/page/": 1}, stream)
+        output = StringIO()
+        call_command("warm_cache", stdout=output)
+        self.assertEqual(
+            output.getvalue().strip(),
+            "Страниц: 3, пересобрано: 2, уже в кеше: 0, ошибок: 1"
+        )
+        self.assertIsNone(Client().get(self.group_url).context)
+
+
+# поток читает базу своим соединением: данные теста должны быть закоммичены
+@override_settings(
+    CACHE_WARMER_STATE=None, CACHE_WARMER_PAGES=10,
+    CACHE_WARMER_INTERVAL=3600,
+)
+class WarmerThreadTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        warmer.reset()
+        self.addCleanup(warmer.reset)
+        self.addCleanup(warmer.stop)
+        user = User.objects.create_user(username="auth")
+        Post.objects.create(author=user, text="Первый пост")
+
+    def test_thread_warms_after_commit(self):
+        """Поток пересобирает горячую страницу после нового поста"""
+        index = reverse("posts:home_page")
+        Client().get(index)
+        done = threading.Event()
+        real_warm = warmer.warm
+
+        def warm(*args, **kwargs):
+            try:
+                return real_warm(*args, **kwargs)
+            finally:
+                done.set()
+
+        with mock.patch.object(warmer, "warm", warm):
+            Post.objects.create(
+                author=User.objects.get(), text="Второй пост"
+            )
+            self.assertTrue(done.wait(10))
+        warmer.stop()
+        response = Client().get(index)
+        self.assertIsNone(response.context)
+        self.assertContains(response, "Второй пост")
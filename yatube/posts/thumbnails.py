@@ -0,0 +1,347 @@
+"""
+Фоновая генерация превью картинок постов.
+
+Загрузка картинки ставит в очередь все варианты из
+settings.THUMBNAIL_VARIANTS (несколько ширин в исходном формате и в
+WebP), а шаблоны через {% post_picture %} только ищут готовые варианты
+и, пока их нет, показывают оригинал — запрос никогда не ждёт Pillow.
+Генерация начинается после коммита, чтобы поток видел сохранённый пост.
+
+Когда готов последний вариант картинки, страницы её постов
+сбрасываются: в кеш они попали с оригиналом вместо превью.
+
+Сведения о превью всей страницы ленты prefetch читает одним запросом,
+а KVStore держит прочитанное в LRU процесса перед общим кешем.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.db import connection, transaction
+from sorl.thumbnail import base, default
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.metrics import THUMBNAIL_SECONDS, THUMBNAILS
+from core.timing import timed
+
+from . import cache, images
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = set()
+# картинки с новыми превью, о которых закешированные страницы не знают
+_refreshed = set()
+_lock = threading.Lock()
+
+
+class ThumbnailBackend(base.ThumbnailBackend):
+    """Умеет вычислить имя превью, не создавая его."""
+
+    def get_options(self, source, options):
+        # те же умолчания, что подставляет get_thumbnail
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault("format", self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        options = self.get_options(source, options)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+
+class LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """
+    Хранилище ключей sorl с LRU процесса перед общим кешем и базой.
+    Локально запоминаются только найденные значения: превью, которое
+    ещё генерируется, должно появиться, как только его запишет другой
+    процесс.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.local = LRUCache(settings.THUMBNAIL_LOCAL_CACHE_SIZE)
+
+    def _get_raw(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def get_many_raw(self, keys):
+        """Значения ключей: LRU, затем общий кеш, затем один запрос."""
+        found = {}
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+        missing = [key for key in keys if key not in found]
+        if missing:
+            cached = self.cache.get_many(missing)
+            missing = [key for key in missing if key not in cached]
+            stored = dict(KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list("key", "value"))
+            self.cache.set_many(stored, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            for key in missing:
+                # пока шёл запрос, превью мог записать другой поток:
+                # отметка «нет» не должна затирать готовое значение
+                if key not in stored:
+                    self.cache.add(
+                        key, cached_db_kvstore.EMPTY_VALUE,
+                        sorl_settings.THUMBNAIL_CACHE_TIMEOUT
+                    )
+            cached.update(stored)
+            for key, value in cached.items():
+                if value != cached_db_kvstore.EMPTY_VALUE:
+                    found[key] = value
+                    self.local.set(key, value)
+        return found
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self.local.set(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self.local.delete(*keys)
+
+
+def variant_geometry(variant):
+    # "640x226 webp" — тот же размер, что "640x226", в другом формате
+    return variant.split()[0]
+
+
+def variant_options(variant):
+    return settings.THUMBNAIL_VARIANTS.get(variant, {})
+
+
+def thumbnail_file(image, variant):
+    return default.backend.thumbnail_file(
+        image, variant_geometry(variant), **variant_options(variant)
+    )
+
+
+def cached(image, variant):
+    """Готовое превью из хранилища ключей sorl или None."""
+    prefetched = getattr(image, "_thumbnails", {})
+    if variant in prefetched:
+        return prefetched[variant]
+    return default.kvstore.get(thumbnail_file(image, variant))
+
+
+@timed("thumbnail")
+def prefetch(posts, variants=None):
+    """
+    Читает сведения о превью картинок всех постов страницы за один
+    проход по хранилищу и запоминает их на самих картинках.
+    """
+    files = {}
+    for post in posts:
+        if post.image:
+            post.image._thumbnails = {}
+            for variant in variants or settings.THUMBNAIL_VARIANTS:
+                thumbnail = thumbnail_file(post.image, variant)
+                # одинаковые картинки разных постов делят одно превью
+                files.setdefault(add_prefix(thumbnail.key), []).append(
+                    (post.image, variant)
+                )
+    if not files or not hasattr(default.kvstore, "get_many_raw"):
+        return
+    found = default.kvstore.get_many_raw(list(files))
+    for key, targets in files.items():
+        thumbnail = None
+        if key in found:
+            thumbnail = deserialize_image_file(found[key])
+        for image, variant in targets:
+            image._thumbnails[variant] = thumbnail
+
+
+@timed("thumbnail")
+def generate(name, variant):
+    started = time.perf_counter()
+    result = "ok"
+    try:
+        # ключ превью в sorl зависит от хранилища исходного файла
+        source = ImageFile(name, images.storage())
+        thumbnail = default.backend.get_thumbnail(
+            source, variant_geometry(variant), **variant_options(variant)
+        )
+        # нечитаемый исходник sorl только пишет в лог и возвращает
+        # несозданное превью
+        if default.kvstore.get(thumbnail) is None:
+            raise OSError(f"sorl не создал превью {thumbnail.name}")
+    except Exception:
+        result = "error"
+        logger.exception("Не удалось создать превью %s %s", name, variant)
+        # битый файл не переделать на каждой странице: ждём срок
+        shared_cache.set(
+            failed_key(name, variant), True, settings.THUMBNAIL_RETRY_AFTER
+        )
+    finally:
+        THUMBNAIL_SECONDS.observe(
+            time.perf_counter() - started, variant=variant
+        )
+        THUMBNAILS.inc(variant=variant, result=result)
+        with _lock:
+            _pending.discard((name, variant))
+            if result == "ok":
+                _refreshed.add(name)
+            finished = name in _refreshed and not any(
+                pending == name for pending, _ in _pending
+            )
+            if finished:
+                _refreshed.discard(name)
+        if finished:
+            refresh_pages(name)
+
+
+def failed_key(name, variant):
+    return "thumbnail-failed:" + hashlib.md5(
+        f"{name}|{variant}".encode()
+    ).hexdigest()
+
+
+def not_failed(name, variants):
+    """Варианты, которые недавно не удалось создать, отбрасываются."""
+    if not variants:
+        return variants
+    keys = {variant: failed_key(name, variant) for variant in variants}
+    failed = shared_cache.get_many(list(keys.values()))
+    return [variant for variant in variants if keys[variant] not in failed]
+
+
+def refresh_pages(name):
+    """Сбрасывает закешированные страницы постов с картинкой name."""
+    scopes = [cache.FEED]
+    for post_id, username, group_slug in Post.objects.filter(
+        image=name
+    ).values_list("id", "author__username", "group__slug"):
+        scopes.extend(cache.post_scopes(post_id, username, group_slug))
+    if len(scopes) > 1:
+        cache.bump(*scopes)
+
+
+def run_in_worker(name, variant):
+    try:
+        generate(name, variant)
+    finally:
+        # у каждого потока своё соединение с базой
+        connection.close()
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix="thumbnails",
+            )
+        return _executor
+
+
+def submit(name, variant):
+    with _lock:
+        if (name, variant) in _pending:
+            return
+        _pending.add((name, variant))
+    if settings.THUMBNAIL_WORKERS:
+        executor().submit(run_in_worker, name, variant)
+    else:
+        generate(name, variant)
+
+
+def schedule(image, variants=None):
+    """Ставит в очередь превью картинки после коммита транзакции."""
+    if not image:
+        return
+    if variants is None:
+        variants = settings.THUMBNAIL_VARIANTS
+    name = image.name
+    for variant in variants:
+        transaction.on_commit(
+            lambda variant=variant: submit(name, variant)
+        )
+
+
+@timed("thumbnail")
+def srcsets(image):
+    """
+    Готовые варианты картинки для <picture>: srcset в исходном формате
+    и в WebP, а также src для старых браузеров — самый крупный готовый
+    вариант или оригинал. Недостающие варианты ставятся в очередь,
+    кроме тех, что не удалось создать за THUMBNAIL_RETRY_AFTER секунд.
+    """
+    ready = {}
+    missing = []
+    for variant, options in settings.THUMBNAIL_VARIANTS.items():
+        thumbnail = cached(image, variant)
+        if thumbnail is None:
+            missing.append(variant)
+            continue
+        ready.setdefault(options.get("format"), []).append(thumbnail)
+    schedule(image, not_failed(image.name, missing))
+    context = {"src": image.url, "srcset": "", "webp_srcset": ""}
+    for format_, found in ready.items():
+        found.sort(key=lambda thumbnail: thumbnail.width)
+        srcset = ", ".join(
+            f"{thumbnail.url} {thumbnail.width}w" for thumbnail in found
+        )
+        if format_ == "WEBP":
+            context["webp_srcset"] = srcset
+        else:
+            context["srcset"] = srcset
+            context["src"] = found[-1].url
+    return context
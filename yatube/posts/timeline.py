@@ -0,0 +1,268 @@
+"""
+Лента подписок с разнесением постов при записи (fan-out on write).
+
+Новый пост сразу раскладывается в TimelineEntry всех подписчиков автора,
+поэтому страница follow_index — один проход по индексу
+(user, -pub_date, -post). Автор, набравший TIMELINE_FANOUT_LIMIT
+подписчиков, помечается AuthorCounters.pulled: его посты
+не раскладываются, а подмешиваются при чтении. Обратно автор переходит,
+только опустившись на TIMELINE_FANOUT_MARGIN ниже порога, — тогда его
+посты раскладываются оставшимся подписчикам в фоне после коммита
+отписки. Запас не даёт автору у самого порога переключаться туда
+и обратно на каждой подписке.
+"""
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import counters
+from .models import AuthorCounters, Follow, Post, TimelineEntry
+from .paginator import CursorPaginator, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+_executor = None
+_lock = threading.Lock()
+
+
+def is_pulled(author_id):
+    """Посты автора читаются из Post напрямую, а не из ленты."""
+    return AuthorCounters.objects.filter(pk=author_id, pulled=True).exists()
+
+
+def pulled_authors(user):
+    followed = Follow.objects.filter(user=user).values("author")
+    return list(
+        AuthorCounters.objects.filter(
+            author__in=followed, pulled=True
+        ).values_list("author", flat=True)
+    )
+
+
+def fan_out(post):
+    if is_pulled(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list("user_id", flat=True)
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post=post,
+                author_id=post.author_id,
+                pub_date=post.pub_date,
+            )
+            for user_id in follower_ids.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def fan_out_many(posts):
+    """fan_out для пачки постов: подписчики всех авторов одним запросом."""
+    by_author = defaultdict(list)
+    for post in posts:
+        by_author[post.author_id].append(post)
+    pulled = AuthorCounters.objects.filter(
+        author__in=list(by_author), pulled=True
+    ).values_list("author", flat=True)
+    follows = Follow.objects.filter(
+        author__in=set(by_author) - set(pulled)
+    ).values_list("user_id", "author_id")
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post.id,
+                author_id=author_id,
+                pub_date=post.pub_date,
+            )
+            for user_id, author_id in follows.iterator()
+            for post in by_author[author_id]
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    if is_pulled(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        "id", "pub_date"
+    )
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for post_id, pub_date in posts.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill_followers(author_id):
+    """Раскладывает все посты автора всем его подписчикам."""
+    ops = connection.ops
+    sql = """
+        {insert} {entry} (user_id, post_id, author_id, pub_date)
+        SELECT follow.user_id, post.id, post.author_id, post.pub_date
+        FROM {follow} follow
+        JOIN {post} post ON post.author_id = follow.author_id
+        WHERE follow.author_id = %s {suffix}
+    """.format(
+        insert=ops.insert_statement(ignore_conflicts=True),
+        entry=TimelineEntry._meta.db_table,
+        follow=Follow._meta.db_table,
+        post=Post._meta.db_table,
+        suffix=ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [author_id])
+
+
+def followed(user_id, author_id):
+    # посты автора, набравшего порог, дальше подмешиваются при чтении
+    AuthorCounters.objects.filter(
+        pk=author_id,
+        pulled=False,
+        followers_count__gte=settings.TIMELINE_FANOUT_LIMIT,
+    ).update(pulled=True)
+    backfill(user_id, author_id)
+
+
+def unfollowed(user_id, author_id):
+    prune(user_id, author_id)
+    pulled, followers = AuthorCounters.objects.filter(
+        pk=author_id
+    ).values_list("pulled", "followers_count").first() or (False, 0)
+    if pulled and not counters.pulled_for(followers, was_pulled=True):
+        transaction.on_commit(lambda: submit(author_id))
+
+
+def push_back(author_id):
+    """
+    Возвращает автора, опустившегося ниже порога с запасом, к раскладке
+    при записи: его посты, написанные в режиме чтения, никому
+    не разложены. Флаг и раскладка меняются в одной транзакции, чтобы
+    посты автора не пропали из лент между ними.
+    """
+    with transaction.atomic():
+        updated = AuthorCounters.objects.filter(
+            pk=author_id,
+            pulled=True,
+            followers_count__lt=(
+                settings.TIMELINE_FANOUT_LIMIT
+                - settings.TIMELINE_FANOUT_MARGIN
+            ),
+        ).update(pulled=False)
+        if updated:
+            backfill_followers(author_id)
+
+
+def run_in_worker(author_id):
+    try:
+        push_back(author_id)
+    except Exception:
+        logger.exception("Не удалось разложить посты автора %s", author_id)
+    finally:
+        # у каждого потока своё соединение с базой
+        connection.close()
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TIMELINE_WORKERS,
+                thread_name_prefix="timeline",
+            )
+        return _executor
+
+
+def submit(author_id):
+    if settings.TIMELINE_WORKERS:
+        executor().submit(run_in_worker, author_id)
+    else:
+        push_back(author_id)
+
+
+def prune(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, author_id=author_id
+    ).delete()
+
+
+def rebuild():
+    """
+    Раскладывает все посты заново одним INSERT ... SELECT: построчный
+    backfill на миллионах записей ленты в разы медленнее.
+    """
+    TimelineEntry.objects.all().delete()
+    sql = """
+        INSERT INTO {entry} (user_id, post_id, author_id, pub_date)
+        SELECT follow.user_id, post.id, post.author_id, post.pub_date
+        FROM {follow} follow
+        JOIN {post} post ON post.author_id = follow.author_id
+        LEFT JOIN {counters} counters
+            ON counters.author_id = follow.author_id
+        WHERE counters.pulled IS NULL OR NOT counters.pulled
+    """.format(
+        entry=TimelineEntry._meta.db_table,
+        follow=Follow._meta.db_table,
+        post=Post._meta.db_table,
+        counters=AuthorCounters._meta.db_table,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+
+
+class TimelinePaginator(CursorPaginator):
+    """
+    Листает TimelineEntry пользователя и сливает результат с постами
+    «тяжёлых» авторов, которые при записи не раскладывались.
+    """
+
+    def __init__(self, user, per_page):
+        ordering = ("-pub_date", "-post_id")
+        entries = TimelineEntry.objects.filter(user=user).select_related(
+            "post__author", "post__group"
+        ).order_by(*ordering)
+        super().__init__(entries, per_page, ordering=ordering)
+        self.pulled = pulled_authors(user)
+
+    def fetch(self, cursor, backwards):
+        posts = [entry.post for entry in super().fetch(cursor, backwards)]
+        if self.pulled:
+            pulled = CursorPaginator(
+                Post.objects.filter(author__in=self.pulled)
+                .select_related("author", "group"),
+                self.per_page,
+            )
+            posts.extend(pulled.fetch(cursor, backwards))
+            unique = {post.id: post for post in posts}.values()
+            select = heapq.nsmallest if backwards else heapq.nlargest
+            posts = select(
+                self.per_page + 1,
+                unique,
+                key=lambda post: (post.pub_date, post.id),
+            )
+        return posts
+
+    def cursor_for(self, item):
+        return encode_cursor([item.pub_date, item.id])
@@ -1,15 +1,18 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = "posts"
 
 urlpatterns = [
     path("", views.index, name="home_page"),
+    path("search/", views.search, name="search"),
     path("group/<slug:slug>/", views.group_posts, name="group_posts"),
     path("profile/<str:username>/", views.profile, name="profile"),
     path("posts/<int:post_id>/", views.post_detail, name="post_detail"),
     path("create/", views.post_create, name="post_create"),
     path("posts/<int:post_id>/edit/", views.post_edit, name="post_edit"),
+    path("posts/<int:post_id>/comments/",
+         views.post_comments, name="post_comments"),
     path("posts/<int:post_id>/comment/",
          views.add_comment, name="add_comment"),
     path('follow/', views.follow_index, name='follow_index'),
@@ -23,4 +26,10 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path("api/posts/", api.index, name="api_index"),
+    path("api/group/<slug:slug>/", api.group_posts, name="api_group"),
+    path("api/profile/<str:username>/", api.profile, name="api_profile"),
+    path("api/posts/<int:post_id>/", api.post_detail, name="api_post"),
+    path("api/posts/<int:post_id>/comments/",
+         api.comments, name="api_comments"),
 ]
@@ -1,8 +1,40 @@
-from django.core.paginator import Paginator
+from itertools import islice
+
+from . import thumbnails
+from .models import Comment
+from .paginator import CursorPaginator
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 50
 
 
 def paginate_page(request, post_list):
-    POSTS_PER_PAGE = 10
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get("page")
-    return paginator.get_page(page_number)
+    return get_page(request, CursorPaginator(post_list, POSTS_PER_PAGE))
+
+
+def get_page(request, paginator):
+    page = paginator.get_page(
+        after=request.GET.get("after"),
+        before=request.GET.get("before")
+    )
+    thumbnails.prefetch(page)
+    return page
+
+
+def comments_page(request, post_id):
+    """Порция комментариев после курсора ?after= вместе с авторами."""
+    ordering = ("created", "id")
+    comments = Comment.objects.filter(post_id=post_id).select_related(
+        "author"
+    ).order_by(*ordering)
+    paginator = CursorPaginator(comments, COMMENTS_PER_PAGE, ordering)
+    return paginator.get_page(after=request.GET.get("after"))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
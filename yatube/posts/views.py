@@ -3,66 +3,159 @@ from .models import Post, Group, Follow
 from .forms import PostForm, CommentForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
-from .utils import paginate_page
-from django.views.decorators.cache import cache_page
+from .utils import paginate_page, get_page, comments_page, POSTS_PER_PAGE
+from .timeline import TimelinePaginator
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from . import cache
+from django.db import transaction
+from . import counters
+from . import search as post_search
+from . import thumbnails
+from urllib.parse import urlencode
 
 User = get_user_model()
 
 
-@cache_page(20)
+def group_scopes(request, slug):
+    return [cache.group_scope(slug)]
+
+
+def profile_scopes(request, username):
+    return [cache.author_scope(username)]
+
+
+def post_scopes(request, post_id):
+    # нужны и проверке ETag, и кешу страницы: запрос к базе один
+    if not hasattr(request, "post_scopes"):
+        row = Post.objects.filter(id=post_id).values_list(
+            "author__username", "group__slug"
+        ).first()
+        if row is None:
+            request.post_scopes = [cache.post_scope(post_id)]
+        else:
+            request.post_scopes = cache.post_scopes(post_id, *row)
+    return request.post_scopes
+
+
+@cache.conditional("index")
+@cache.cache_page_for_anonymous(
+    settings.PAGE_CACHE_TIMEOUT, "index", warm=True
+)
 def index(request):
-    post_list = Post.objects.all()
-    page_obj = paginate_page(request, post_list)
+    post_list = Post.objects.select_related("author", "group")
+    # страница ленты вычисляется, только если фрагмент не найден в кеше
+    page_obj = SimpleLazyObject(lambda: paginate_page(request, post_list))
     context = {
-        "page_obj": page_obj
+        "page_obj": page_obj,
+        "feed_key": cache.feed_key(request, cache.FEED),
+        "feed_cache_timeout": settings.PAGE_CACHE_TIMEOUT
     }
     return render(request, "posts/index.html", context)
 
 
+@cache.conditional("group", group_scopes)
+@cache.cache_page_for_anonymous(
+    settings.PAGE_CACHE_TIMEOUT, "group", group_scopes, warm=True
+)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    page_obj = paginate_page(request, post_list)
+    post_list = group.posts.select_related("author", "group")
+    page_obj = SimpleLazyObject(lambda: paginate_page(request, post_list))
     title = group.title
     description = group.description
     context = {
         "page_obj": page_obj,
         "title": title,
-        "description": description
+        "description": description,
+        "feed_key": cache.feed_key(request, *group_scopes(request, slug)),
+        "feed_cache_timeout": settings.PAGE_CACHE_TIMEOUT
     }
 
     return render(request, "posts/group_list.html", context)
 
 
+@cache.conditional("profile", profile_scopes)
+@cache.cache_page_for_anonymous(
+    settings.PAGE_CACHE_TIMEOUT, "profile", profile_scopes, warm=True
+)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    post_list = author.posts.select_related("author")
+    post_list = author.posts.select_related("author", "group")
     template = "posts/profile.html"
-    page_obj = paginate_page(request, post_list)
+    page_obj = SimpleLazyObject(lambda: paginate_page(request, post_list))
     following = request.user.is_authenticated and Follow.objects.filter(
         user=request.user,
         author__username=username).exists()
     context = {
         "page_obj": page_obj,
         "author": author,
-        "following": following
+        "counters": SimpleLazyObject(lambda: counters.for_author(author)),
+        "following": following,
+        "feed_key": cache.feed_key(
+            request, *profile_scopes(request, username)
+        ),
+        "feed_cache_timeout": settings.PAGE_CACHE_TIMEOUT
     }
     return render(request, template, context)
 
 
+@cache.conditional("post", post_scopes)
+@cache.cache_page_for_anonymous(
+    settings.PAGE_CACHE_TIMEOUT, "post", post_scopes
+)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related("author", "group"), id=post_id
+    )
     form = CommentForm()
-    comments = post.comments.select_related("post")
+    comments = SimpleLazyObject(lambda: comments_page(request, post.id))
     context = {
         "post": post,
         "form": form,
-        "comments": comments
+        "comments": comments,
+        "comments_cursor": request.GET.get("after", ""),
+        "author_counters": SimpleLazyObject(
+            lambda: counters.for_author(post.author)
+        ),
+        "post_counters": SimpleLazyObject(lambda: counters.for_post(post)),
+        "post_key": cache.versions_key(*cache.post_scopes(
+            post.id, post.author.username, post.group and post.group.slug
+        )),
+        "post_cache_timeout": settings.PAGE_CACHE_TIMEOUT
     }
     return render(request, "posts/post_detail.html", context)
 
 
+@cache.conditional("comments", post_scopes)
+@cache.cache_page_for_anonymous(
+    settings.PAGE_CACHE_TIMEOUT, "comments", post_scopes
+)
+def post_comments(request, post_id):
+    get_object_or_404(Post.objects.only("id"), id=post_id)
+    context = {
+        "post_id": post_id,
+        "comments": comments_page(request, post_id),
+    }
+    return render(request, "posts/includes/comments.html", context)
+
+
+def search(request):
+    query = request.GET.get("q", "").strip()
+    page_obj = None
+    if query:
+        paginator = post_search.paginator_for(query, POSTS_PER_PAGE)
+        page_obj = get_page(request, paginator)
+    context = {
+        "query": query,
+        "page_obj": page_obj,
+        "extra_query": urlencode({"q": query}) + "&"
+    }
+    return render(request, "posts/search.html", context)
+
+
 @login_required
+@transaction.atomic
 def post_create(request):
     if request.method == "POST":
         form = PostForm(
@@ -73,6 +166,7 @@ def post_create(request):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            thumbnails.schedule(post.image)
             author = request.user.username
             return redirect("posts:profile", author)
         context = {
@@ -87,6 +181,7 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = PostForm(
@@ -103,13 +198,16 @@ def post_edit(request, post_id):
         return redirect("posts:post_detail", post_id=post_id)
     if request.method == "POST":
         if form.is_valid():
-            form.save()
+            post = form.save()
+            if "image" in form.changed_data:
+                thumbnails.schedule(post.image)
             return redirect("posts:post_detail", post_id=post_id)
         return render(request, "posts/create_post.html", context)
     return render(request, "posts/create_post.html", context)
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -123,8 +221,8 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginate_page(request, post_list)
+    paginator = TimelinePaginator(request.user, POSTS_PER_PAGE)
+    page_obj = get_page(request, paginator)
     context = {
         "page_obj": page_obj
     }
@@ -132,6 +230,7 @@ def follow_index(request):
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     follow = get_object_or_404(User, username=username)
     if request.user != follow:
@@ -140,9 +239,11 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    is_follower = Follow.objects.filter(user=request.user, author=author)
-    if is_follower.exists():
-        is_follower.delete()
+    for follow in Follow.objects.filter(user=request.user, author=author):
+        # сигнал удаления читает имена обоих пользователей: они уже есть
+        follow.user, follow.author = request.user, author
+        follow.delete()
     return redirect("posts:profile", username=username)
@@ -0,0 +1,318 @@
+"""
+Фоновый прогрев кеша самых посещаемых страниц.
+
+Адреса страниц, которые анонимы получают из кеша (лента, группы,
+профили), считаются в компактном частотном скетче (Count-Min), рядом
+держится короткий список самых частых. Фоновый поток процесса
+пересобирает эти страницы сразу после коммита, сменившего поколение
+(posts.cache.bump), и раз в CACHE_WARMER_INTERVAL секунд — те, чей
+мягкий срок истекает до следующего прохода. Пересборка идёт через то же
+представление и single_flight, что и у посетителя, поэтому свежие
+страницы пропускаются, а одну страницу два процесса одновременно
+не собирают.
+
+Список горячих страниц сохраняется в файл CACHE_WARMER_STATE: новый
+процесс после выкладки начинает с него, а команда warm_cache прогревает
+по нему кеш после очистки.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter
+from io import BytesIO
+from urllib.parse import unquote_to_bytes
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections, transaction
+from django.http import Http404
+from django.urls import resolve
+
+from core.metrics import CACHE_WARMER
+
+logger = logging.getLogger(__name__)
+
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+# после стольких попаданий на счётчик все счётчики делятся пополам,
+# чтобы вчерашние популярные страницы уступали сегодняшним
+SKETCH_SAMPLE = 10 * SKETCH_WIDTH
+
+
+class FrequencySketch:
+    """
+    Count-Min: depth строк по width счётчиков. Оценка частоты не меньше
+    настоящей и завышена тем реже, чем шире строки.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH,
+                 sample=SKETCH_SAMPLE):
+        self.width = width
+        self.rows = [array("L", [0]) * width for _ in range(depth)]
+        self.sample = sample
+        self.additions = 0
+
+    def indexes(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=8).digest()
+        first = int.from_bytes(digest[:4], "little")
+        second = int.from_bytes(digest[4:], "little") | 1
+        return [
+            (first + row * second) % self.width
+            for row in range(len(self.rows))
+        ]
+
+    def estimate(self, item):
+        return min(
+            row[index] for row, index in zip(self.rows, self.indexes(item))
+        )
+
+    def add(self, item, count=1):
+        """Учитывает item и возвращает новую оценку его частоты."""
+        indexes = self.indexes(item)
+        estimate = min(row[index] for row, index in zip(self.rows, indexes))
+        # консервативное обновление: растут только минимальные счётчики,
+        # так редкие адреса меньше завышают оценку частых соседей
+        for row, index in zip(self.rows, indexes):
+            if row[index] == estimate:
+                row[index] = estimate + count
+        self.additions += count
+        if self.additions >= self.sample:
+            self.age()
+        return min(row[index] for row, index in zip(self.rows, indexes))
+
+    def age(self):
+        for row in self.rows:
+            for index, value in enumerate(row):
+                row[index] = value >> 1
+        self.additions >>= 1
+
+
+class HotPages:
+    """Самые частые адреса по оценке скетча, не больше size штук."""
+
+    def __init__(self, size):
+        self.size = size
+        self.sketch = FrequencySketch()
+        self.top = {}
+        self._lock = threading.Lock()
+
+    def record(self, path, count=1):
+        with self._lock:
+            additions = self.sketch.additions
+            estimate = self.sketch.add(path, count)
+            if self.sketch.additions < additions:
+                # скетч состарился: оценки списка тоже
+                self.top = {
+                    key: value >> 1 for key, value in self.top.items()
+                }
+            if path in self.top or len(self.top) < self.size:
+                self.top[path] = estimate
+                return
+            coldest = min(self.top, key=self.top.get)
+            if estimate > self.top[coldest]:
+                del self.top[coldest]
+                self.top[path] = estimate
+
+    def paths(self):
+        """Адреса от самого частого к редкому."""
+        with self._lock:
+            return [
+                path for path, _ in sorted(
+                    self.top.items(), key=lambda item: (-item[1], item[0])
+                )
+            ]
+
+    def counts(self):
+        with self._lock:
+            return dict(self.top)
+
+
+_lock = threading.Lock()
+_hot = None
+_wake = None
+_stopping = None
+_worker = None
+
+
+def reset():
+    """Поток и список не переживают fork: потомок начинает с файла."""
+    global _lock, _hot, _wake, _stopping, _worker
+    _lock = threading.Lock()
+    _hot = None
+    _wake = threading.Event()
+    _stopping = threading.Event()
+    _worker = None
+
+
+reset()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset)
+
+
+def hot():
+    global _hot
+    with _lock:
+        if _hot is None:
+            _hot = HotPages(settings.CACHE_WARMER_PAGES)
+            for path, count in load().items():
+                _hot.record(path, count)
+        return _hot
+
+
+def load():
+    path = settings.CACHE_WARMER_STATE
+    if not path:
+        return {}
+    try:
+        with open(path) as stream:
+            return dict(json.load(stream))
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def save():
+    """Пишет список горячих страниц процесса в CACHE_WARMER_STATE."""
+    path = settings.CACHE_WARMER_STATE
+    if not path or _hot is None:
+        return
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(descriptor, "w") as stream:
+        json.dump(_hot.counts(), stream)
+    os.replace(temporary, path)
+
+
+def record(path):
+    """Учитывает анонимный запрос закешированной страницы."""
+    if not settings.CACHE_WARMER_PAGES:
+        return
+    hot().record(path)
+    start()
+
+
+def schedule():
+    """Будит прогрев после коммита текущей транзакции."""
+    if not settings.CACHE_WARMER_PAGES or _hot is None:
+        return
+    transaction.on_commit(wake)
+
+
+def wake():
+    start()
+    _wake.set()
+
+
+def start():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=work, name="cache-warmer", daemon=True
+            )
+            _worker.start()
+
+
+def stop():
+    """Останавливает поток прогрева и ждёт, пока он закончит проход."""
+    global _worker
+    with _lock:
+        worker, _worker = _worker, None
+    if worker is None:
+        return
+    _stopping.set()
+    _wake.set()
+    worker.join()
+    _stopping.clear()
+    _wake.clear()
+
+
+def work():
+    while True:
+        woken = _wake.wait(settings.CACHE_WARMER_INTERVAL)
+        _wake.clear()
+        if _stopping.is_set():
+            return
+        try:
+            if woken:
+                # сменилось поколение: собираем только пропавшие страницы
+                warm(hot().paths())
+            else:
+                save()
+                warm(hot().paths(), ahead=2 * settings.CACHE_WARMER_INTERVAL)
+        except Exception:
+            logger.exception("Не удалось прогреть кеш страниц")
+        finally:
+            # у потока своё соединение с базой
+            connections.close_all()
+
+
+def host():
+    for name in settings.ALLOWED_HOSTS:
+        if name != "*" and not name.startswith("."):
+            return name
+    return "localhost"
+
+
+def build_request(path, ahead):
+    path_info, _, query = path.partition("?")
+    request = WSGIRequest({
+        "REQUEST_METHOD": "GET",
+        # в WSGI путь приходит байтами, раскодированными как latin-1
+        "PATH_INFO": unquote_to_bytes(path_info).decode("iso-8859-1"),
+        "QUERY_STRING": query,
+        "SERVER_NAME": host(),
+        "SERVER_PORT": "80",
+        "wsgi.input": BytesIO(),
+        "wsgi.url_scheme": "http",
+    })
+    request.user = AnonymousUser()
+    request.warming_ahead = ahead
+    return request
+
+
+def warm_page(path, ahead=0):
+    """
+    Собирает страницу в кеш, если её там нет или её мягкий срок истекает
+    в ближайшие ahead секунд. Возвращает rendered, fresh или error.
+    """
+    try:
+        request = build_request(path, ahead)
+        match = resolve(request.path_info)
+        request.resolver_match = match
+        response = match.func(request, *match.args, **match.kwargs)
+    except Http404:
+        result = "error"
+    except Exception:
+        logger.exception("Не удалось прогреть %s", path)
+        result = "error"
+    else:
+        cached = getattr(request, "page_cache_result", None)
+        if response.status_code != 200 or cached is None:
+            result = "error"
+        elif cached in ("miss", "refresh"):
+            result = "rendered"
+        else:
+            result = "fresh"
+    CACHE_WARMER.inc(result=result)
+    return result
+
+
+def warm(paths, ahead=0):
+    """Прогревает страницы по очереди; возвращает число исходов."""
+    results = Counter()
+    started = time.monotonic()
+    for path in paths:
+        results[warm_page(path, ahead)] += 1
+    if results["rendered"] or results["error"]:
+        logger.info(
+            "Прогрев кеша за %.1f с: %s", time.monotonic() - started,
+            ", ".join(f"{name} {count}" for name, count in results.items()),
+        )
+    return results
@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -25,6 +29,9 @@ SECRET_KEY = 'ak$msjn-2mqf2f6z7oni@#-xn5h=ggl&r#=0qaj3qf&s)4nh9r'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# Запуск тестов: manage.py test или pytest
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
 ALLOWED_HOSTS = [
     'localhost',
     '127.0.0.1',
@@ -50,6 +57,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.SlowQueryMiddleware',
+    # Замеры выше сами к базе не обращаются. Бюджет стоит перед
+    # middleware Django, чтобы учитывать и запросы сессии из них.
+    'core.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,8 +100,13 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # transaction.atomic начинается с BEGIN IMMEDIATE (core.backends)
+        'ENGINE': 'core.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # сколько секунд запись ждёт блокировку базы
+            'timeout': 20,
+        },
     }
 }
 
@@ -138,8 +156,132 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Общий для всех процессов кеш: LRU в памяти процесса перед файлом SQLite
+# (core.cache). После migrate кеш очищается.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TwoLevelCache',
+        'LOCATION': os.environ.get(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'yatube-cache.sqlite3')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'L1_MAX_BYTES': 64 * 1024 * 1024,
+        },
+    }
+}
+if TESTING:
+    # У тестов свой кеш на время запуска: очистка после создания
+    # тестовой базы и cache.clear() в тестах не трогают кеш сервера,
+    # а записи прошлых запусков не попадают в следующие.
+    TEST_DIR = tempfile.mkdtemp(prefix='yatube-test-')
+    atexit.register(shutil.rmtree, TEST_DIR, True)
+    CACHES['default']['LOCATION'] = os.path.join(TEST_DIR, 'cache.sqlite3')
+    # Тестовая база в файле, а не в памяти: общий кеш SQLite в памяти
+    # не ждёт блокировок, и конкурирующие записи там не проверить.
+    DATABASES['default']['TEST'] = {
+        'NAME': os.path.join(TEST_DIR, 'test.sqlite3'),
     }
+# Авторы с таким числом подписчиков не раскладываются по лентам при
+# публикации: их посты подмешиваются в follow_index при чтении.
+TIMELINE_FANOUT_LIMIT = 1000
+# Обратно к раскладке автор переходит, потеряв ещё столько подписчиков:
+# у самого порога режим не переключается на каждой подписке.
+TIMELINE_FANOUT_MARGIN = 100
+# Потоков раскладки постов автора, вернувшегося ниже порога;
+# 0 — раскладывать сразу после коммита отписки.
+TIMELINE_WORKERS = 1
+# Анонимам страницы отдаются из кеша целиком, остальным — закешированная
+# лента со свежей шапкой. Устаревшие записи отсекаются сменой поколения
+# (posts.cache), поэтому срок жизни длинный.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Столько секунд после срока страница ещё хранится, чтобы отдавать её,
+# пока один запрос собирает новую (posts.cache.single_flight).
+PAGE_CACHE_GRACE = 60 * 10
+# Сколько самых посещаемых анонимами страниц ленты, групп и профилей
+# пересобирать в фоне (posts.warmer): после смены поколения и раз
+# в CACHE_WARMER_INTERVAL секунд — те, что скоро устареют. 0 отключает;
+# в тестах выключен, иначе поток рендерит страницы по тестовой базе.
+CACHE_WARMER_PAGES = 0 if TESTING else 50
+CACHE_WARMER_INTERVAL = 60
+# Список горячих страниц переживает перезапуск: с него начинают новые
+# процессы и команда warm_cache. None — не сохранять.
+CACHE_WARMER_STATE = os.environ.get(
+    'CACHE_WARMER_STATE',
+    os.path.join(tempfile.gettempdir(), 'yatube-hot-pages.json')
+)
+
+THUMBNAIL_BACKEND = 'posts.thumbnails.ThumbnailBackend'
+THUMBNAIL_KVSTORE = 'posts.thumbnails.KVStore'
+# Сколько сведений о превью держать в памяти каждого процесса
+THUMBNAIL_LOCAL_CACHE_SIZE = 1000
+# Варианты превью картинок постов: ширины ленты для srcset в исходном
+# формате и в WebP. Шаблоны и фоновая генерация берут параметры отсюда,
+# поэтому имена файлов превью совпадают.
+THUMBNAIL_PRESERVE_FORMAT = True
+THUMBNAIL_VARIANTS = {
+    '320x113': {'crop': 'center', 'upscale': True},
+    '640x226': {'crop': 'center', 'upscale': True},
+    '960x339': {'crop': 'center', 'upscale': True},
+    '320x113 webp': {'crop': 'center', 'upscale': True, 'format': 'WEBP'},
+    '640x226 webp': {'crop': 'center', 'upscale': True, 'format': 'WEBP'},
+    '960x339 webp': {'crop': 'center', 'upscale': True, 'format': 'WEBP'},
+}
+# Потоков генерации превью; 0 — создавать превью сразу после коммита
+THUMBNAIL_WORKERS = 2
+# Вариант превью, который не удалось создать (битый файл), столько
+# секунд не ставится в очередь снова
+THUMBNAIL_RETRY_AFTER = 60 * 60
+# Сколько запросов к базе может сделать страница, по имени маршрута.
+# При DEBUG превышение пишет в лог core.middleware.QueryBudgetMiddleware,
+# а тест posts.tests.test_query_budget падает. Страницы с картинками
+# постов учитывают ещё один запрос к хранилищу сведений о превью.
+QUERY_BUDGETS = {
+    'posts:home_page': 4,
+    'posts:search': 6,
+    'posts:group_posts': 5,
+    'posts:profile': 7,
+    'posts:post_detail': 8,
+    'posts:post_comments': 5,
+    'posts:post_create': 3,
+    'posts:post_edit': 5,
+    'posts:add_comment': 3,
+    'posts:follow_index': 5,
+    # подписка переводит автора, набравшего TIMELINE_FANOUT_LIMIT,
+    # в режим чтения, отписка проверяет, не пора ли обратно
+    'posts:profile_follow': 5,
+    'posts:profile_unfollow': 9,
+    'posts:api_index': 1,
+    'posts:api_group': 2,
+    'posts:api_profile': 2,
+    'posts:api_post': 1,
+    'posts:api_comments': 2,
 }
+# Столько одинаковых по форме запросов на странице — признак N+1
+QUERY_BUDGET_REPEATS = 3
+# Доля запросов, для которых время раскладывается по фазам
+# (SQL, шаблоны, кеш, превью) в заголовок Server-Timing и лог core.timing.
+# 0 отключает замер совсем.
+SERVER_TIMING_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+# Метрики для Prometheus (/metrics/). Процессы сбрасывают свои значения
+# в файлы METRICS_DIR не чаще раза в METRICS_FLUSH_INTERVAL секунд,
+# опрос складывает файлы всех процессов. None — только текущий процесс.
+METRICS_DIR = os.environ.get(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'yatube-metrics')
+)
+if TESTING:
+    # тесты не смешивают свои метрики с метриками сервера и прошлых запусков
+    METRICS_DIR = os.path.join(TEST_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 10
+# Файлы процессов, не обновлявшиеся столько секунд, опрос удаляет:
+# процесс считается завершённым, а его счётчики — сброшенными.
+METRICS_STALE_AFTER = 360 * METRICS_FLUSH_INTERVAL
+# Пишущий запрос дольше этого (в секундах) считается ждавшим блокировку
+METRICS_LOCK_WAIT_THRESHOLD = 0.05
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+# Запросы к базе дольше стольких секунд пишутся в лог core.slowlog
+# с планом выполнения и стеком; None отключает замер. Один и тот же
+# по форме запрос пишется не чаще раза в SLOW_QUERY_REPEAT_INTERVAL.
+SLOW_QUERY_THRESHOLD = 0.1
+SLOW_QUERY_REPEAT_INTERVAL = 600